@@ -0,0 +1,97 @@
+"""Inputs shared by the benchmarks, built from the recorded payloads in tests/raw_data."""
+
+import copy
+import json
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, List
+
+from src.bbot.constants import Interval
+from src.bbot.downloader import Downloader
+from src.models.database import DataBase
+from src.models.options import Options
+from src.models.symbol import Symbol
+from src.models.window import Window
+
+RAW_DATA  = Path(__file__).resolve().parent.parent / "tests" / "raw_data"
+INTERVALS = (
+    Interval.SECOND_2,
+    Interval.MINUTE_1,
+    Interval.MINUTE_3,
+    Interval.MINUTE_5,
+    Interval.MINUTE_15,
+    Interval.HOUR_1,
+)
+
+
+def load(name: str) -> Any:
+    return json.loads((RAW_DATA / f"{name}.json").read_text())
+
+
+def kline_messages(n: int) -> list:
+    """A continuous stream of `n` kline events, two seconds apart.
+
+    Every event is based on a recorded one. Volumes and trade counts grow
+    within each minute, like they do on the exchange.
+    """
+
+    template = [m["data"] for m in load("kline_1m")]
+    base     = template[0]["k"]
+    first    = template[0]["E"] // 60000 * 60000
+    messages = []
+    for j in range(n):
+        m    = copy.deepcopy(template[j % len(template)])
+        k    = m["k"]
+        e    = first + 2000 * j
+        tick = (e % 60000) // 2000
+        m["E"] = e
+        k["t"] = e // 60000 * 60000
+        k["T"] = k["t"] + 59999
+        k["x"] = tick == 29
+        for f in ("v", "q", "V", "Q"):
+            k[f] = f"{Decimal(base[f]) + tick * Decimal('0.1'):.8f}"
+        k["n"] = base["n"] + 17 * tick
+        messages.append(m)
+    return messages
+
+
+def history_pages(n: int, page_size: int = 1000) -> List[list]:
+    """`n` continuous 1m historical klines based on a recorded one, in pages like the api returns them."""
+
+    first = load("hist_candles")[0]
+    rows  = []
+    for i in range(n):
+        row     = list(first)
+        row[0] += i * 60000
+        row[6] += i * 60000
+        row[4]  = f"{float(first[4]) + (i % 50) * 0.01:.8f}"
+        rows.append(row)
+    return [rows[i:i + page_size] for i in range(0, n, page_size)]
+
+
+def recorded_messages(name: str, n: int) -> list:
+    """`n` stream messages, cycling through the recordings in `name`.json."""
+
+    recorded = load(name)
+    return [copy.deepcopy(recorded[i % len(recorded)]) for i in range(n)]
+
+
+def create_db(
+    symbol:        str,
+    fixed_point:   bool = False,
+    window_length: int  = 1000,
+    intervals:     tuple = INTERVALS,
+    latency_stats: bool = False,
+) -> DataBase:
+    db    = DataBase(options=Options(fixed_point=fixed_point, latency_stats=latency_stats))
+    scale = None
+    if fixed_point:
+        scale = Downloader.parse_scales(load("exchange_info"))[symbol]
+    db.symbols[symbol] = Symbol(
+        name    = symbol,
+        scale   = scale,
+        windows = {
+            iv: Window(interval=iv, window_length=window_length, scale=scale) for iv in intervals
+        },
+    )
+    return db
@@ -0,0 +1,119 @@
+"""Measures the per-message routing overhead of Pipeline.process.
+
+Compares the routing tables that Pipeline builds once against the previous
+implementation, which built two closures and two dicts for every message.
+Handlers do nothing, so only routing is measured.
+
+Run from the root of the project:
+
+    python -m benchmarks.dispatch [n_messages]
+"""
+
+import sys
+import time
+from typing import Any
+
+from src.bbot.constants import ContentType, Interval, InTimeFrame
+from src.bbot.pipeline.pipe import Pipeline
+from src.models.database import DataBase
+from src.models.options import Options
+from src.models.symbol import Symbol
+from src.models.window import Window
+
+INTERVALS = (
+    Interval.SECOND_2,
+    Interval.MINUTE_1,
+    Interval.MINUTE_3,
+    Interval.MINUTE_5,
+    Interval.MINUTE_15,
+    Interval.HOUR_1,
+)
+
+
+class NullPipe(Pipeline):
+    """Payload is a close time in epoch ms, handlers leave the window as it is."""
+
+    def get_close_time(self, payload: int) -> int:
+        return payload
+
+    def first(self, payload: Any, window: Window) -> Window:
+        return window
+
+    previous = current = nexxt = first
+
+
+class LegacyNullPipe(NullPipe):
+    """NullPipe with the routing as it was before the tables were built once."""
+
+    def process(self, symbol, interval, contenttype, payload, db):
+        self.n_items_processed.update([contenttype])
+
+        def one_window():
+            db.symbols[symbol].windows[interval] = self.process_window(
+                contenttype, payload, db.symbols[symbol].windows[interval]
+            )
+
+        def all_windows():
+            for iv, w in db.symbols[symbol].windows.items():
+                db.symbols[symbol].windows[iv] = self.process_window(contenttype, payload, w)
+
+        apply_on_windows = {
+            ContentType.CANDLE_HISTORY: one_window,
+            ContentType.CANDLE_STREAM:  all_windows,
+        }
+        apply_on_windows[contenttype]()
+        return db
+
+    def process_window(self, contenttype, payload, window):
+        if not window._history_downloaded and not contenttype == ContentType.CANDLE_HISTORY:
+            pass
+
+        tf = {
+            InTimeFrame.FIRST: self.first,
+            InTimeFrame.PREVIOUS: self.previous,
+            InTimeFrame.CURRENT: self.current,
+            InTimeFrame.NEXT: self.nexxt,
+            InTimeFrame.OTHER: self.data_leakage_error,
+        }
+
+        close_time = self.get_close_time(payload)
+        in_tf = self.which_timeframe(close_time, window)
+
+        return tf[in_tf](payload, window)
+
+
+def create_db(symbol: str) -> DataBase:
+    db = DataBase(options=Options())
+    db.symbols[symbol] = Symbol(
+        name    = symbol,
+        windows = {iv: Window(interval=iv, window_length=10) for iv in INTERVALS},
+    )
+    for w in db.symbols[symbol].windows.values():
+        w.timeframes.append_row(0, 1999)
+    return db
+
+
+def ns_per_message(pipe: Pipeline, contenttype: ContentType, n: int) -> float:
+    db      = create_db("btcusdt")
+    process = pipe.process
+    start   = time.perf_counter_ns()
+    for _ in range(n):
+        process("btcusdt", Interval.MINUTE_1, contenttype, 1000, db)
+    return (time.perf_counter_ns() - start) / n
+
+
+def main(n_messages: int = 200000) -> dict:
+    results = dict()
+    for contenttype in (ContentType.CANDLE_HISTORY, ContentType.CANDLE_STREAM):
+        legacy = min(ns_per_message(LegacyNullPipe(), contenttype, n_messages) for _ in range(3))
+        tables = min(ns_per_message(NullPipe(), contenttype, n_messages) for _ in range(3))
+        results[contenttype.value] = (legacy, tables)
+        print(f"{contenttype.value}")
+        print(f"  per-message closures and dicts: {legacy:8.0f} ns")
+        print(f"  routing tables built once:      {tables:8.0f} ns")
+        print(f"  overhead saved:                 {legacy - tables:8.0f} ns ({legacy / tables:.2f}x)")
+    return results
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,374 @@
+"""Benchmark suite for the ingestion hot path.
+
+Every stage is fed with payloads built from the recordings in tests/raw_data and
+runs three times on fresh state: once for throughput, once with a timer around
+every message for latency percentiles, and once under tracemalloc for memory.
+
+Stages:
+    parse.*       raw exchange payload -> parsed object
+    insert.*      parsed object -> windows, through the pipelines
+    feature.*     feature functions on the windows after every insert
+    end_to_end.*  raw stream message -> windows, as a consumer shard does it
+
+Results are printed and saved as JSON, so runs can be compared.
+Run from the root of the project:
+
+    python -m benchmarks.ingest [-n 20000] [--stages parse,insert] [--output results.json]
+    python -m benchmarks.ingest --compare old.json new.json
+"""
+
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.bbot.constants import ContentType, Interval
+from src.bbot.consumers import ShardConsumer
+from src.bbot.downloader import Downloader
+from src.bbot.features import FeatureEngine, ema
+from src.bbot.pipeline import HistoricalCandlePipe, StreamCandlePipe
+from src.models.candle import Candle
+from src.models.ringbuffer import ms_to_datetime
+from src.models.ticker import MiniTicker, Ticker
+from src.models.trade import AggTrade, Trade
+
+from .common import create_db, history_pages, kline_messages, load, recorded_messages
+
+RESULTS     = Path(__file__).resolve().parent / "results"
+PERCENTILES = (50, 90, 99, 99.9)
+SYMBOL      = "btcusdt"
+
+# items, run(item) which is measured, before(item) which runs first and is not measured
+Setup = Tuple[List[Any], Callable[[Any], Any], Optional[Callable[[Any], Any]]]
+
+
+# Parsers for streams that have a model but no pipeline yet
+
+def parse_aggtrade(msg: dict) -> AggTrade:
+    d = msg["data"]
+    return AggTrade(
+        trade_time     = ms_to_datetime(d["T"]),
+        aggtrade_id    = d["a"],
+        first_trade_id = d["f"],
+        last_trade_id  = d["l"],
+        price          = d["p"],
+        quantity       = d["q"],
+        buyer_is_maker = d["m"],
+    )
+
+
+def parse_trade(msg: dict) -> Trade:
+    d = msg["data"]
+    return Trade(
+        trade_time      = ms_to_datetime(d["T"]),
+        trade_id        = d["t"],
+        buyer_order_id  = d["b"],
+        seller_order_id = d["a"],
+        price           = d["p"],
+        quantity        = d["q"],
+        buyer_is_maker  = d["m"],
+    )
+
+
+def parse_miniticker(msg: dict) -> MiniTicker:
+    d = msg["data"]
+    return MiniTicker(
+        event_time            = ms_to_datetime(d["E"]),
+        current_price         = d["c"],
+        price_24_hours_ago    = d["o"],
+        high_price_last_24h   = d["h"],
+        low_price_last_24h    = d["l"],
+        base_volume_last_24h  = d["v"],
+        quote_volume_last_24h = d["q"],
+    )
+
+
+def parse_ticker(msg: dict) -> Ticker:
+    d = msg["data"]
+    return Ticker(
+        event_time                    = ms_to_datetime(d["E"]),
+        current_price                 = d["c"],
+        price_24_hours_ago            = d["o"],
+        high_price_last_24h           = d["h"],
+        low_price_last_24h            = d["l"],
+        weighted_avg_price_last_24h   = d["w"],
+        price_change_last_24h         = d["p"],
+        price_change_last_24h_percent = d["P"],
+        base_volume_last_24h          = d["v"],
+        quote_volume_last_24h         = d["q"],
+        n_trades_last_24h             = d["n"],
+    )
+
+
+def parse_depth(scale) -> Callable[[dict], tuple]:
+    # Depth updates to scaled int64 (price, quantity) arrays.
+    def parse(msg: dict) -> tuple:
+        d      = msg["data"]
+        levels = []
+        for side in (d["b"], d["a"]):
+            side = np.asarray(side, dtype=str).reshape(-1, 2)
+            levels.append((scale.prices(side[:, 0]), scale.quantities(side[:, 1])))
+        return tuple(levels)
+    return parse
+
+
+# Sample features, recomputed over the whole window on every tick
+
+def sample_features(windows) -> dict:
+    out = dict()
+    for iv, w in windows.items():
+        if not len(w.timeframes):
+            continue
+        close  = w.timeframes.column("close_price")
+        base   = w.timeframes.column("base_volume")
+        quote  = w.timeframes.column("quote_volume")
+        out[iv] = (close[-20:].mean(), quote.sum() / base.sum() if base.any() else 0.0)
+    return out
+
+
+# Stages
+
+def parse_kline(n: int) -> Setup:
+    return kline_messages(n), Candle.parse_kline, None
+
+
+def parse_kline_validated(n: int) -> Setup:
+    return kline_messages(n), lambda m: Candle.parse_kline(m, True), None
+
+
+def parse_history_row(n: int) -> Setup:
+    rows = [row for page in history_pages(n) for row in page]
+    return rows, Candle.parse_historical_candle_fast, None
+
+
+def parse_history_page(n: int) -> Setup:
+    return history_pages(n), HistoricalCandlePipe.parse_block, None
+
+
+def parse_stream(name: str, parse: Callable) -> Callable[[int], Setup]:
+    def setup(n: int) -> Setup:
+        return recorded_messages(name, n), parse, None
+    return setup
+
+
+def parse_depth_stage(n: int) -> Setup:
+    scale = Downloader.parse_scales(load("exchange_info"))[SYMBOL]
+    return recorded_messages("depth", n), parse_depth(scale), None
+
+
+def insert_history_page(n: int) -> Setup:
+    db   = create_db(SYMBOL, window_length=0, intervals=(Interval.MINUTE_1,))
+    pipe = HistoricalCandlePipe()
+    run  = lambda page: pipe.process_block(SYMBOL, Interval.MINUTE_1, page, db)
+    return history_pages(n), run, None
+
+
+def insert_stream(n: int) -> Setup:
+    db     = create_db(SYMBOL)
+    pipe   = StreamCandlePipe()
+    klines = [Candle.parse_kline(m) for m in kline_messages(n)]
+    run    = lambda k: pipe.process(SYMBOL, "*", ContentType.CANDLE_STREAM, k, db)
+    return klines, run, None
+
+
+def feature_sample(n: int) -> Setup:
+    db      = create_db(SYMBOL)
+    pipe    = StreamCandlePipe()
+    windows = db.symbols[SYMBOL].windows
+    klines  = [Candle.parse_kline(m) for m in kline_messages(n)]
+    before  = lambda k: pipe.process(SYMBOL, "*", ContentType.CANDLE_STREAM, k, db)
+    return klines, lambda k: sample_features(windows), before
+
+
+def feature_engine(n: int) -> Setup:
+    db      = create_db(SYMBOL)
+    pipe    = StreamCandlePipe()
+    windows = db.symbols[SYMBOL].windows
+    engine  = FeatureEngine({ema(20), ema(50), ema(20, "base_volume")})
+    klines  = [Candle.parse_kline(m) for m in kline_messages(n)]
+    before  = lambda k: pipe.process(SYMBOL, "*", ContentType.CANDLE_STREAM, k, db)
+    return klines, lambda k: engine.update(SYMBOL, windows), before
+
+
+def end_to_end_stream(n: int, latency_stats: bool = False) -> Setup:
+    db = create_db(SYMBOL, latency_stats=latency_stats)
+    for w in db.symbols[SYMBOL].windows.values():
+        w._history_downloaded = True
+    consumer = ShardConsumer(db)
+    items    = [(SYMBOL, "*", ContentType.CANDLE_STREAM, m) for m in kline_messages(n)]
+    if latency_stats:
+        # As if every item was queued just before it is processed
+        return items, lambda item: consumer.process((*item, time.perf_counter_ns())), None
+    return items, consumer.process, None
+
+
+STAGES: Dict[str, Callable[[int], Setup]] = {
+    "parse.kline":              parse_kline,
+    "parse.kline_validated":    parse_kline_validated,
+    "parse.history_row":        parse_history_row,
+    "parse.history_page":       parse_history_page,
+    "parse.aggtrade":           parse_stream("aggTrade", parse_aggtrade),
+    "parse.trade":              parse_stream("trade", parse_trade),
+    "parse.miniticker":         parse_stream("miniTicker", parse_miniticker),
+    "parse.ticker":             parse_stream("ticker", parse_ticker),
+    "parse.depth":              parse_depth_stage,
+    "insert.history_page":      insert_history_page,
+    "insert.stream":            insert_stream,
+    "feature.sample":           feature_sample,
+    "feature.engine":           feature_engine,
+    "end_to_end.stream":        end_to_end_stream,
+    "end_to_end.stream_timed":  lambda n: end_to_end_stream(n, latency_stats=True),
+}
+
+# Stages that get one item per 1000 messages
+PAGED = {"parse.history_page", "insert.history_page"}
+
+
+# Measurement
+
+def throughput(setup: Setup) -> float:
+    items, run, before = setup
+    if before is None:
+        start = time.perf_counter_ns()
+        for item in items:
+            run(item)
+        elapsed = time.perf_counter_ns() - start
+    else:
+        elapsed = 0
+        for item in items:
+            before(item)
+            start    = time.perf_counter_ns()
+            run(item)
+            elapsed += time.perf_counter_ns() - start
+    return len(items) / (elapsed / 1e9)
+
+
+def latencies(setup: Setup) -> np.ndarray:
+    items, run, before = setup
+    out   = np.empty(len(items), dtype=np.int64)
+    clock = time.perf_counter_ns
+    for i, item in enumerate(items):
+        if before is not None:
+            before(item)
+        start  = clock()
+        run(item)
+        out[i] = clock() - start
+    return out
+
+
+def memory(setup: Setup) -> Tuple[int, int]:
+    """Returns (peak, retained) bytes allocated while running the stage."""
+
+    items, run, before = setup
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    for item in items:
+        if before is not None:
+            before(item)
+        run(item)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - baseline, current - baseline
+
+
+def measure(name: str, n: int) -> dict:
+    stage   = STAGES[name]
+    n_items = max(1, n // 1000) if name in PAGED else n
+    lat     = latencies(stage(n))
+    peak, retained = memory(stage(n))
+    return {
+        "messages":          n_items,
+        "throughput":        throughput(stage(n)),
+        "latency_ns":        {
+            **{f"p{p:g}": float(np.percentile(lat, p)) for p in PERCENTILES},
+            "mean": float(lat.mean()),
+            "max":  float(lat.max()),
+        },
+        "peak_memory_bytes": peak,
+        "retained_bytes":    retained,
+    }
+
+
+def metadata(n: int) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time":     datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit":   commit,
+        "python":   platform.python_version(),
+        "numpy":    np.__version__,
+        "platform": platform.platform(),
+        "n":        n,
+    }
+
+
+def run(n: int = 20000, stages: Optional[List[str]] = None) -> dict:
+    names   = [s for s in STAGES if not stages or any(s.startswith(p) for p in stages)]
+    results = {"meta": metadata(n), "stages": dict()}
+    print(f"{'stage':<24}{'msg/s':>12}{'p50 us':>10}{'p99 us':>10}{'p99.9 us':>10}{'peak KiB':>11}")
+    for name in names:
+        r = measure(name, n)
+        results["stages"][name] = r
+        lat = r["latency_ns"]
+        print(
+            f"{name:<24}{r['throughput']:>12,.0f}{lat['p50'] / 1e3:>10.1f}"
+            f"{lat['p99'] / 1e3:>10.1f}{lat['p99.9'] / 1e3:>10.1f}{r['peak_memory_bytes'] / 1024:>11,.0f}"
+        )
+    return results
+
+
+def compare(old: dict, new: dict) -> None:
+    """Prints throughput and p99 of two runs side by side."""
+
+    print(f"old: {old['meta']['commit']} {old['meta']['time']}")
+    print(f"new: {new['meta']['commit']} {new['meta']['time']}")
+    print(f"{'stage':<24}{'msg/s old':>12}{'msg/s new':>12}{'speedup':>9}{'p99 old':>10}{'p99 new':>10}")
+    for name, r in new["stages"].items():
+        if name not in old["stages"]:
+            continue
+        o = old["stages"][name]
+        print(
+            f"{name:<24}{o['throughput']:>12,.0f}{r['throughput']:>12,.0f}"
+            f"{r['throughput'] / o['throughput']:>8.2f}x"
+            f"{o['latency_ns']['p99'] / 1e3:>10.1f}{r['latency_ns']['p99'] / 1e3:>10.1f}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=20000, help="messages per stage")
+    parser.add_argument("--stages", help="comma separated stage name prefixes, like parse,insert")
+    parser.add_argument("--output", type=Path, help="where to save the results")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*(json.loads(p.read_text()) for p in args.compare))
+        return
+
+    results = run(args.n, args.stages.split(",") if args.stages else None)
+    output  = args.output
+    if output is None:
+        RESULTS.mkdir(exist_ok=True)
+        output = RESULTS / f"ingest-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.write_text(json.dumps(results, indent=2))
+    print(f"saved to {output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,53 @@
+"""Counts how often a kline message is parsed on its way through StreamCandlePipe.
+
+Replays a stream built from tests/raw_data/kline_1m.json through a
+symbol with several windows and reports parses per message.
+
+Run from the root of the project:
+
+    python -m benchmarks.parse_count [--fixed-point]
+"""
+
+import sys
+import time
+
+from src.bbot.constants import ContentType
+from src.bbot.pipeline import StreamCandlePipe
+from src.models.candle import Candle
+
+from .common import INTERVALS, create_db, kline_messages
+
+
+def main(n_messages: int = 1000, fixed_point: bool = False) -> None:
+    messages = kline_messages(n_messages)
+    db       = create_db("btcusdt", fixed_point)
+    scale    = db.symbols["btcusdt"].scale
+    pipeline = StreamCandlePipe()
+
+    n_parsed = 0
+    parse    = Candle.parse_candle_fast
+
+    def counting_parse(*args):
+        nonlocal n_parsed
+        n_parsed += 1
+        return parse(*args)
+
+    Candle.parse_candle_fast = staticmethod(counting_parse)
+    try:
+        start = time.perf_counter()
+        for m in messages:
+            kline = Candle.parse_kline(m, False, scale)
+            pipeline.process(kline.symbol, "*", ContentType.CANDLE_STREAM, kline, db)
+        elapsed = time.perf_counter() - start
+    finally:
+        Candle.parse_candle_fast = staticmethod(parse)
+
+    print(f"fixed point:         {fixed_point}")
+    print(f"windows:             {len(INTERVALS)}")
+    print(f"messages:            {len(messages)}")
+    print(f"parses per message:  {n_parsed / len(messages):.2f}")
+    print(f"messages per second: {len(messages) / elapsed:,.0f}")
+
+
+if __name__ == "__main__":
+    main(fixed_point="--fixed-point" in sys.argv)
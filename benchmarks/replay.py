@@ -0,0 +1,99 @@
+"""Replays a recorded stream log through the stream shards and consumers.
+
+The log is written by FrameWriter, see `Options.record_path`, for example:
+
+    python -m benchmarks.stress --symbols 500 --speed 20 --seconds 30 --record frames.jsonl.gz
+
+Windows start empty and are marked as downloaded, so every kline frame
+goes through the pipelines. Reports the time from the first frame until
+the consumers inserted the last one.
+
+Run from the root of the project:
+
+    python -m benchmarks.replay frames.jsonl.gz [--speed 10] [--consumer-shards 2]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from typing import List, Optional
+
+from src.bbot.constants import ConsumerMode, ContentType, QueuePolicy
+from src.bbot.consumers import ConsumerPool
+from src.bbot.recorder import ReplaySocketManager, read_frames
+from src.bbot.streams import StreamShard, shard_streams, stream_symbol
+from src.models.database import DataBase
+from src.models.options import Options
+from src.models.symbol import Symbol
+from src.models.window import Window
+
+from .stress import INTERVALS
+
+
+def recorded_streams(path: str) -> List[str]:
+    streams = set()
+    for _, frame in read_frames(path):
+        if isinstance(frame, dict) and "stream" in frame:
+            streams.add(frame["stream"])
+    return sorted(streams)
+
+
+def create_db(streams: List[str], window_length: int) -> DataBase:
+    db = DataBase(options=Options(window_length=window_length))
+    for s in {stream_symbol(s) for s in streams}:
+        db.symbols[s] = Symbol(
+            name    = s,
+            windows = {iv: Window(interval=iv, window_length=window_length) for iv in INTERVALS},
+        )
+        for w in db.symbols[s].windows.values():
+            w._history_downloaded = True
+    db.selected_symbols = set(db.symbols)
+    return db
+
+
+async def run(args: argparse.Namespace) -> dict:
+    streams = recorded_streams(args.log)
+    db      = create_db(streams, args.window_length)
+    manager = ReplaySocketManager(args.log, args.speed)
+    pool    = ConsumerPool(
+        db, args.consumer_shards, ConsumerMode(args.mode), args.queue_size, QueuePolicy(args.policy)
+    )
+    print(f"{len(streams)} streams of {len(db.symbols)} symbols")
+
+    start   = time.perf_counter()
+    workers = pool.start()
+    shards  = [
+        asyncio.create_task(StreamShard(i, s, ContentType.CANDLE_STREAM).run(pool, manager, False))
+        for i, s in enumerate(shard_streams(streams, args.stream_shards))
+    ]
+    await manager.finished.wait()
+    for t in shards:
+        t.cancel()
+    await asyncio.get_running_loop().run_in_executor(None, pool.stop, 60)
+    await asyncio.gather(*shards, *workers, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    results = {"frames": manager.n_frames, "seconds": elapsed, "rate": manager.n_frames / elapsed}
+    print(f"replayed {results['frames']:,} frames in {elapsed:.2f}s, {results['rate']:,.0f} frames/s")
+    print(f"queues: {pool.stats()}")
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log")
+    parser.add_argument("--speed", type=float, default=0.0, help="times the recorded rate, 0 is unlimited")
+    parser.add_argument("--window-length", type=int, default=100)
+    parser.add_argument("--stream-shards", type=int, default=1)
+    parser.add_argument("--consumer-shards", type=int, default=1)
+    parser.add_argument("--mode", default=ConsumerMode.TASK.value, choices=[m.value for m in ConsumerMode])
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--policy", default=QueuePolicy.BLOCK.value, choices=[p.value for p in QueuePolicy])
+    args = parser.parse_args(argv)
+    args.speed = args.speed or None
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,133 @@
+"""Load test of the full candle ingestion on a simulated market.
+
+Runs the tasks of `Candle.get_tasks()` against SimulatedClient and
+SimulatedSocketManager instead of Binance: history download, stream
+shards and consumers. At `--speed 1` every symbol sends a kline update
+every 2 seconds, like Binance does, so `--speed 50` is 50 times the real load.
+
+Reports the rate at which the streams delivered messages and the rate at which
+the consumers inserted them into the windows, once per second and on average.
+When the consumers can not keep up, the stream rate drops below the target
+(queue policy BLOCK) or messages are dropped (DROP_OLDEST, CONFLATE).
+
+Run from the root of the project:
+
+    python -m benchmarks.stress [--symbols 2000] [--speed 50] [--seconds 20] [--record frames.jsonl.gz]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from src.bbot.constants import ConsumerMode, Interval, QueuePolicy, Stream
+from src.bbot.simulator import SimulatedClient, SimulatedSocketManager
+from src.models.candle import Candle
+from src.models.database import DataBase
+from src.models.options import Options
+from src.models.symbol import Symbol
+from src.models.window import Window
+
+INTERVALS = (Interval.SECOND_2, Interval.MINUTE_1, Interval.MINUTE_5, Interval.HOUR_1)
+
+
+def create_db(options: Options, symbols: List[str]) -> DataBase:
+    db = DataBase(options=options)
+    db.selected_symbols = {s.lower() for s in symbols}
+    for s in db.selected_symbols:
+        db.symbols[s] = Symbol(
+            name    = s,
+            windows = {
+                iv: Window(interval=iv, window_length=options.window_length)
+                for iv in options.window_intervals
+            },
+        )
+    return db
+
+
+def n_inserted(db: DataBase) -> int:
+    # Every stream message adds one 2s timeframe, once the history is in.
+    return sum(s.windows[Interval.SECOND_2].timeframes.n_appended for s in db.symbols.values())
+
+
+def history_done(db: DataBase) -> bool:
+    return all(
+        w._history_downloaded
+        for s in db.symbols.values() for iv, w in s.windows.items() if iv != Interval.SECOND_2
+    )
+
+
+async def run(args: argparse.Namespace) -> dict:
+    options = Options(
+        window_length        = args.window_length,
+        request_weight_limit = 10**9,
+        stream_shards        = args.stream_shards,
+        consumer_shards      = args.consumer_shards,
+        consumer_mode        = ConsumerMode(args.mode),
+        queue_size           = args.queue_size,
+        queue_policy         = QueuePolicy(args.policy),
+    ).copy(update={
+        "window_intervals": set(INTERVALS),
+        "streams":          {Stream.CANDLE},
+        "record_path":      args.record,
+    })
+    client  = SimulatedClient(args.symbols)
+    manager = SimulatedSocketManager(client, speed=args.speed)
+    db      = create_db(options, client.symbols)
+    target  = args.symbols * (args.speed or 0) * 1000 / manager.step_ms
+
+    start = time.perf_counter()
+    tasks = Candle.get_tasks(options, client, manager, db, False)
+    while not history_done(db):
+        await asyncio.sleep(0.1)
+    history = time.perf_counter() - start
+    print(f"history of {args.symbols} symbols in {history:.1f}s, {client.n_requests} requests")
+    if target:
+        print(f"target stream rate {target:,.0f} msg/s")
+
+    print(f"{'s':>4}{'streamed msg/s':>16}{'inserted msg/s':>16}")
+    streamed0, inserted0, t0 = manager.n_messages, n_inserted(db), time.perf_counter()
+    last = (streamed0, inserted0, t0)
+    for second in range(1, args.seconds + 1):
+        await asyncio.sleep(1)
+        now = (manager.n_messages, n_inserted(db), time.perf_counter())
+        dt  = now[2] - last[2]
+        print(f"{second:>4}{(now[0] - last[0]) / dt:>16,.0f}{(now[1] - last[1]) / dt:>16,.0f}")
+        last = now
+
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    elapsed = last[2] - t0
+    results = {
+        "history_seconds": history,
+        "target":          target,
+        "streamed":        (last[0] - streamed0) / elapsed,
+        "inserted":        (last[1] - inserted0) / elapsed,
+    }
+    print(f"average: streamed {results['streamed']:,.0f} msg/s, inserted {results['inserted']:,.0f} msg/s")
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=2000)
+    parser.add_argument("--speed", type=float, default=10.0, help="times the real message rate, 0 is unlimited")
+    parser.add_argument("--seconds", type=int, default=20)
+    parser.add_argument("--window-length", type=int, default=100)
+    parser.add_argument("--stream-shards", type=int, default=2)
+    parser.add_argument("--consumer-shards", type=int, default=1)
+    parser.add_argument("--mode", default=ConsumerMode.TASK.value, choices=[m.value for m in ConsumerMode])
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--policy", default=QueuePolicy.BLOCK.value, choices=[p.value for p in QueuePolicy])
+    parser.add_argument("--record", type=Path, help="append the stream frames to this log")
+    args = parser.parse_args(argv)
+    args.speed = args.speed or None
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
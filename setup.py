@@ -17,8 +17,13 @@ setup(
     package_dir={"": "src"},
     packages=find_packages(where="src"),
     install_requires=[
+        "numpy",
         "python-binance",
         "typeguard",
     ],
+    extras_require={
+        "arrow":  ["pyarrow"],
+        "pandas": ["pandas"],
+    },
     zip_safe=False,
 )
@@ -1,3 +1,5 @@
+from .constants import ContentType
+from .metrics import MetricsServer
 from .options import Options
 from .asyncbot import _AsyncBot
 
@@ -7,13 +9,28 @@ class Bot:
 
     # Public
     def stop(self) -> None:
-        pass
+        if self._metrics is not None:
+            self._metrics.stop()
+
+    def latency(self, symbol: str = None, stream: ContentType = None) -> dict:
+        """Latency summary per stage, see LatencyStats.summary().
+        Empty unless the bot was created with `Options(latency_stats=True)`.
+        """
+        stats = self._bot.db.latency
+        return stats.summary(symbol, stream) if stats is not None else dict()
 
     # Internal
     def __init__(self, options: Options) -> None:
-        self.options = options
+        self.options  = options
+        self._metrics = None
         self._create_asyncbot(options)
+        self._start_metrics(options)
 
     def _create_asyncbot(self, options: Options) -> None:
         """Process fork or thread spawn here..."""
         self._bot = _AsyncBot(options)
+
+    def _start_metrics(self, options: Options) -> None:
+        """Serves prometheus metrics in a thread of its own, see MetricsServer."""
+        if options.metrics_port is not None:
+            self._metrics = MetricsServer(self._bot.db, options.metrics_port).start()
@@ -24,6 +24,32 @@ class Stream(str, Enum):
     TRADE      = "TRADE"
 
 
+class ConsumerMode(str, Enum):
+    """Single choice saved in options.consumer_mode. How consumer shards run."""
+
+    TASK       = "TASK"
+    THREAD     = "THREAD"
+    PROCESS    = "PROCESS"
+
+
+class LatencyStage(str, Enum):
+    """Stages of an item that bbot keeps latency histograms of, see bbot/latency.py."""
+
+    QUEUE      = "QUEUE"       # waiting in the consumer queue
+    PARSE      = "PARSE"       # raw message to parsed kline
+    INSERT     = "INSERT"      # pipeline insert in all windows
+    FEATURE    = "FEATURE"     # feature calculation
+    DELAY      = "DELAY"       # exchange event time to processed
+
+
+class QueuePolicy(str, Enum):
+    """Single choice saved in options.queue_policy. What a full queue does with new items."""
+
+    BLOCK       = "BLOCK"
+    DROP_OLDEST = "DROP_OLDEST"
+    CONFLATE    = "CONFLATE"
+
+
 class Interval(str, Enum):
     """Multiple choice saved in options.intervals."""
 
@@ -47,16 +73,42 @@ class Interval(str, Enum):
 class ContentType(str, Enum):
     """Different types of content the pipeline can process."""
 
-    CANDLE_STREAM:  "CANDLE_STREAM"
-    CANDLE_HISTORY: "CANDLE_HISTORY"
+    CANDLE_STREAM        = "CANDLE_STREAM"
+    CANDLE_HISTORY       = "CANDLE_HISTORY"
+    CANDLE_HISTORY_BLOCK = "CANDLE_HISTORY_BLOCK"
 
 class InTimeFrame(str, Enum):
     """Used in pipeline. 
     Describes in which timeframe a new piece of content should be placed or updated.
     """
 
-    FIRST:    "FIRST"
-    PREVIOUS: "PREVIOUS"
-    CURRENT:  "CURRENT"
-    NEXT:     "NEXT"
-    OTHER:    "OTHER"
\ No newline at end of file
+    FIRST      = "FIRST"
+    PREVIOUS   = "PREVIOUS"
+    CURRENT    = "CURRENT"
+    NEXT       = "NEXT"
+    OTHER      = "OTHER"
+
+
+# Length of every interval in milliseconds.
+INTERVAL_MS = {
+    Interval.SECOND_2:  2000,
+    Interval.MINUTE_1:  60000,
+    Interval.MINUTE_3:  180000,
+    Interval.MINUTE_5:  300000,
+    Interval.MINUTE_15: 900000,
+    Interval.MINUTE_30: 1800000,
+    Interval.HOUR_1:    3600000,
+    Interval.HOUR_2:    7200000,
+    Interval.HOUR_4:    14400000,
+    Interval.HOUR_6:    21600000,
+    Interval.HOUR_8:    28800000,
+    Interval.HOUR_12:   43200000,
+    Interval.DAY_1:     86400000,
+    Interval.DAY_3:     259200000,
+    Interval.WEEK_1:    604800000,
+}
+
+# Offset of the first interval boundary from the unix epoch in milliseconds.
+# Weekly candles open on monday, the epoch was a thursday.
+INTERVAL_OFFSET_MS = {iv: 0 for iv in INTERVAL_MS}
+INTERVAL_OFFSET_MS[Interval.WEEK_1] = 4 * 86400000
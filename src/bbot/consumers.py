@@ -0,0 +1,551 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from .constants import ConsumerMode, ContentType, Interval, LatencyStage, QueuePolicy
+from .featurepool import FeaturePool
+from .features import FeatureEngine, PanelEngine, PanelFeature
+from .latency import STAGE_INDEX
+from .pipeline import HistoricalCandlePipe, StreamCandlePipe
+from .queues import WAKE, BoundedQueue
+from ..models.candle import Candle, ValidationSampler
+from ..models.database import DataBase
+from ..models.store import CandleStore, candle_dir
+
+
+FINISHED = "finished_history_download"
+
+# Seconds between the counters and latency histograms sent back by a worker process.
+STATS_SYNC = 5.0
+
+# Items after which a worker process sends the changed windows back, if its inbox is not empty before.
+CHANGES_BATCH = 64
+
+QUEUE   = STAGE_INDEX[LatencyStage.QUEUE]
+PARSE   = STAGE_INDEX[LatencyStage.PARSE]
+INSERT  = STAGE_INDEX[LatencyStage.INSERT]
+FEATURE = STAGE_INDEX[LatencyStage.FEATURE]
+DELAY   = STAGE_INDEX[LatencyStage.DELAY]
+
+# Changed tail of every window of a symbol: {interval: (columns, history_downloaded, latency)}
+WindowChanges = Dict[Interval, Tuple[Dict[str, Any], bool, Optional[timedelta]]]
+
+
+
+def consumer_shard(symbol: str, n_shards: int) -> int:
+    """Returns the shard of a symbol. The same in every process and on every run."""
+
+    return zlib.crc32(symbol.encode()) % n_shards
+
+
+def conflation_key(item: tuple) -> Optional[Tuple[str, str, int]]:
+    """Key of an item in a BoundedQueue: (symbol, stream, kline open time).
+
+    Only stream updates of the same kline are conflated, their values are cumulative.
+    The last update of a kline is never replaced by one of the next kline.
+    History items return None, they are never dropped.
+    """
+
+    symbol, contenttype, payload = item[0], item[2], item[3]
+    if contenttype != ContentType.CANDLE_STREAM:
+        return None
+    data = payload.get("data", payload)
+    return (symbol, payload.get("stream"), data["k"]["t"])
+
+
+
+class ShardConsumer:
+    """Processes the items of the symbols in one shard, in the order they arrive.
+
+    Items are tuple(symbol, interval, content_type, payload), from the history
+    producers as well as the stream producers. Stream updates of a symbol are
+    skipped until the history of all its windows is downloaded.
+
+    With latency stats enabled (see `db.latency`), items have a fifth field,
+    the `time.perf_counter_ns()` at which they were queued, and every stage
+    of processing is timed. Otherwise nothing is timed.
+
+    `n_processed` counts the processed items per content type, the
+    notifications that the history of a window is downloaded under None.
+    Workers call `consume()`, which logs an item that raises and counts it
+    in `n_errors` instead of stopping the consumer.
+
+    With `Options.datadir` set, the timeframes that close are appended
+    to the CandleStore in `datadir/candles` after every item.
+
+    With `Options.features` set, the features of the windows an item
+    changed are updated after it is inserted, see bbot/features.py.
+    With `Options.feature_workers` they are computed in a FeaturePool,
+    except in a worker process of ConsumerMode.PROCESS, which can not
+    start processes of its own. `idle()` writes back the values of the
+    FeaturePool, which wakes the queue of the consumer when a worker is
+    done, see `wake_on()`. Panel features are left to the ConsumerPool,
+    their `panel_columns` are not part of `changes()`.
+    """
+
+    def __init__(self, db: DataBase) -> None:
+        rate          = db.options.validation_sample_rate
+        self.db       = db
+        self.history  = HistoricalCandlePipe(rate)
+        self.stream   = StreamCandlePipe()
+        self.validate = ValidationSampler(rate)
+        self.latency  = db.latency
+        self.store    = CandleStore(candle_dir(db.options.datadir)) if db.options.datadir else None
+        features      = [f for f in db.options.features or () if not isinstance(f, PanelFeature)]
+        self.features = None
+        if features and db.options.feature_workers and not multiprocessing.current_process().daemon:
+            self.features = FeaturePool(features, db.options.feature_workers, db.latency)
+        elif features:
+            self.features = FeatureEngine(features, db.latency)
+        self.n_processed: Counter = Counter()
+        self.n_errors:    Counter = Counter()
+        self.panel_columns = {f.name for f in db.options.features or () if isinstance(f, PanelFeature)}
+
+
+    def process(self, item: tuple) -> None:
+        self.n_processed[item[2]] += 1
+        if self.latency is not None:
+            self.process_timed(item)
+        else:
+            symbol, interval, contenttype, payload = item
+            if isinstance(payload, str) and payload == FINISHED:
+                self.db.symbols[symbol].windows[interval]._history_downloaded = True
+            elif contenttype == ContentType.CANDLE_HISTORY_BLOCK:
+                self.history.process_block(symbol, interval, payload, self.db)
+                self.update_features(symbol, interval)
+            elif contenttype == ContentType.CANDLE_HISTORY:
+                self.history.process(symbol, interval, contenttype, payload, self.db)
+                self.update_features(symbol, interval)
+            elif self.history_downloaded(symbol):
+                kline = Candle.parse_kline(payload, self.validate(), self.db.symbols[symbol].scale)
+                self.stream.process(symbol, interval, contenttype, kline, self.db)
+                self.update_features(symbol)
+        if self.store is not None:
+            self.store.sync(item[0], self.db.symbols[item[0]].windows)
+
+
+    def consume(self, item: tuple) -> bool:
+        """`process()` that logs and counts an item that raises, instead of raising.
+
+        A bad message or a continuity error then only costs that item, the other
+        symbols of the shard keep updating. Returns whether the item was processed.
+        """
+
+        try:
+            self.process(item)
+        except Exception:
+            self.n_errors[item[2]] += 1
+            logging.exception(f"Consumer skipped an item of {item[0]} {item[1]} that raised.")
+            return False
+        return True
+
+
+    def wake_on(self, inbox: BoundedQueue) -> None:
+        """Wakes `inbox` when the FeaturePool has values to write back, so that `idle()` is called."""
+
+        if isinstance(self.features, FeaturePool):
+            self.features.on_done = inbox.wake
+
+
+    def idle(self) -> None:
+        """Called when the queue of the consumer is empty. Writes back the values of the FeaturePool."""
+
+        if isinstance(self.features, FeaturePool):
+            self.features.collect()
+
+
+    def close(self) -> None:
+        """Writes the stored candles to disk, and stops the feature workers."""
+
+        if self.store is not None:
+            self.store.close()
+        if isinstance(self.features, FeaturePool):
+            self.features.close()
+
+
+    def process_timed(self, item: tuple) -> None:
+        """`process()` that records the time of every stage in `self.latency`."""
+
+        symbol, interval, contenttype, payload, queued = item
+        clock = time.perf_counter_ns
+        start = clock()
+        if isinstance(payload, str) and payload == FINISHED:
+            self.db.symbols[symbol].windows[interval]._history_downloaded = True
+            return
+
+        h = self.latency.stages(symbol, contenttype)
+        h[QUEUE].record(start - queued)
+        if contenttype == ContentType.CANDLE_HISTORY_BLOCK:
+            self.history.process_block(symbol, interval, payload, self.db)
+            h[INSERT].record(clock() - start)
+        elif contenttype == ContentType.CANDLE_HISTORY:
+            self.history.process(symbol, interval, contenttype, payload, self.db)
+            h[INSERT].record(clock() - start)
+        elif self.history_downloaded(symbol):
+            kline  = Candle.parse_kline(payload, self.validate(), self.db.symbols[symbol].scale)
+            parsed = clock()
+            self.stream.process(symbol, interval, contenttype, kline, self.db)
+            h[INSERT].record(clock() - parsed)
+            h[PARSE].record(parsed - start)
+            interval = None
+        else:
+            return
+
+        if self.features is not None:
+            inserted = clock()
+            self.update_features(symbol, interval)
+            h[FEATURE].record(clock() - inserted)
+        if interval is None:
+            delay   = time.time_ns() - kline.event_time * 1000000
+            h[DELAY].record(max(delay, 0))
+            latency = timedelta(microseconds=delay // 1000)
+            for w in self.db.symbols[symbol].windows.values():
+                w._latency = latency
+
+
+    def update_features(self, symbol: str, interval: Optional[Interval] = None) -> None:
+        """Updates the features of one window of `symbol`, or of all its windows."""
+
+        if self.features is not None:
+            windows = self.db.symbols[symbol].windows
+            self.features.update(symbol, windows if interval is None else {interval: windows[interval]})
+
+
+    def history_downloaded(self, symbol: str) -> bool:
+        return all(
+            w._history_downloaded
+            for iv, w in self.db.symbols[symbol].windows.items() if iv != Interval.SECOND_2
+        )
+
+
+    def n_appended(self, symbol: str) -> Dict[Interval, int]:
+        return {iv: w.timeframes.n_appended for iv, w in self.db.symbols[symbol].windows.items()}
+
+
+    def changes(self, symbol: str, n_appended: Dict[Interval, int]) -> WindowChanges:
+        """Returns the timeframes of every window of `symbol` that were appended or
+        updated since the windows had appended `n_appended` timeframes. Without the
+        panel columns: the pool computes those on the DataBase of the bot.
+        """
+
+        changes = dict()
+        for iv, w in self.db.symbols[symbol].windows.items():
+            n = w.timeframes.n_appended - n_appended[iv] + 1
+            if w.timeframes or w._history_downloaded:
+                columns = w.timeframes.tail(n if w.timeframes else 0)
+                for name in self.panel_columns:
+                    columns.pop(name, None)
+                changes[iv] = (columns, w._history_downloaded, w._latency)
+        return changes
+
+
+
+def merge_changes(db: DataBase, symbol: str, changes: WindowChanges) -> None:
+    """Applies the changes of a worker process to the windows of `symbol` in `db`."""
+
+    for iv, (columns, downloaded, latency) in changes.items():
+        window = db.symbols[symbol].windows[iv]
+        window.timeframes.merge(columns)
+        window._history_downloaded = downloaded
+        window._latency            = latency
+
+
+
+def _thread_worker(consumer: ShardConsumer, inbox: BoundedQueue) -> None:
+    consumer.wake_on(inbox)
+    for item in iter(inbox.get_blocking, None):
+        if item is not WAKE:
+            consumer.consume(item)
+        if not len(inbox):
+            consumer.idle()
+    consumer.close()
+
+
+def _forward_worker(inbox: BoundedQueue, outbox: multiprocessing.Queue) -> None:
+    # Moves items to a worker process. The outbox is small, so a slow worker
+    # fills the BoundedQueue and its policy applies.
+    for item in iter(inbox.get_blocking, None):
+        outbox.put(item)
+    outbox.put(None)
+
+
+def _process_worker(db: DataBase, inbox: multiprocessing.Queue, outbox: multiprocessing.Queue) -> None:
+    # The changed windows are sent as a list of (symbol, WindowChanges), when the
+    # inbox is empty or after CHANGES_BATCH items, once per symbol for all its items.
+    # Counters and latency histograms since the last sync are sent as
+    # (None, (n_processed, n_errors, LatencyStats)), every STATS_SYNC seconds and at the end.
+    consumer = ShardConsumer(db)
+    synced   = time.monotonic()
+    pending: Dict[str, Dict[Interval, int]] = dict()  # n_appended of the changed symbols
+    n_items  = 0
+
+    def send():
+        outbox.put([(s, consumer.changes(s, before)) for s, before in pending.items()])
+        pending.clear()
+
+    def sync():
+        latency = consumer.latency.take() if consumer.latency is not None else None
+        outbox.put((None, (consumer.n_processed, consumer.n_errors, latency)))
+        consumer.n_processed = Counter()
+        consumer.n_errors    = Counter()
+
+    for item in iter(inbox.get, None):
+        if item[0] not in pending:
+            pending[item[0]] = consumer.n_appended(item[0])
+        consumer.consume(item)
+        n_items += 1
+        if inbox.empty() or n_items >= CHANGES_BATCH:
+            send()
+            n_items = 0
+        if inbox.empty():
+            consumer.idle()
+        if time.monotonic() - synced > STATS_SYNC:
+            sync()
+            synced = time.monotonic()
+    if pending:
+        send()
+    sync()
+    consumer.close()
+
+
+
+class ConsumerPool:
+    """Partitions symbols over `n_shards` consumers, each with its own queue and pipelines.
+
+    Producers use the pool as their queue. All items of a symbol go to the same
+    shard, in the order they were put, so the updates of a symbol are always
+    processed in order. A slow symbol only delays the symbols in its own shard.
+
+    Every shard queue is a BoundedQueue of `queue_size` items. When it is full,
+    `queue_policy` decides whether stream updates block the producer, drop the
+    oldest update, or conflate with the queued update of the same kline.
+    History items are never dropped. A dropped or conflated update leaves a
+    2s timeframe without candle, see StreamCandlePipe. Dropping the last
+    update of a kline also loses the trades after the update before it.
+
+    An item that raises is logged and skipped, see `ShardConsumer.consume()`
+    and `n_errors()`: a bad message does not stop its shard.
+
+    Modes:
+    TASK:    shards are asyncio tasks in the event loop of the bot.
+    THREAD:  every shard runs in its own thread, on the shared DataBase.
+             The windows are updated without a lock: code in the event loop that
+             reads a window may see it halfway an update. Read it with `tail()`
+             or `to_numpy()` and check the last open time, or use TASK mode.
+    PROCESS: every shard runs in a worker process, on its own copy of the DataBase.
+             The worker sends the changed tail of the windows back, which is merged
+             into the DataBase of the bot. It does so when its inbox is empty, or
+             after CHANGES_BATCH items, once for every symbol those items changed.
+
+    Panel features are computed by a task of the pool in the event loop, over all
+    symbols of the DataBase, every `Options.panel_period` seconds in which items were
+    processed, and once more after the last item. Also under a sustained load, and in
+    PROCESS mode on the merged windows. See `PanelFeature`.
+    """
+
+    # Items in flight between the forwarder thread and a worker process.
+    PROCESS_BUFFER = 64
+
+
+    def __init__(
+        self,
+        db:           DataBase,
+        n_shards:     int          = 1,
+        mode:         ConsumerMode = ConsumerMode.TASK,
+        queue_size:   int          = 0,
+        queue_policy: QueuePolicy  = QueuePolicy.BLOCK,
+    ) -> None:
+        self.db       = db
+        self.n_shards = max(1, n_shards)
+        self.mode     = ConsumerMode(mode)
+        self.n_items  = [0] * self.n_shards
+        self.queues   = [
+            BoundedQueue(queue_size, queue_policy, conflation_key) for _ in range(self.n_shards)
+        ]
+        panels        = [f for f in db.options.features or () if isinstance(f, PanelFeature)]
+        self.panels   = PanelEngine(panels, db.latency) if panels else None
+        self.consumers: List[ShardConsumer] = []
+        self._workers: List[Any] = []
+        self._tasks:   List[asyncio.Task] = []  # that process items in the event loop
+        self._outbox: Optional[multiprocessing.Queue] = None
+        self._stopped  = False
+        self._n_merged = 0                      # changes merged from worker processes
+        self._n_processed: Counter = Counter()  # of worker processes
+        self._n_errors:    Counter = Counter()  # of worker processes
+
+
+    async def put(self, item: tuple) -> None:
+        """Adds an item to the queue of the shard of its symbol."""
+
+        shard = consumer_shard(item[0], self.n_shards)
+        self.n_items[shard] += 1
+        if self.db.latency is not None:
+            # perf_counter is a system wide monotonic clock, also in worker processes.
+            item = (*item, time.perf_counter_ns())
+        await self.queues[shard].put(item)
+
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the counters of all shard queues added up. See `BoundedQueue.stats()`."""
+
+        total = dict()
+        for q in self.queues:
+            for k, v in q.stats().items():
+                total[k] = total.get(k, 0) + v
+        return total
+
+
+    def n_processed(self) -> Counter:
+        """Returns the number of processed items per content type, of all shards.
+
+        Worker processes report their counts every STATS_SYNC seconds.
+        """
+
+        total = Counter(self._n_processed)
+        for c in self.consumers:
+            total.update(c.n_processed.copy())
+        return total
+
+
+    def n_errors(self) -> Counter:
+        """Returns the number of items per content type that raised and were skipped, of all shards."""
+
+        total = Counter(self._n_errors)
+        for c in self.consumers:
+            total.update(c.n_errors.copy())
+        return total
+
+
+    def symbols(self, shard: int) -> List[str]:
+        return [s for s in self.db.symbols if consumer_shard(s, self.n_shards) == shard]
+
+
+    def start(self) -> set[asyncio.Task]:
+        """Starts all shards. Returns the asyncio tasks the event loop has to run."""
+
+        tasks = set()
+        if self.panels is not None:
+            self.panels.add_columns(self.db.symbols)
+        if self.mode == ConsumerMode.TASK:
+            for q in self.queues:
+                self.consumers.append(ShardConsumer(self.db))
+                self._tasks.append(asyncio.create_task(self._task_worker(self.consumers[-1], q)))
+
+        elif self.mode == ConsumerMode.THREAD:
+            for i, q in enumerate(self.queues):
+                self.consumers.append(ShardConsumer(self.db))
+                t = threading.Thread(
+                    target=_thread_worker, args=(self.consumers[-1], q),
+                    name=f"bbot-consumer-{i}", daemon=True,
+                )
+                t.start()
+                self._workers.append(t)
+
+        else:
+            ctx          = multiprocessing.get_context("spawn")
+            self._outbox = ctx.Queue()
+            for i, q in enumerate(self.queues):
+                partition = self.db.copy(update={
+                    "symbols": {s: self.db.symbols[s] for s in self.symbols(i)},
+                    "metrics": None,
+                })
+                inbox = ctx.Queue(self.PROCESS_BUFFER)
+                p = ctx.Process(
+                    target=_process_worker, args=(partition, inbox, self._outbox),
+                    name=f"bbot-consumer-{i}", daemon=True,
+                )
+                p.start()
+                t = threading.Thread(
+                    target=_forward_worker, args=(q, inbox),
+                    name=f"bbot-forward-{i}", daemon=True,
+                )
+                t.start()
+                self._workers.extend((t, p))
+            self._tasks.append(asyncio.create_task(self._mirror()))
+        tasks.update(self._tasks)
+        if self.panels is not None:
+            tasks.add(asyncio.create_task(self._panel_worker()))
+        return tasks
+
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stops all shards after they processed the items already in their queue."""
+
+        for q in self.queues:
+            q.close()
+        for w in self._workers:
+            w.join(timeout)
+        if self._outbox is not None:
+            self._outbox.put(None)
+        self._workers = []
+        self._stopped = True
+
+
+    # Internal
+
+    @staticmethod
+    async def _task_worker(consumer: ShardConsumer, inbox: BoundedQueue) -> None:
+        consumer.wake_on(inbox)
+        while True:
+            item = await inbox.get()
+            if item is None:
+                consumer.close()
+                return
+            if item is not WAKE:
+                consumer.consume(item)
+            if not len(inbox):
+                consumer.idle()
+
+
+    async def _mirror(self) -> None:
+        """Merges the changes of the worker processes into the DataBase of the bot."""
+
+        loop = asyncio.get_running_loop()
+        while True:
+            msg = await loop.run_in_executor(None, self._outbox.get)
+            while msg is not None:
+                if isinstance(msg, list):
+                    for symbol, changes in msg:
+                        merge_changes(self.db, symbol, changes)
+                    self._n_merged += len(msg)
+                else:
+                    n_processed, n_errors, latency = msg[1]
+                    self._n_processed.update(n_processed)
+                    self._n_errors.update(n_errors)
+                    if latency is not None:
+                        self.db.latency.merge(latency)
+                try:
+                    msg = self._outbox.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                return
+
+
+
+    async def _panel_worker(self) -> None:
+        """Updates the panel features every `Options.panel_period` seconds in which items were
+        processed. After `stop()`, waits for the last items and updates them once more.
+        """
+
+        period = self.db.options.panel_period
+        done   = 0
+        while not self._stopped:
+            await asyncio.sleep(period)
+            done = self._update_panels(done)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._update_panels(done)
+
+
+    def _update_panels(self, done: int) -> int:
+        n = sum(self.n_processed().values()) + self._n_merged
+        if n != done:
+            self.panels.update(self.db.symbols)
+        return n
@@ -7,6 +7,7 @@ from pydantic import BaseModel
 
 from ..models.database import DataBase
 from ..models.options import Options
+from ..models.scale import Scale
 
 
 class DataProcessor(ABC):
@@ -64,9 +65,21 @@ class Downloader:
     def download_market_info(
         self, client: Client, database: DataBase
     ) -> DataBase:
+        info = client.get_exchange_info()
+        if database.options.fixed_point:
+            database.scales = self.parse_scales(info)
         # TODO
         return database
 
+    @staticmethod
+    def parse_scales(exchange_info: Dict[str, Any]) -> Dict[str, Scale]:
+        """Returns the fixed-point Scale of every symbol in the exchange info."""
+
+        return {
+            s["symbol"].lower(): Scale.from_symbol_info(s)
+            for s in exchange_info["symbols"]
+        }
+
     def download_account_info(
         self, client: Client, database: DataBase
     ) -> DataBase:
@@ -0,0 +1,204 @@
+import concurrent.futures
+import logging
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Deque, Dict, Iterable, Optional, Set, Tuple
+
+import numpy as np
+
+from .constants import Interval
+from .features import FeatureEngine, graph
+from .latency import LatencyStats
+from ..models.shared import SharedCandleBuffer
+from ..models.window import Window
+
+
+# Timeframes in shared memory of an unbounded window, the last ones.
+UNBOUNDED_ROWS = 1000
+
+Key = Tuple[str, Interval]
+
+
+
+class FeaturePool:
+    """Computes the features of a consumer in worker processes, see `Options.feature_workers`.
+
+    Every window gets a SharedCandleBuffer, a copy of its last timeframes in shared
+    memory. After an item, `update()` copies the changed tail of the windows into
+    their shared buffer and submits them to a worker. Workers read the shared buffer
+    and write the feature values in it, nothing but the key of the window is pickled.
+    `update()` never waits for a worker. While a window is computed its shared buffer
+    is left alone, and a newer version is submitted when the worker is done: like a
+    conflating queue, the features of the newest version of a window are computed.
+
+    The values are written back into the windows in the thread of the consumer, by
+    `collect()`, which `update()` and `flush()` call as well. When a window is done,
+    `on_done()` is called from another thread, to tell the consumer to `collect()`.
+    All windows of a symbol go to the same worker, which keeps the state of their
+    incremental features: every worker is a `ProcessPoolExecutor` of one process.
+
+    A window that fails in a worker is logged and counted in `n_errors`, its
+    values are left as they are. Features that raise are handled by the
+    FeatureEngine of the worker, see `FeatureEngine.n_errors`.
+
+    Usage:
+        pool = FeaturePool(options.features, 4)
+        pool.update("btcusdt", db.symbols["btcusdt"].windows)
+        ...
+        pool.close()
+    """
+
+    def __init__(
+        self,
+        features:  Iterable[Callable],
+        n_workers: int,
+        latency:   Optional[LatencyStats] = None,
+    ) -> None:
+        self.features  = graph(features)
+        self.latency   = latency
+        ctx            = multiprocessing.get_context("spawn")
+        self.executors = [
+            ProcessPoolExecutor(1, ctx, initializer=_init_worker, initargs=(self.features, latency is not None))
+            for _ in range(max(1, n_workers))
+        ]
+        self._shared:  Dict[Key, SharedCandleBuffer] = dict()
+        self._windows: Dict[Key, Window]             = dict()
+        self._synced:  Dict[Key, int]                = dict()  # n_appended of the window
+        self._running: Dict[Key, Future]             = dict()
+        self._dirty:   Set[Key]                      = set()
+        self._done:    Deque[Tuple[Key, Future]]     = deque()  # filled by the executor threads
+        self.on_done:  Optional[Callable[[], None]]  = None
+        self.n_errors: Counter                       = Counter()  # per window
+
+
+    def update(self, symbol: str, windows: Dict[Interval, Window]) -> None:
+        """Writes back the finished windows, and submits the windows of `symbol`."""
+
+        self.collect()
+        for iv, window in windows.items():
+            if not window.timeframes:
+                continue
+            key = (symbol, iv)
+            self._windows[key] = window
+            if key in self._running:
+                self._dirty.add(key)
+            else:
+                self._submit(key)
+
+
+    def collect(self) -> None:
+        """Writes the values of the finished windows back, and submits the ones that changed since."""
+
+        while self._done:
+            key, future = self._done.popleft()
+            del self._running[key]
+            try:
+                _, rows, latency = future.result()
+            except Exception:
+                self.n_errors[key] += 1
+                logging.exception(f"Features of {key[0]} {key[1].value} failed in a worker.")
+            else:
+                self._write_back(key, rows)
+                if latency is not None and self.latency is not None:
+                    self.latency.merge(latency)
+            if key in self._dirty:
+                self._dirty.discard(key)
+                self._submit(key)
+
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Waits until all windows are computed, and writes their values back."""
+
+        while self._running:
+            concurrent.futures.wait(list(self._running.values()), timeout)
+            if not self._done:
+                return
+            self.collect()
+
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        try:
+            self.flush(timeout)
+        finally:
+            for executor in self.executors:
+                executor.shutdown(wait=True, cancel_futures=True)
+            for shared in self._shared.values():
+                shared.close()
+            self._shared.clear()
+
+
+    # Internal
+
+    def _submit(self, key: Key) -> None:
+        window = self._windows[key]
+        shared = self._shared.get(key)
+        if shared is None:
+            capacity = window.window_length or UNBOUNDED_ROWS
+            extra    = [f.name for f in self.features]
+            shared   = self._shared[key] = SharedCandleBuffer(capacity, window.scale is not None, extra)
+            for name in extra:
+                window.timeframes.add_column(name)
+
+        # The tail that changed since the last copy, from the last timeframe of that copy.
+        buffer = window.timeframes
+        synced = self._synced.get(key)
+        n      = len(buffer) if synced is None else buffer.n_appended - synced + 1
+        if n > len(buffer):
+            shared.buffer.clear()
+            n = len(buffer)
+        shared.buffer.merge(buffer.tail(min(n, shared.buffer.capacity)))
+        shared.publish()
+        self._synced[key] = buffer.n_appended
+
+        executor = self.executors[hash(key[0]) % len(self.executors)]
+        future   = executor.submit(_compute, key, shared.name, shared.buffer.capacity, window.scale is not None)
+        self._running[key] = future
+        future.add_done_callback(partial(self._finished, key))
+
+
+    def _finished(self, key: Key, future: Future) -> None:
+        # In a thread of the executor
+        self._done.append((key, future))
+        if self.on_done is not None:
+            self.on_done()
+
+
+    def _write_back(self, key: Key, rows: int) -> None:
+        # The window may have moved on since it was copied, the rows are found by open time.
+        shared = self._shared[key].buffer
+        opens  = self._windows[key].timeframes.view("open_time")
+        rows   = min(rows, len(shared))
+        if not rows or not len(opens):
+            return
+        last = shared.last_open_time()
+        end  = int(np.searchsorted(opens, last)) + 1
+        if end > len(opens) or opens[end - 1] != last:
+            return
+        rows = min(rows, end)
+        for f in self.features:
+            self._windows[key].timeframes.view(f.name)[end - rows:end] = shared.view(f.name)[-rows:]
+
+
+
+# Worker processes
+
+_engine: Optional[FeatureEngine] = None
+_windows: Dict[Key, Tuple[SharedCandleBuffer, Window]] = dict()
+
+
+def _init_worker(features: Iterable[Callable], timed: bool) -> None:
+    global _engine
+    _engine = FeatureEngine(features, LatencyStats() if timed else None)
+
+
+def _compute(key: Key, name: str, capacity: int, fixed_point: bool) -> Tuple[Key, int, Optional[LatencyStats]]:
+    if key not in _windows or _windows[key][0].name != name:
+        shared = SharedCandleBuffer(capacity, fixed_point, [f.name for f in _engine.features], name)
+        _windows[key] = (shared, Window(interval=key[1], window_length=capacity, timeframes=shared.buffer))
+    shared, window = _windows[key]
+    shared.restore()
+    rows    = _engine.update_window(key, window)
+    latency = _engine.latency.take() if _engine.latency is not None else None
+    return key, rows, latency
@@ -0,0 +1,414 @@
+import logging
+import time
+from collections import Counter
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .constants import INTERVAL_MS, Interval
+from .latency import LatencyStats
+from ..models.ringbuffer import CANDLE_COLUMNS
+from ..models.window import Window
+
+
+# (state, candle) -> (state, value), or (state, *inputs) -> (state, value)
+Update = Callable[..., Tuple[Any, Optional[float]]]
+
+COLUMNS = {name for name, _ in CANDLE_COLUMNS}
+
+
+
+def no_state() -> None:
+    return None
+
+
+
+class Feature:
+    """A value computed for every timeframe of a window, stored in a column of its CandleBuffer.
+
+    Incremental features give `update(state, candle) -> (state, value)` and
+    `init() -> state`. The state covers the closed candles. On every tick the
+    open candle is applied to that state, so `update()` must return a new state
+    instead of modifying `state` in place. When the open candle closes, its final
+    version is applied once more and the result becomes the state. Either way
+    a tick costs a single `update()`, whatever the length of the window.
+    A candle is a CandleView: prices and volumes are scaled int64 with `Options.fixed_point`.
+
+    Other features give `compute(window) -> value`, for the most recent timeframe.
+    They are computed again on every tick, over the whole window if they need it,
+    see `Window.to_numpy()`.
+
+    With `inputs`, the names of window columns or of other features, a feature gets
+    those instead of the candle or the window: `update(state, *values)` with the
+    values of the timeframe, or `compute(*columns)` with the columns of the window.
+    The FeatureEngine computes features after their inputs, and only when an input changed.
+
+    Any other callable in `Options.features` is used as `compute`, named after the function.
+    With `ConsumerMode.PROCESS` features are pickled, so they can not be lambdas.
+
+    Usage:
+        def ema20(state, close):
+            ema = close if state is None else state + (close - state) * 2 / 21
+            return ema, ema
+
+        Options(features={Feature("ema20", update=ema20, inputs=["close_price"]), ...})
+    """
+
+    def __init__(
+        self,
+        name:    str,
+        update:  Optional[Update]             = None,
+        init:    Callable[[], Any]            = no_state,
+        compute: Optional[Callable[..., Any]] = None,
+        inputs:  Sequence[str]                = (),
+    ) -> None:
+        if (update is None) == (compute is None):
+            raise ValueError(f"Feature {name} needs either an update or a compute function.")
+        self.name    = name
+        self.update  = update
+        self.init    = init
+        self.compute = compute
+        self.inputs  = tuple(inputs)
+
+
+    @property
+    def incremental(self) -> bool:
+        return self.update is not None
+
+
+    def __call__(self, window: Window) -> float:
+        """Returns the value for the most recent timeframe of `window`, computed from scratch.
+
+        Feature inputs are read from the columns of the window.
+        """
+
+        buffer = window.timeframes
+        if not self.incremental:
+            return self.compute(*map(buffer.view, self.inputs)) if self.inputs else self.compute(window)
+        state, value = self.init(), None
+        if self.inputs:
+            has_candle = buffer.view("has_candle")
+            for i, values in enumerate(zip(*map(buffer.view, self.inputs))):
+                if has_candle[i]:
+                    state, value = self.update(state, *values)
+            return value
+        for tf in buffer:
+            if tf.candle is not None:
+                state, value = self.update(state, tf.candle)
+        return value
+
+
+    def __repr__(self) -> str:
+        return f"Feature({self.name})"
+
+
+
+def as_feature(f: Callable) -> Feature:
+    return f if isinstance(f, Feature) else Feature(f.__name__, compute=f)
+
+
+def ema(span: int, column: str = "close_price", name: Optional[str] = None) -> Feature:
+    """Exponential moving average of a window column or a feature, incremental."""
+
+    return Feature(name or f"ema{span}_{column}", update=partial(_ema, 2 / (span + 1)), inputs=[column])
+
+
+def _ema(alpha: float, state: Optional[float], x: float) -> Tuple[float, float]:
+    state = x if state is None else state + alpha * (x - state)
+    return state, state
+
+
+def graph(features: Iterable[Callable]) -> List[Feature]:
+    """Returns the features in an order in which every feature comes after its inputs.
+
+    Raises a ValueError for an input that is neither a window column nor a feature,
+    and for features that depend on each other.
+    """
+
+    nodes = {f.name: f for f in map(as_feature, features)}
+    order = []
+    done  = dict()   # name -> False while its inputs are visited, True after
+
+    def visit(name: str, path: Tuple[str, ...]) -> None:
+        if done.get(name):
+            return
+        if name in done:
+            raise ValueError(f"Features depend on each other: {' -> '.join(path + (name,))}.")
+        done[name] = False
+        for i in nodes[name].inputs:
+            if i in nodes:
+                visit(i, path + (name,))
+            elif i not in COLUMNS:
+                raise ValueError(f"Input {i} of feature {name} is not a window column or a feature.")
+        done[name] = True
+        order.append(nodes[name])
+
+    for name in sorted(nodes):
+        visit(name, ())
+    return order
+
+
+
+class FeatureEngine:
+    """Keeps the features of `Options.features` up to date in the windows of a consumer.
+
+    Called after every processed item with the windows it changed. Feature values
+    are stored in a float64 column per feature, named after the feature, so
+    `window.timeframes.view("ema20")` or `window.to_frame()` return them.
+
+    Features are computed in the order of `graph()`, each at most once per window
+    and item. A feature with inputs is skipped when no timeframe was appended and
+    the inputs of the open timeframe did not change: its value stays as it is.
+    With `latency`, the compute time of every feature is recorded, see
+    `LatencyStats.feature()`.
+
+    A window is recomputed from scratch only the first time it is seen, or when
+    more timeframes were appended than it holds, like after a history block.
+    Windowed features then only get a value for the most recent timeframe.
+
+    A feature that raises gets NaN for the timeframe, the other features and
+    windows are computed as usual. Errors are counted per feature in `n_errors`,
+    the first one of every feature is logged. An incremental feature that raises
+    on one candle gets NaN for that candle only, the next candles are folded into
+    the state of the candle before it.
+    """
+
+    def __init__(self, features: Iterable[Callable], latency: Optional[LatencyStats] = None) -> None:
+        self.features = graph(features)
+        self.latency  = latency
+        self.columns  = {"has_candle"} | {f.name for f in self.features}
+        self.columns |= {i for f in self.features for i in f.inputs}
+        self.n_errors: Counter = Counter()
+        self._seen:   Dict[Tuple[str, Interval], int]              = dict()  # n_appended of the window
+        self._states: Dict[Tuple[str, Interval], Dict[str, Any]]   = dict()  # state of the closed candles
+        self._inputs: Dict[Tuple[str, Interval], Dict[str, tuple]] = dict()  # inputs of the open timeframe
+
+
+    def update(self, symbol: str, windows: Dict[Interval, Window]) -> None:
+        for iv, window in windows.items():
+            if window.timeframes:
+                self.update_window((symbol, iv), window)
+
+
+    def update_window(self, key: Tuple[str, Interval], window: Window) -> int:
+        """Updates the features of one window. Returns the number of timeframes at the end
+        of the window whose values may have changed.
+        """
+
+        buffer = window.timeframes
+        n      = len(buffer)
+        seen   = self._seen.get(key)
+        new    = buffer.n_appended - seen if seen is not None else n
+        self._seen[key] = buffer.n_appended
+
+        if seen is None:
+            for f in self.features:
+                buffer.add_column(f.name)
+        views = buffer.views(self.columns)
+        if new >= n:
+            # The previous open timeframe is gone, start over.
+            self._states[key] = {f.name: f.init() for f in self.features if f.incremental}
+            closed = range(n - 1)
+        else:
+            closed = range(n - 1 - new, n - 1)
+        if new:
+            self._inputs[key] = dict()
+        states, inputs = self._states[key], self._inputs[key]
+        has_candle     = views["has_candle"]
+        candles        = None
+        clock          = time.perf_counter_ns
+
+        for f in self.features:
+            if f.inputs:
+                last = tuple(views[i][-1] for i in f.inputs)
+                if not new and inputs.get(f.name) == last:
+                    continue
+                inputs[f.name] = last
+            elif f.incremental and candles is None:
+                candles = [buffer[i].candle for i in closed] + [buffer[-1].candle]
+
+            start  = clock() if self.latency is not None else 0
+            values = views[f.name]
+            try:
+                if not f.incremental:
+                    value      = f.compute(*(views[i] for i in f.inputs)) if f.inputs else f.compute(window)
+                    values[-1] = np.nan if value is None else value
+                else:
+                    state = states[f.name]
+                    if f.inputs:
+                        columns = [views[i] for i in f.inputs]
+                        for i in closed:
+                            if has_candle[i]:
+                                state, values[i] = self.fold(f, key, state, *(c[i] for c in columns))
+                        if has_candle[-1]:
+                            values[-1] = self.fold(f, key, state, *last)[1]
+                    else:
+                        for i, candle in zip(closed, candles):
+                            if candle is not None:
+                                state, values[i] = self.fold(f, key, state, candle)
+                        if candles[-1] is not None:
+                            values[-1] = self.fold(f, key, state, candles[-1])[1]
+                    states[f.name] = state
+            except Exception:
+                values[-1] = np.nan
+                self.failed(f, key)
+            if self.latency is not None:
+                self.latency.feature(f.name).record(clock() - start)
+        return len(closed) + 1
+
+
+    def fold(self, f: Feature, key: Tuple[str, Interval], state: Any, *args: Any) -> Tuple[Any, float]:
+        """`f.update(state, *args)`. When it raises, returns the state unchanged and NaN."""
+
+        try:
+            return _value(f.update(state, *args))
+        except Exception:
+            self.failed(f, key)
+            return state, np.nan
+
+
+    def failed(self, f: Any, key: Tuple[str, Interval]) -> None:
+        """Counts an error of feature `f` in window `key`, and logs the first one of `f`."""
+
+        if not self.n_errors[f.name]:
+            logging.exception(f"Feature {f.name} raised on {key[0]} {key[1].value}, its value is NaN.")
+        self.n_errors[f.name] += 1
+
+
+
+def _value(result: Tuple[Any, Optional[float]]) -> Tuple[Any, float]:
+    state, value = result
+    return state, np.nan if value is None else value
+
+
+
+def panel(windows: Sequence[Window], column: str = "close_price", length: Optional[int] = None) -> np.ndarray:
+    """Returns a (windows x time) matrix of a column of windows of the same interval.
+
+    The columns are the last `length` open times, the last one is the most recent
+    open time of all windows. Timeframes are placed by open time, so a window
+    that is behind or has a gap gets NaN where it has no timeframe.
+    """
+
+    windows = [w for w in windows if w.timeframes]
+    length  = length or max((len(w.timeframes) for w in windows), default=0)
+    matrix  = np.full((len(windows), length), np.nan)
+    if not windows or not length:
+        return matrix
+    ms   = INTERVAL_MS[windows[0].interval]
+    last = max(w.timeframes.last_open_time() for w in windows)
+    for row, w in zip(matrix, windows):
+        opens = w.timeframes.view("open_time")[-length:]
+        idx   = (opens - last) // ms + length - 1
+        keep  = idx >= 0
+        row[idx[keep]] = w.timeframes.view(column)[-length:][keep]
+    return matrix
+
+
+
+class PanelFeature:
+    """A feature of all symbols at once, computed from a (symbols x time) matrix.
+
+    `compute(matrix) -> values` gets one row per symbol with the last `length`
+    values of `column` in the `interval` windows (see `panel()`), and returns one
+    value per symbol. So one NumPy call computes a feature for hundreds of symbols.
+    The values are stored like those of a Feature, in the most recent timeframe.
+    `column` can be a window column or a Feature.
+
+    Panel features in `Options.features` are computed by the ConsumerPool, over
+    all symbols of the DataBase, every `Options.panel_period` seconds in which
+    items were processed. `compute` is a function, not a lambda, so that the
+    Options can be sent to the worker processes of ConsumerMode.PROCESS.
+
+    Usage:
+        def momentum(closes):
+            return closes[:, -1] / closes[:, 0] - 1
+
+        Options(features={PanelFeature("momentum", momentum, Interval.MINUTE_1, length=15)})
+    """
+
+    def __init__(
+        self,
+        name:     str,
+        compute:  Callable[[np.ndarray], Any],
+        interval: Interval,
+        column:   str           = "close_price",
+        length:   Optional[int] = None,
+    ) -> None:
+        self.name     = name
+        self.compute  = compute
+        self.interval = Interval(interval)
+        self.column   = column
+        self.length   = length
+
+
+    def __call__(self, windows: Sequence[Window]) -> np.ndarray:
+        """Returns one value per window, NaN for empty windows."""
+
+        full   = np.array([bool(w.timeframes) for w in windows], dtype=bool)
+        values = np.full(len(windows), np.nan)
+        if full.any():
+            computed     = self.compute(panel(windows, self.column, self.length))
+            values[full] = np.asarray(computed, dtype=np.float64).reshape(-1)
+        return values
+
+
+    def __repr__(self) -> str:
+        return f"PanelFeature({self.name}, {self.interval.value})"
+
+
+
+class PanelEngine:
+    """Keeps the panel features of `Options.features` up to date in the windows of the DataBase.
+
+    Every `update()` computes each panel feature once, for all symbols it is given.
+    A feature that raises leaves NaN in the windows, and is counted in `n_errors`.
+    The value of a window goes in the timeframe that was the most recent one when
+    the feature was computed, also when a consumer thread appended one meanwhile.
+    """
+
+    def __init__(self, features: Iterable[PanelFeature], latency: Optional[LatencyStats] = None) -> None:
+        self.features = sorted(features, key=lambda f: f.name)
+        self.latency  = latency
+        self.n_errors: Counter = Counter()
+
+
+    def add_columns(self, symbols: Dict[str, Any]) -> None:
+        """Adds the columns of the panel features to the windows, before consumers write to them."""
+
+        for f in self.features:
+            for s in symbols.values():
+                if f.interval in s.windows:
+                    s.windows[f.interval].timeframes.add_column(f.name)
+
+
+    def update(self, symbols: Dict[str, Any]) -> None:
+        clock = time.perf_counter_ns
+        for f in self.features:
+            start   = clock() if self.latency is not None else 0
+            windows = [s.windows[f.interval] for s in list(symbols.values()) if f.interval in s.windows]
+            opens   = [w.timeframes.last_open_time() if w.timeframes else None for w in windows]
+            try:
+                values = f(windows)
+            except Exception:
+                if not self.n_errors[f.name]:
+                    logging.exception(f"Panel feature {f.name} raised, its values are NaN.")
+                self.n_errors[f.name] += 1
+                values = np.full(len(windows), np.nan)
+            for w, open_time, value in zip(windows, opens, values):
+                if open_time is not None:
+                    self.write(w.timeframes, f.name, open_time, value)
+            if self.latency is not None:
+                self.latency.feature(f.name).record(clock() - start)
+
+
+    @staticmethod
+    def write(buffer: Any, name: str, open_time: int, value: float) -> None:
+        """Writes `value` in column `name` of the timeframe that opened at `open_time`, if still there."""
+
+        buffer.add_column(name)
+        views = buffer.views(("open_time", name))
+        i     = int(np.searchsorted(views["open_time"], open_time))
+        if i < len(views["open_time"]) and views["open_time"][i] == open_time:
+            views[name][i] = value
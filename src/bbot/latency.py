@@ -0,0 +1,274 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .constants import ContentType, LatencyStage
+
+
+# Every power of two of nanoseconds is split in 2**SUB_BITS buckets,
+# so a recorded value is off by at most 1 / 2**SUB_BITS, 12.5%.
+SUB_BITS  = 3
+SUB       = 1 << SUB_BITS
+N_BUCKETS = 64 * SUB
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+# (symbol, stream, stage)
+Key = Tuple[str, ContentType, LatencyStage]
+# Position of the histogram of a stage in StageHistograms
+STAGE_INDEX = {stage: i for i, stage in enumerate(LatencyStage)}
+
+
+
+def bucket(ns: int) -> int:
+    """Returns the histogram bucket of a duration in nanoseconds."""
+
+    if ns < 2 * SUB:
+        return ns if ns > 0 else 0
+    shift = ns.bit_length() - SUB_BITS - 1
+    return (shift + 1) * SUB + (ns >> shift) - SUB
+
+
+def bucket_bounds(i: int) -> Tuple[int, int]:
+    """Returns the lowest and the highest nanoseconds in bucket `i`."""
+
+    if i < 2 * SUB:
+        return i, i
+    shift = i // SUB - 1
+    m     = i % SUB + SUB
+    return m << shift, ((m + 1) << shift) - 1
+
+
+
+class LatencyHistogram:
+    """Log-linear histogram of durations in nanoseconds.
+
+    Recording is a bucket lookup with integer arithmetic and a few
+    additions, memory is fixed. Percentiles are accurate to a bucket.
+    With a `parent`, every duration recorded or merged is added to it as well.
+    """
+
+    __slots__ = ("counts", "n", "total", "max", "parent")
+
+    def __init__(self, parent: Optional["LatencyHistogram"] = None) -> None:
+        self.counts = [0] * N_BUCKETS
+        self.n      = 0
+        self.total  = 0
+        self.max    = 0
+        self.parent = parent
+
+
+    def record(self, ns: int) -> None:
+        if ns < 2 * SUB:
+            self.counts[ns if ns > 0 else 0] += 1
+        else:
+            shift = ns.bit_length() - SUB_BITS - 1
+            self.counts[(shift + 1) * SUB + (ns >> shift) - SUB] += 1
+        self.n     += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+        if self.parent is not None:
+            self.parent.record(ns)
+
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        self.n     += other.n
+        self.total += other.total
+        self.max    = max(self.max, other.max)
+        if self.parent is not None:
+            self.parent.merge(other)
+        return self
+
+
+    def percentile(self, p: float) -> int:
+        """Returns the `p`th percentile in nanoseconds, the middle of its bucket."""
+
+        if not self.n:
+            return 0
+        rank = p / 100 * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= rank:
+                low, high = bucket_bounds(i)
+                return min((low + high) // 2, self.max)
+        return self.max
+
+
+    def cumulative(self, bounds: Sequence[int]) -> List[int]:
+        """Returns the number of durations up to every bound in nanoseconds, in order.
+
+        A bucket is counted under the first bound that is not below its highest
+        duration, so a count is accurate to a bucket.
+        """
+
+        out, seen, i = [], 0, 0
+        for bound in bounds:
+            while i < N_BUCKETS and bucket_bounds(i)[1] <= bound:
+                seen += self.counts[i]
+                i    += 1
+            out.append(seen)
+        return out
+
+
+    def summary(self) -> Dict[str, float]:
+        """Count, mean, percentiles and maximum. Times in microseconds."""
+
+        out = {"count": self.n, "mean": self.total / self.n / 1e3 if self.n else 0.0}
+        for p in PERCENTILES:
+            out[f"p{p:g}"] = self.percentile(p) / 1e3
+        out["max"] = self.max / 1e3
+        return out
+
+
+    def __repr__(self) -> str:
+        s = self.summary()
+        return f"LatencyHistogram(count={s['count']}, p50={s['p50']:.1f}us, p99={s['p99']:.1f}us)"
+
+
+
+class StageHistograms(list):
+    """The histograms of one symbol and stream, one per LatencyStage, in STAGE_INDEX order.
+
+    Consumers look this list up once per item and record every stage
+    in it by position, see `LatencyStats.stages()`. With `totals`, the
+    histograms of a stream of all symbols, every stage is also recorded there.
+    """
+
+    def __init__(self, totals: Optional["StageHistograms"] = None) -> None:
+        super().__init__(LatencyHistogram(totals[i] if totals else None) for i in range(len(LatencyStage)))
+
+
+
+class LatencyStats:
+    """Latency histograms per symbol, stream and stage.
+
+    Created by the DataBase when `Options.latency_stats` is set, and filled
+    by the consumers, see `ShardConsumer.process_timed()`. Every symbol is handled
+    by a single consumer, so the histograms of a symbol are only written by one
+    thread. With latency stats disabled `db.latency` is None and nothing is timed.
+
+    Stages (see LatencyStage):
+    QUEUE:   time between ConsumerPool.put() and the start of processing
+    PARSE:   raw stream message to parsed kline
+    INSERT:  pipeline insert in all windows, history blocks include parsing
+    FEATURE: feature calculation
+    DELAY:   exchange event time (`E`) to processed, measured with the wall clock,
+             so it includes the network and any clock offset between bbot and Binance
+
+    The FEATURE stage is also split per feature, of all symbols and intervals,
+    see `FeatureEngine`.
+
+    Besides the histograms per symbol, `totals` holds those of every stream of all
+    symbols, kept up to date on every record. So reading the latency of all symbols,
+    like a metrics scrape does, costs the same for any number of symbols.
+
+    Usage:
+        db.latency.summary(symbol="btcusdt")[LatencyStage.QUEUE]["p99"]
+        db.latency.feature_summary()["ema20_close_price"]["mean"]
+    """
+
+    def __init__(self) -> None:
+        self.streams:  Dict[Tuple[str, ContentType], StageHistograms] = dict()
+        self.totals:   Dict[ContentType, StageHistograms]             = dict()
+        self.features: Dict[str, LatencyHistogram]                    = dict()
+
+
+    def stages(self, symbol: str, stream: ContentType) -> StageHistograms:
+        """Returns the histograms of `symbol` and `stream`, index them with STAGE_INDEX."""
+
+        key = (symbol, stream)
+        h   = self.streams.get(key)
+        if h is None:
+            totals = self.totals.get(stream)
+            if totals is None:
+                totals = self.totals[stream] = StageHistograms()
+            h = self.streams[key] = StageHistograms(totals)
+        return h
+
+
+    def feature(self, name: str) -> LatencyHistogram:
+        """Returns the histogram of the compute time of a feature."""
+
+        h = self.features.get(name)
+        if h is None:
+            h = self.features[name] = LatencyHistogram()
+        return h
+
+
+    def record(self, symbol: str, stream: ContentType, stage: LatencyStage, ns: int) -> None:
+        self.stages(symbol, stream)[STAGE_INDEX[stage]].record(ns)
+
+
+    def select(
+        self,
+        symbol: Optional[str]          = None,
+        stream: Optional[ContentType]  = None,
+        stage:  Optional[LatencyStage] = None,
+    ) -> Dict[Key, LatencyHistogram]:
+        """Returns the recorded histograms that match all given arguments."""
+
+        return {
+            (s, c, st): h[i]
+            for (s, c), h in list(self.streams.items())
+            if (symbol is None or s == symbol) and (stream is None or c == stream)
+            for st, i in STAGE_INDEX.items()
+            if (stage is None or st == stage) and h[i].n
+        }
+
+
+    def summary(
+        self,
+        symbol: Optional[str]         = None,
+        stream: Optional[ContentType] = None,
+    ) -> Dict[LatencyStage, Dict[str, float]]:
+        """Returns a summary per stage, of all symbols and streams that match. See `LatencyHistogram.summary()`."""
+
+        merged = dict()
+        if symbol is None:
+            for (_, stage), h in self.select_totals(stream).items():
+                merged.setdefault(stage, LatencyHistogram()).merge(h)
+        else:
+            for (_, _, stage), h in self.select(symbol, stream).items():
+                merged.setdefault(stage, LatencyHistogram()).merge(h)
+        return {stage: h.summary() for stage, h in merged.items()}
+
+
+    def select_totals(self, stream: Optional[ContentType] = None) -> Dict[Tuple[ContentType, LatencyStage], LatencyHistogram]:
+        """Returns the recorded histograms of all symbols, per stream and stage."""
+
+        return {
+            (c, st): h[i]
+            for c, h in list(self.totals.items())
+            if stream is None or c == stream
+            for st, i in STAGE_INDEX.items()
+            if h[i].n
+        }
+
+
+    def feature_summary(self) -> Dict[str, Dict[str, float]]:
+        """Returns a summary of the compute time per feature. See `LatencyHistogram.summary()`."""
+
+        return {name: h.summary() for name, h in sorted(list(self.features.items())) if h.n}
+
+
+    def merge(self, other: "LatencyStats") -> None:
+        """Adds the histograms of `take()`, for example of a worker process."""
+
+        for key, histograms in other.streams.items():
+            for mine, h in zip(self.stages(*key), histograms):
+                mine.merge(h)
+        for name, h in other.features.items():
+            self.feature(name).merge(h)
+
+
+    def take(self) -> "LatencyStats":
+        """Returns all histograms and starts new, empty ones."""
+
+        taken = LatencyStats()
+        taken.streams, self.streams   = self.streams, dict()
+        taken.totals, self.totals     = self.totals, dict()
+        taken.features, self.features = self.features, dict()
+        return taken
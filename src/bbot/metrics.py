@@ -0,0 +1,179 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Optional, Tuple
+
+from .latency import LatencyHistogram
+
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+
+class Metrics:
+    """The sources of the metrics that MetricsServer exposes.
+
+    Created by the DataBase when `Options.metrics_port` is set. Producers register
+    the consumer pool and stream shards they start, see `Candle.get_tasks()`.
+    Latency histograms are read from `db.latency`.
+    """
+
+    def __init__(self) -> None:
+        self.pool:   Optional[Any] = None  # ConsumerPool
+        self.shards: List[Any]     = []    # StreamShard
+
+
+    def register(self, pool: Any = None, shards: List[Any] = ()) -> None:
+        if pool is not None:
+            self.pool = pool
+        self.shards.extend(shards)
+
+
+    def render(self, db: Any) -> str:
+        """Returns all metrics in the Prometheus text format.
+
+        Only reads counters that the consumers and producers keep anyway,
+        so it can run in another thread than the event loop.
+        """
+
+        out = []
+
+        def metric(name, kind, text, samples):
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                out.append(f"{name}{labels} {value}")
+
+        pool = self.pool
+        if pool is not None:
+            processed = pool.n_processed()
+            metric(
+                "bbot_messages_processed_total", "counter", "Items processed by the consumers.",
+                [(f'{{content_type="{t.value}"}}', n) for t, n in sorted(processed.items(), key=str) if t],
+            )
+            errors = pool.n_errors()
+            metric(
+                "bbot_consumer_errors_total", "counter", "Items that raised and were skipped by the consumers.",
+                [(f'{{content_type="{t.value}"}}', n) for t, n in sorted(errors.items(), key=str) if t],
+            )
+            stats = [q.stats() for q in pool.queues]
+            for key, name, kind, text in (
+                ("size",      "bbot_queue_depth",           "gauge",   "Items waiting in the consumer queue."),
+                ("dropped",   "bbot_queue_dropped_total",   "counter", "Stream updates dropped by a full queue."),
+                ("conflated", "bbot_queue_conflated_total", "counter", "Stream updates replaced by a newer one."),
+                ("blocked",   "bbot_queue_blocked_total",   "counter", "Times a producer waited for a full queue."),
+            ):
+                metric(name, kind, text, [(f'{{shard="{i}"}}', s[key]) for i, s in enumerate(stats)])
+
+        if self.shards:
+            labels = [f'{{shard="{s.shard_id}"}}' for s in self.shards]
+            metric(
+                "bbot_stream_messages_total", "counter", "Messages received per websocket connection.",
+                [(l, s.n_messages) for l, s in zip(labels, self.shards)],
+            )
+            metric(
+                "bbot_stream_reconnects_total", "counter", "Reconnects per websocket connection.",
+                [(l, s.n_reconnects) for l, s in zip(labels, self.shards)],
+            )
+
+        if db.latency is not None:
+            self._render_latency(db.latency, metric)
+
+        return "\n".join(out) + "\n"
+
+
+    @staticmethod
+    def _render_latency(latency: Any, metric: Any) -> None:
+        # One histogram per stage and content type, of all symbols, see LatencyStats.totals.
+        totals  = latency.select_totals()
+        samples = []
+        for stream, stage in sorted(totals, key=lambda k: str(k[::-1])):
+            labels = f'stage="{stage.value.lower()}",content_type="{stream.value}"'
+            samples.extend(Metrics._histogram(totals[(stream, stage)], labels))
+        metric(
+            "bbot_latency_seconds", "histogram",
+            "Time per processing stage. Feature is the feature computation time, "
+            "delay is the exchange event time to processed.",
+            samples,
+        )
+
+        if latency.features:
+            samples = []
+            for name, h in sorted(list(latency.features.items())):
+                samples.extend(Metrics._histogram(h, f'feature="{name}"'))
+            metric("bbot_feature_seconds", "histogram", "Compute time per feature, per window.", samples)
+
+
+    @staticmethod
+    def _histogram(h: LatencyHistogram, labels: str) -> List[Tuple[str, float]]:
+        samples = []
+        bounds  = [int(b * 1e9) for b in LATENCY_BUCKETS]
+        for b, n in zip(LATENCY_BUCKETS, h.cumulative(bounds)):
+            samples.append((f'_bucket{{{labels},le="{b:g}"}}', n))
+        samples.append((f'_bucket{{{labels},le="+Inf"}}', h.n))
+        samples.append((f"_sum{{{labels}}}", h.total / 1e9))
+        samples.append((f"_count{{{labels}}}", h.n))
+        return samples
+
+
+
+class MetricsServer:
+    """Serves `db.metrics` on http://host:port/metrics, for Prometheus to scrape.
+
+    The server runs in a daemon thread, a scrape does not wait for the event loop.
+    Port 0 binds a free port, `port` is the bound port after `start()`.
+
+    Usage:
+        server = MetricsServer(db, 9100).start()
+        ...
+        server.stop()
+    """
+
+    def __init__(self, db: Any, port: int, host: str = "127.0.0.1") -> None:
+        self.db      = db
+        self.host    = host
+        self.port    = port
+        self._server = None
+
+
+    def start(self) -> "MetricsServer":
+        metrics = self.db.metrics
+        db      = self.db
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render(db).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logging.debug(f"Metrics: {format % args}")
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port    = self._server.server_address[1]
+        threading.Thread(
+            target=self._server.serve_forever, name="bbot-metrics", daemon=True
+        ).start()
+        logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        return self
+
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
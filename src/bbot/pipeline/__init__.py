@@ -0,0 +1 @@
+from .pipe import HistoricalCandlePipe, Pipeline, StreamCandlePipe
@@ -0,0 +1,167 @@
+import logging
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from ..constants import INTERVAL_MS, INTERVAL_OFFSET_MS, Interval
+
+
+# Column order of IntervalAggregator._price and IntervalAggregator._volume
+PRICE_FIELDS  = ("open_price", "high_price", "low_price", "close_price")
+VOLUME_FIELDS = ("base_volume", "quote_volume", "base_volume_taker", "quote_volume_taker")
+
+
+class IntervalAggregator:
+    """Aggregates the 1m kline stream of one symbol into all its windows.
+
+    Every supported interval is a whole multiple of one minute, so the
+    aggregation tree is flat: all intervals are parents of the 1m leaf.
+    The open candle of every interval is kept in one row of a small matrix,
+    and a 1m update is folded into all rows with a handful of vectorized
+    NumPy operations. The cost per message therefore does not depend on
+    the number of windows.
+
+    The open candles are not copied into the windows on every message.
+    Each window's last timeframe is bound to its row and reads it lazily,
+    see `CandleBuffer.bind_live()`. A row is only written out explicitly
+    when its interval rolls over, which happens once per interval.
+
+    The matrices use the dtype of the window buffers: float64, or int64
+    when the windows store scaled prices and volumes. Volumes are summed
+    in int64 then, and an OverflowError is raised when a sum wraps around.
+
+    A late update of a kline whose candle already rolled over in a window is
+    dropped and counted in `n_late`: its open candles are already closed.
+
+    The 2 second window is not aggregated here: its candles are derived
+    from the difference between two consecutive updates instead.
+    """
+
+    def __init__(self, windows: Dict[Interval, "Window"]) -> None:
+        self.intervals = sorted(
+            (iv for iv in windows if iv != Interval.SECOND_2), key=INTERVAL_MS.get
+        )
+        n = len(self.intervals)
+        self.version    = 0
+        self.n_late     = 0
+        self._windows   = [windows[iv] for iv in self.intervals]
+        self._dtype     = self._windows[0].timeframes.dtype if n else np.dtype(np.float64)
+        self._length    = np.array([INTERVAL_MS[iv] for iv in self.intervals], dtype=np.int64)
+        self._offset    = np.array([INTERVAL_OFFSET_MS[iv] for iv in self.intervals], dtype=np.int64)
+        self._open_time = np.full(n, -1, dtype=np.int64)
+        self._price     = np.zeros((n, len(PRICE_FIELDS)), dtype=self._dtype)
+        self._volume    = np.zeros((n, len(VOLUME_FIELDS)), dtype=self._dtype)
+        self._n_trades  = np.zeros(n, dtype=np.int64)
+
+        # Previous 1m update: (open_time, volumes, n_trades, closed)
+        self._last: Optional[Tuple[int, np.ndarray, int, bool]] = None
+
+
+    def update(self, open_time: int, candle, closed: bool) -> bool:
+        """Folds a single 1m kline update into the open candle of every interval.
+
+        `open_time` is the open time of the 1m kline in epoch milliseconds,
+        `candle` holds its cumulative values so far and
+        `closed` tells whether this is the final update of the 1m kline.
+        Returns False when the update is late and was dropped.
+        """
+
+        volume = np.array([getattr(candle, f) for f in VOLUME_FIELDS], dtype=self._dtype)
+        n      = int(candle.n_trades)
+
+        if self._last is None:
+            # Without a previous update the volume delta is unknown.
+            self._seed(open_time)
+            self._last = (open_time, volume, n, closed)
+            return True
+
+        start  = (open_time - self._offset) // self._length * self._length + self._offset
+        if (start < self._open_time).any():
+            if not self.n_late:
+                logging.warning(f"Dropped a late kline update of {open_time}, its candle is closed.")
+            self.n_late += 1
+            return False
+        last_open_time, last_volume, last_n, last_closed = self._last
+        if last_closed or last_open_time != open_time:
+            d_volume, d_n = volume, n
+        else:
+            d_volume, d_n = volume - last_volume, n - last_n
+
+        rolled = np.flatnonzero(start > self._open_time)
+        for row in rolled:
+            # A candle that opens halfway a 1m kline also gets its earlier volume.
+            self._roll(row, int(start[row]), candle.open_price, volume - d_volume, n - d_n)
+
+        price = self._price
+        np.maximum(price[:, 1], candle.high_price, out=price[:, 1])
+        np.minimum(price[:, 2], candle.low_price, out=price[:, 2])
+        price[:, 3] = candle.close_price
+        self._volume   += d_volume
+        self._n_trades += d_n
+        if self._dtype.kind == "i" and (self._volume < 0).any():
+            raise OverflowError("Volume of an open candle is too large for int64, see Scale.")
+
+        self.version += 1
+        self._last = (open_time, volume, n, closed)
+        return True
+
+
+    def write(self, row: int, columns: Dict[str, np.ndarray], idx: int) -> None:
+        """Copies the open candle in `row` to slot `idx` of a CandleBuffer."""
+
+        for j, f in enumerate(PRICE_FIELDS):
+            columns[f][idx] = self._price[row, j]
+        for j, f in enumerate(VOLUME_FIELDS):
+            columns[f][idx] = self._volume[row, j]
+        columns["n_trades"][idx]   = self._n_trades[row]
+        columns["has_candle"][idx] = True
+
+
+    # Internal
+
+    def _seed(self, open_time: int) -> None:
+        """Takes over the open candle of every window, as downloaded with the history."""
+
+        start = (open_time - self._offset) // self._length * self._length + self._offset
+        for row, window in enumerate(self._windows):
+            buffer = window.timeframes
+            if buffer and buffer[-1].candle is not None:
+                last = buffer[-1]
+                if last.open_time_ms == start[row]:
+                    c = last.candle
+                    self._open_time[row] = start[row]
+                    self._price[row]     = [getattr(c, f) for f in PRICE_FIELDS]
+                    self._volume[row]    = [getattr(c, f) for f in VOLUME_FIELDS]
+                    self._n_trades[row]  = c.n_trades
+                    buffer.bind_live(self, row)
+
+
+    def _roll(
+        self, 
+        row:        int, 
+        start:      int, 
+        open_price: float, 
+        volume:     np.ndarray, 
+        n_trades:   int
+    ) -> None:
+        """Closes the open candle in `row` and starts a new one at `start`."""
+
+        buffer = self._windows[row].timeframes
+        if self._open_time[row] >= 0:
+            buffer.unbind_live()
+
+        self._open_time[row] = start
+        lowest, highest      = self._extremes()
+        self._price[row]     = (open_price, lowest, highest, open_price)
+        self._volume[row]    = volume
+        self._n_trades[row]  = n_trades
+
+        buffer.append_row(start, start + int(self._length[row]) - 1)
+        buffer.bind_live(self, row)
+
+
+    def _extremes(self) -> Tuple:
+        if self._dtype.kind == "f":
+            return -np.inf, np.inf
+        info = np.iinfo(self._dtype)
+        return info.min, info.max
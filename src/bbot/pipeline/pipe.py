@@ -2,25 +2,58 @@
 
 from abc import ABC, abstractmethod
 from collections import Counter
-from datetime import datetime, timedelta
-from typing import Any, List
+from typing import Any, Dict, List, Optional
 
-from ..constants import ContentType, Interval, InTimeFrame
-from models.candle import Candle
-from models.database import DataBase
-from models.timeframe import TimeFrame
-from models.window import Window
+import numpy as np
 
-class Pipeline(ABC):
-    """Handles insertion of content in the database."""
+from ..constants import INTERVAL_MS, ContentType, Interval, InTimeFrame
+from .aggregation import IntervalAggregator
+from .timeslots import which_slot
+from ...models.candle import Candle, ParsedKline, ValidationSampler
+from ...models.database import DataBase
+from ...models.scale import Scale
+from ...models.window import Window
 
-    
-    n_items_processed = Counter(
-        {
-            ContentType.CANDLE_HISTORY: 0,
-            ContentType.CANDLE_STREAM:  0,
+class Pipeline(ABC):
+    """Handles insertion of content in the database.
+
+    All routing is looked up in tables that are built once, in `__init__()`:
+    content type -> the windows to update, and timeframe position -> handler.
+    """
+
+
+    # Which windows of a symbol an item of a content type is inserted in.
+    ONE_WINDOW  = "ONE_WINDOW"
+    ALL_WINDOWS = "ALL_WINDOWS"
+    WINDOWS     = {
+        ContentType.CANDLE_HISTORY: ONE_WINDOW,
+        ContentType.CANDLE_STREAM:  ALL_WINDOWS,
+    }
+
+
+    def __init__(self) -> None:
+        # Per pipeline, every consumer shard counts its own items.
+        self.n_items_processed = Counter(
+            {
+                ContentType.CANDLE_HISTORY:       0,
+                ContentType.CANDLE_HISTORY_BLOCK: 0,
+                ContentType.CANDLE_STREAM:        0,
+            }
+        )
+        apply_on_windows = {
+            self.ONE_WINDOW:  self._one_window,
+            self.ALL_WINDOWS: self._all_windows,
+        }
+        self._apply_on_windows = {
+            contenttype: apply_on_windows[windows] for contenttype, windows in self.WINDOWS.items()
+        }
+        self._handlers = {
+            InTimeFrame.FIRST:    self.first,
+            InTimeFrame.PREVIOUS: self.previous,
+            InTimeFrame.CURRENT:  self.current,
+            InTimeFrame.NEXT:     self.nexxt,
+            InTimeFrame.OTHER:    self.data_leakage_error,
         }
-    )
 
 
     def process(
@@ -33,22 +66,8 @@ class Pipeline(ABC):
     ) -> DataBase:
         """Calls process_window() for the windows that should be updated."""
 
-        self.n_items_processed.update(contenttype)
-
-        def one_window(self):
-            db.symbols[symbol].windows[interval] = self.process_window(
-                contenttype, payload, db.symbols[symbol].windows[interval]
-            )
-
-        def all_windows(self):
-            for iv, w in db.symbols[symbol].windows.items():
-                db.symbols[symbol].windows[iv] = self.process_window(contenttype, payload, w)
-
-        apply_on_windows = {
-            ContentType.CANDLE_HISTORY: one_window,
-            ContentType.CANDLE_STREAM:  all_windows,
-        }
-        apply_on_windows[contenttype]()
+        self.n_items_processed[contenttype] += 1
+        self._apply_on_windows[contenttype](db.symbols[symbol].windows, interval, contenttype, payload)
         return db
 
 
@@ -60,62 +79,46 @@ class Pipeline(ABC):
     ) -> Window:
         """Interface for all pipelines. Payload is inserted in window and window is returned."""
 
-        if not window._history_downloaded and not contenttype == ContentType.CANDLE_HISTORY:
-            pass
-
-        tf = {
-            InTimeFrame.FIRST: self.first,
-            InTimeFrame.PREVIOUS: self.previous,
-            InTimeFrame.CURRENT: self.current,
-            InTimeFrame.NEXT: self.nexxt,
-            InTimeFrame.OTHER: self.data_leakage_error,
-        }
-
         close_time = self.get_close_time(payload)
-        in_tf = self.which_timeframe(close_time, window)
-
-        return tf[in_tf](payload, window)
-
+        in_tf      = self.which_timeframe(close_time, window)
+        return self._handlers[in_tf](payload, window)
 
 
-    def which_timeframe(self, close_time, window) -> str:
-        """Returns which timeframe the item belongs to."""
+    def _one_window(self, windows: Dict[Interval, Window], interval, contenttype, payload) -> None:
+        windows[interval] = self.process_window(contenttype, payload, windows[interval])
 
-        if not window.timeframes:
-            return InTimeFrame.FIRST
 
-        tf = window.timeframes[-1]
-        delta = tf.close_time - tf.open_time
+    def _all_windows(self, windows: Dict[Interval, Window], interval, contenttype, payload) -> None:
+        for iv, w in windows.items():
+            windows[iv] = self.process_window(contenttype, payload, w)
 
-        if close_time > tf.close_time + delta:
-            raise Exception("Error in timeframe creation.")
 
-        if close_time > tf.close_time:
-            return InTimeFrame.NEXT
 
-        if close_time > tf.open_time:
-            return InTimeFrame.CURRENT
+    def which_timeframe(self, close_time: int, window: Window) -> InTimeFrame:
+        """Returns which timeframe the item belongs to. Close time in epoch ms."""
 
-        if close_time > tf.open_time - delta:
-            return InTimeFrame.PREVIOUS
+        if not window.timeframes:
+            return InTimeFrame.FIRST
+        return which_slot(
+            close_time, window.timeframes.last_open_time(), INTERVAL_MS[window.interval]
+        )
 
-        return InTimeFrame.OTHER
-  
 
 
-    def data_leakage_error(self):
+    def data_leakage_error(self, payload: Any, window: Window) -> Window:
         e = """Data leakage: bbot cannot process the data fast enough. 
         Reduce the number of data sources or try to increase the performance
-        of your feature calculation functions.
+        of your feature calculation functions, or compute them in worker
+        processes with `Options.feature_workers`.
         """
 
         raise Exception(e)
 
 
     @abstractmethod
-    def get_close_time(self, payload: Any) -> datetime:
+    def get_close_time(self, payload: Any) -> int:
         """Parse and return close time in payload.
-        Returns datetime object.
+        Returns epoch milliseconds.
         """
 
         pass
@@ -159,27 +162,122 @@ class Pipeline(ABC):
 
     # Helperfuncs
 
-    def round_time(self, close_time: datetime):
-        """Rounds time to closest possible 2-second close time -1.
+    def round_time(self, close_time: int) -> int:
+        """Rounds time in epoch ms down to the whole second, minus 1 ms.
         Used to get 2 second candle close time based on event time.
         """
       
-        return close_time - timedelta(microseconds=close_time.microsecond) - timedelta(milliseconds=1)
+        return close_time // 1000 * 1000 - 1
 
 
 class HistoricalCandlePipe(Pipeline):
+    """Inserts historical klines in a window, oldest first.
+
+    Klines come straight from the exchange and are parsed without validation,
+    except for one in `validation_sample_rate`.
+
+    A whole page of klines can be inserted at once with `process_block()`.
+    """
+
+    # Column name and index of every field in a historical kline.
+    PRICE_COLUMNS  = (("open_price", 1), ("high_price", 2), ("low_price", 3), ("close_price", 4))
+    QTY_COLUMNS    = (("base_volume", 5), ("base_volume_taker", 9))
+    QUOTE_COLUMNS  = (("quote_volume", 7), ("quote_volume_taker", 10))
+
+
+    def __init__(self, validation_sample_rate: int = 0) -> None:
+        super().__init__()
+        self.validate = ValidationSampler(validation_sample_rate)
+
+
+    def process_block(
+        self,
+        symbol:   str,
+        interval: Interval,
+        payload:  List[List],
+        db:       DataBase
+    ) -> DataBase:
+        """Inserts a page of historical klines in a window in one operation.
+
+        The page is parsed column-wise, checked for continuity in one vectorized
+        pass, and written to the window with `CandleBuffer.extend()`.
+        Klines the window already has are skipped, see `skip_known()`.
+        """
+
+        self.n_items_processed[ContentType.CANDLE_HISTORY_BLOCK] += 1
+        if not len(payload):
+            return db
+
+        window  = db.symbols[symbol].windows[interval]
+        columns = self.parse_block(payload, window.scale)
+        for i in self.validate.select(len(payload)):
+            if Candle.parse_historical_candle(payload[i]) is None:
+                columns["corrupt"][i] = True
+        columns = self.skip_known(columns, window)
+        self.check_continuity(columns, window)
+        window.timeframes.extend(columns)
+        return db
+
+
+    @staticmethod
+    def parse_block(payload: List[List], scale: Optional[Scale] = None) -> Dict[str, np.ndarray]:
+        """Parses a page of historical klines into one array per CandleBuffer column."""
+
+        rows    = np.array(payload, dtype=object)
+        columns = {
+            "open_time":  rows[:, 0].astype(np.int64),
+            "close_time": rows[:, 6].astype(np.int64),
+            "n_trades":   rows[:, 8].astype(np.int64),
+            "corrupt":    np.zeros(len(rows), dtype=bool),
+        }
+        converters = (
+            (HistoricalCandlePipe.PRICE_COLUMNS, scale.prices if scale else None),
+            (HistoricalCandlePipe.QTY_COLUMNS,   scale.quantities if scale else None),
+            (HistoricalCandlePipe.QUOTE_COLUMNS, scale.quote_quantities if scale else None),
+        )
+        for fields, convert in converters:
+            for name, j in fields:
+                columns[name] = convert(rows[:, j]) if convert else rows[:, j].astype(np.float64)
+        return columns
+
 
-    def get_close_time(self, payload: List, window: Window) -> datetime:
-        return datetime(payload[6])
+    @staticmethod
+    def skip_known(columns: Dict[str, np.ndarray], window: Window) -> Dict[str, np.ndarray]:
+        """Drops the klines the window already has, like candles loaded from the store.
+
+        Only a block that reaches past the last timeframe of the window is trimmed.
+        """
+
+        if not window.timeframes:
+            return columns
+        last      = window.timeframes.last_open_time()
+        open_time = columns["open_time"]
+        if open_time[0] <= last < open_time[-1]:
+            known   = np.searchsorted(open_time, last, side="right")
+            columns = {name: values[known:] for name, values in columns.items()}
+        return columns
+
+
+    @staticmethod
+    def check_continuity(columns: Dict[str, np.ndarray], window: Window) -> None:
+        """Raises if the block has gaps, has the wrong interval or does not continue the window."""
+
+        length     = INTERVAL_MS[window.interval]
+        open_time  = columns["open_time"]
+        close_time = columns["close_time"]
+        if (np.diff(open_time) != length).any() or (close_time - open_time != length - 1).any():
+            raise Exception("Historical klines are not continuous.")
+        if window.timeframes and open_time[0] != window.timeframes[-1].open_time_ms + length:
+            raise Exception("Historical klines do not continue the window.")
+
+
+    def get_close_time(self, payload: List) -> int:
+        return payload[6]
 
 
     def first(self, payload: List, window: Window) -> Window:
-        o = datetime(payload[0])
-        c = datetime(payload[6])
-        timeframe = TimeFrame(open_time=o, close_time=c)
-        window.timeframes[0] = timeframe
-        candle = Candle.parse_historical_candle(payload)
-        window.timeframes[0].candle = candle
+        candle = Candle.parse_historical_candle_fast(payload, self.validate(), window.scale)
+        window.timeframes.append_row(payload[0], payload[6], candle)
         return window
 
 
@@ -192,49 +290,115 @@ class HistoricalCandlePipe(Pipeline):
 
 
     def nexxt(self, payload: List, window: Window) -> Window:
-        o = datetime(payload[0])
-        c = datetime(payload[6])
-        timeframe = TimeFrame(open_time=o, close_time=c)
-        window.timeframes.append(timeframe)
-        candle = Candle.parse_historical_candle(payload)
-        window.timeframes[-1].candle = candle
+        candle = Candle.parse_historical_candle_fast(payload, self.validate(), window.scale)
+        window.timeframes.append_row(payload[0], payload[6], candle)
         return window
 
 
 class StreamCandlePipe(Pipeline):
+    """Updates the windows of a symbol with 1m kline updates from the stream.
+
+    Payloads are ParsedKline objects, see `Candle.parse_kline()`. The raw
+    message is parsed once before it enters the pipeline and the result
+    is shared by every window handler.
+
+    The 2s window is updated through `process_window()`, all other windows
+    are updated at once by the IntervalAggregator of the symbol.
+
+    A 2s candle is the difference between two consecutive updates. When updates
+    were dropped or conflated by a full queue, the 2s slots without an update
+    get a timeframe without candle, and the next candle holds everything since
+    the last update that was processed, see `fill_gap()`.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.aggregators: dict[str, IntervalAggregator] = dict()
+
+
+    def process(
+        self, 
+        symbol:      str, 
+        interval:    Interval, 
+        contenttype: ContentType, 
+        payload:     ParsedKline, 
+        db:          DataBase
+    ) -> DataBase:
+        """Passes a kline update to the aggregator of the symbol and to the 2s window.
+
+        A late update that the aggregator drops is not passed to the 2s window either,
+        it does not follow the last update there. See `IntervalAggregator.n_late`.
+        """
+
+        self.n_items_processed[contenttype] += 1
+        windows = db.symbols[symbol].windows
+
+        if symbol not in self.aggregators:
+            self.aggregators[symbol] = IntervalAggregator(windows)
+        if not self.aggregators[symbol].update(payload.open_time, payload.candle, payload.closed):
+            return db
+
+        if Interval.SECOND_2 in windows:
+            self.fill_gap(payload, windows[Interval.SECOND_2])
+            windows[Interval.SECOND_2] = self.process_window(
+                contenttype, payload, windows[Interval.SECOND_2]
+            )
+        return db
+
 
     # required by super
-    def get_close_time(self, payload: dict, window: Window) -> datetime:
-        return super().round_time(datetime(payload["E"]))
+    def get_close_time(self, payload: ParsedKline) -> int:
+        return super().round_time(payload.event_time)
 
 
-    def set_last_update(self, payload: dict, window: Window) -> Window:
-        candle_1m = Candle.parse_candle(payload)
-        closed = bool(payload["x"])
-        window._last_candle_update = candle_1m
-        window._last_candle_update_closed = closed
+    def set_last_update(self, payload: ParsedKline, window: Window) -> Window:
+        window._last_candle_update = payload.candle
+        window._last_candle_update_closed = payload.closed
+        window._last_update_open_time = payload.open_time
         return window
 
 
+    def last_update_closed(self, payload: ParsedKline, window: Window) -> bool:
+        """Whether the last update ended its kline. Also when the final update of that
+        kline was dropped: the volumes of `payload` then start from zero as well.
+        """
+
+        return window._last_candle_update_closed or window._last_update_open_time != payload.open_time
+
+
+    def fill_gap(self, payload: ParsedKline, window: Window) -> None:
+        """Appends a timeframe without candle for every 2s slot between the last timeframe
+        of `window` and the one of `payload`, so that `payload` goes in the next slot.
+        """
+
+        if not window.timeframes:
+            return
+        length   = INTERVAL_MS[window.interval]
+        last     = window.timeframes.last_open_time()
+        missing  = (self.get_close_time(payload) - last) // length - 1
+        # Only the last `capacity` slots stay in a bounded window.
+        capacity = window.timeframes.capacity
+        first    = max(1, missing - capacity + 1) if capacity else 1
+        for k in range(first, missing + 1):
+            o = last + k * length
+            window.timeframes.append_row(o, o + length - 1)
+
+
     # required by super
-    def first(self, payload: dict, window: Window) -> Window:
+    def first(self, payload: ParsedKline, window: Window) -> Window:
 
         if not window._last_candle_update:
             window = self.set_last_update(payload, window)
             return window
 
         if window.interval == Interval.SECOND_2:
-            c = super().round_time(datetime(payload["E"]))
-            o = c - timedelta(milliseconds=1999)
-            timeframe = TimeFrame(open_time=o, close_time=c)
-            window.timeframes[0] = timeframe
-            candle_1m = Candle.parse_candle(payload)
+            c = self.get_close_time(payload)
             candle_2s = Candle.create_2s_candle(
-                candle_1m, 
+                payload.candle, 
                 window._last_candle_update, 
-                window._last_candle_update_closed
+                self.last_update_closed(payload, window)
             )
-            window.timeframes[0].candle = candle_2s
+            window.timeframes.append_row(c - 1999, c, candle_2s)
             window = self.set_last_update(payload, window)
             return window
 
@@ -242,10 +406,10 @@ class StreamCandlePipe(Pipeline):
             raise Exception("Tried to insert candle from stream before history downloaded.")
         
 
-    def update(self, payload, window, idx) -> Window:
+    def update(self, payload: ParsedKline, window: Window, idx: int) -> Window:
         window.timeframes[idx].candle = Candle.update(
             candle=window.timeframes[idx].candle, 
-            update=Candle.parse_candle(payload), 
+            update=payload.candle, 
             previous_update=window._last_candle_update,
             previous_update_closed=window._last_candle_update_closed
         )
@@ -254,7 +418,7 @@ class StreamCandlePipe(Pipeline):
 
 
     # required by super
-    def previous(self, payload: dict, window: Window) -> Window:
+    def previous(self, payload: ParsedKline, window: Window) -> Window:
         if window.interval == Interval.SECOND_2:
             raise Exception("Tried to update previous 2 second timeframe.")
         window = self.update(payload, window, -2)
@@ -262,7 +426,7 @@ class StreamCandlePipe(Pipeline):
 
 
     # required by super
-    def current(self, payload: dict, window: Window) -> Window:
+    def current(self, payload: ParsedKline, window: Window) -> Window:
         if window.interval == Interval.SECOND_2:
             raise Exception("Tried to update 2 second timeframe.")
         window = self.update(payload, window, -1)
@@ -270,24 +434,22 @@ class StreamCandlePipe(Pipeline):
 
 
     def add_new_timeframe(self, window) -> Window:
-        timeframe = TimeFrame.create_next_timeframe(
-            window.timeframes[-1].open_time, 
-            window.timeframes[-1].close_time
-        )
-        window.timeframes.append(timeframe)
+        length = INTERVAL_MS[window.interval]
+        o      = window.timeframes[-1].open_time_ms + length
+        window.timeframes.append_row(o, o + length - 1)
         return window
 
 
     # required by super
-    def nexxt(self, payload: dict, window: Window) -> Window:
-        candle = Candle.parse_candle(payload)
+    def nexxt(self, payload: ParsedKline, window: Window) -> Window:
+        candle = payload.candle
         if window.interval == Interval.SECOND_2:
             candle = Candle.create_2s_candle(
                 candle, 
                 window._last_candle_update, 
-                window._last_candle_update_closed
+                self.last_update_closed(payload, window)
             )
         window = self.add_new_timeframe(window)
         window.timeframes[-1].candle = candle
         window = self.set_last_update(payload, window)
-        return window
\ No newline at end of file
+        return window
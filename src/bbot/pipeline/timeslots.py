@@ -0,0 +1,62 @@
+from typing import Union
+
+import numpy as np
+
+from ..constants import INTERVAL_MS, INTERVAL_OFFSET_MS, Interval, InTimeFrame
+
+
+# Position of a timestamp relative to the last timeframe of a window,
+# in timeframes: -1 is the previous one, 0 the current one, 1 the next one.
+# Everything older is OTHER, anything past the next one is an error.
+PREVIOUS = -1
+CURRENT  = 0
+NEXT     = 1
+TOO_OLD  = -2
+TOO_NEW  = 2
+
+RELATIVE_SLOTS = {
+    PREVIOUS: InTimeFrame.PREVIOUS,
+    CURRENT:  InTimeFrame.CURRENT,
+    NEXT:     InTimeFrame.NEXT,
+}
+
+
+
+def slot_open(t_ms: int, interval: Interval) -> int:
+    """Returns the open time of the aligned timeframe of `interval` that contains `t_ms`."""
+
+    length = INTERVAL_MS[interval]
+    offset = INTERVAL_OFFSET_MS[interval]
+    return (t_ms - offset) // length * length + offset
+
+
+def slot_opens(t_ms: np.ndarray, interval: Interval) -> np.ndarray:
+    """Vectorized `slot_open()`."""
+
+    length = INTERVAL_MS[interval]
+    offset = INTERVAL_OFFSET_MS[interval]
+    return (np.asarray(t_ms, dtype=np.int64) - offset) // length * length + offset
+
+
+def which_slot(t_ms: int, last_open_ms: int, length: int) -> InTimeFrame:
+    """Returns where `t_ms` belongs, relative to the timeframe that opened at `last_open_ms`.
+
+    Timeframes are `length` ms long and counted from `last_open_ms`, so they do not
+    have to be aligned to the epoch. Raises if `t_ms` lies past the next timeframe.
+    """
+
+    rel = (t_ms - last_open_ms) // length
+    if rel > NEXT:
+        raise Exception("Error in timeframe creation.")
+    return RELATIVE_SLOTS.get(rel, InTimeFrame.OTHER)
+
+
+def which_slots(t_ms: Union[np.ndarray, list], last_open_ms: int, length: int) -> np.ndarray:
+    """Vectorized `which_slot()`.
+
+    Returns an int8 array of relative slots, clipped to TOO_OLD and TOO_NEW
+    instead of raising. See RELATIVE_SLOTS.
+    """
+
+    rel = (np.asarray(t_ms, dtype=np.int64) - last_open_ms) // length
+    return np.clip(rel, TOO_OLD, TOO_NEW).astype(np.int8)
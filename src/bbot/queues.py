@@ -0,0 +1,214 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from .constants import QueuePolicy
+
+
+# Marks an entry that was dropped while it was still in the queue.
+_DROPPED = object()
+
+# Returned by a get of an empty queue after `wake()`.
+WAKE = object()
+
+
+
+class BoundedQueue:
+    """Bounded FIFO queue with an overload policy, safe to use from threads and event loops.
+
+    Producers `await put()`, consumers `await get()` in an event loop or call
+    `get_blocking()` in a thread. When the queue holds `maxsize` items, `policy` decides:
+
+    BLOCK:       the producer waits until there is room.
+    DROP_OLDEST: the oldest item that has a key is dropped.
+    CONFLATE:    the new item replaces the queued item with the same key, in its
+                 place in the queue. Without such an item the oldest one is dropped.
+
+    `key(item)` returns the conflation key of an item, or None for items that must never
+    be dropped or replaced. Those items make the producer wait, whatever the policy.
+    A maxsize of 0 means unbounded.
+
+    `wake()` makes a get of the empty queue return WAKE instead of waiting, once,
+    so that a consumer can be told about work done in the background.
+    """
+
+    def __init__(
+        self,
+        maxsize: int                                 = 0,
+        policy:  QueuePolicy                         = QueuePolicy.BLOCK,
+        key:     Optional[Callable[[Any], Hashable]] = None,
+    ) -> None:
+        self.maxsize     = maxsize
+        self.policy      = QueuePolicy(policy)
+        self.key         = key or (lambda item: None)
+        self.n_put       = 0     # items accepted
+        self.n_dropped   = 0     # items dropped by DROP_OLDEST or CONFLATE
+        self.n_conflated = 0     # items replaced by a newer one with CONFLATE
+        self.n_blocked   = 0     # puts that had to wait for room
+        self._entries    = deque()    # [item, key], oldest first
+        self._index      = dict()     # key -> entry
+        self._size       = 0
+        self._lock       = threading.Lock()
+        self._changed    = threading.Condition(self._lock)
+        self._waiters    = []         # asyncio futures of waiting puts and gets
+        self._woken      = False
+
+
+    def __len__(self) -> int:
+        return self._size
+
+
+    def qsize(self) -> int:
+        return self._size
+
+
+    async def put(self, item: Any) -> None:
+        """Adds an item, applying the overload policy when the queue is full."""
+
+        waited = False
+        while True:
+            with self._lock:
+                if self._offer(item):
+                    return
+                if not waited:
+                    self.n_blocked += 1
+                    waited = True
+                fut = asyncio.get_running_loop().create_future()
+                self._waiters.append(fut)
+            await fut
+
+
+    def put_blocking(self, item: Any) -> None:
+        """Like `put()`, for producers in a thread."""
+
+        with self._changed:
+            if not self._offer(item):
+                self.n_blocked += 1
+                while not self._offer(item):
+                    self._changed.wait()
+
+
+    def close(self) -> None:
+        """Adds None to the end of the queue, regardless of maxsize. Consumers stop on None."""
+
+        with self._lock:
+            self._append(None, None)
+
+
+    def wake(self) -> None:
+        """Makes the next get return WAKE if the queue is empty. Safe to call from any thread."""
+
+        with self._lock:
+            self._woken = True
+            self._notify()
+
+
+    async def get(self) -> Any:
+        while True:
+            with self._lock:
+                if self._size:
+                    return self._take()
+                if self._woken:
+                    self._woken = False
+                    return WAKE
+                fut = asyncio.get_running_loop().create_future()
+                self._waiters.append(fut)
+            await fut
+
+
+    def get_blocking(self) -> Any:
+        with self._changed:
+            while not self._size:
+                if self._woken:
+                    self._woken = False
+                    return WAKE
+                self._changed.wait()
+            return self._take()
+
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size":      self._size,
+            "put":       self.n_put,
+            "dropped":   self.n_dropped,
+            "conflated": self.n_conflated,
+            "blocked":   self.n_blocked,
+        }
+
+
+    # Internal, called with the lock held
+
+    def _offer(self, item: Any) -> bool:
+        """Adds the item if the policy allows it now. Returns False if the producer has to wait."""
+
+        key = self.key(item)
+        if not self.maxsize or self._size < self.maxsize:
+            self._append(item, key)
+            return True
+        if key is None or self.policy == QueuePolicy.BLOCK:
+            return False
+
+        if self.policy == QueuePolicy.CONFLATE and key in self._index:
+            self._index[key][0] = item
+            self.n_conflated   += 1
+            self.n_put         += 1
+            return True
+
+        if not self._drop_oldest():
+            return False
+        self._append(item, key)
+        return True
+
+
+    def _append(self, item: Any, key: Optional[Hashable]) -> None:
+        entry = [item, key]
+        self._entries.append(entry)
+        if key is not None:
+            self._index[key] = entry
+        self._size += 1
+        if item is not None:
+            self.n_put += 1
+        self._notify()
+
+
+    def _take(self) -> Any:
+        entry = self._entries.popleft()
+        while entry[0] is _DROPPED:
+            entry = self._entries.popleft()
+        item, key = entry
+        if key is not None and self._index.get(key) is entry:
+            del self._index[key]
+        self._size -= 1
+        self._notify()
+        return item
+
+
+    def _drop_oldest(self) -> bool:
+        for i, entry in enumerate(self._entries):
+            if entry[0] is _DROPPED or entry[1] is None:
+                continue
+            if self._index.get(entry[1]) is entry:
+                del self._index[entry[1]]
+            if i == 0:
+                self._entries.popleft()
+            else:
+                entry[0] = _DROPPED
+            self._size     -= 1
+            self.n_dropped += 1
+            return True
+        return False
+
+
+    def _notify(self) -> None:
+        self._changed.notify_all()
+        waiters, self._waiters = self._waiters, []
+        for fut in waiters:
+            if not fut.done():
+                fut.get_loop().call_soon_threadsafe(_wake, fut)
+
+
+
+def _wake(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
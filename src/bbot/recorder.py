@@ -0,0 +1,234 @@
+import asyncio
+import atexit
+import gzip
+import json
+import logging
+import queue
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Tuple, Union
+
+from binance import BinanceSocketManager
+
+
+# Seconds between flushes of the log, at most this much is lost when the process dies.
+FLUSH_INTERVAL = 1.0
+# Frames replayed at maximum speed before other tasks get a turn.
+REPLAY_BATCH   = 1000
+
+
+
+def read_frames(path: Union[str, Path]) -> Iterator[Tuple[int, Any]]:
+    """Yields tuple(receive time in epoch µs, frame) from a log of FrameWriter.
+
+    A log that ends halfway a write, because the recording process died,
+    is read up to the last complete frame.
+    """
+
+    with gzip.open(path, "rb") as f:
+        try:
+            for line in f:
+                try:
+                    t, frame = json.loads(line)
+                except ValueError:
+                    return
+                yield t, frame
+        except (EOFError, zlib.error):
+            return
+
+
+
+class FrameWriter:
+    """Appends websocket frames to a gzip compressed, append-only log.
+
+    Every line of the log is a json array [receive time in epoch µs, frame].
+    `write()` only timestamps the frame and puts it in a queue, compression
+    and file io run in a background thread, so the event loop is not slowed
+    down. Every session appends a new gzip member, `gzip` reads them as one.
+    """
+
+    def __init__(self, path: Union[str, Path], compresslevel: int = 6) -> None:
+        self.path          = Path(path)
+        self.compresslevel = compresslevel
+        self.n_frames      = 0
+        self._queue        = queue.SimpleQueue()
+        self._thread       = threading.Thread(target=self._run, name="bbot-recorder", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+
+    def write(self, frame: Any) -> None:
+        self._queue.put((time.time_ns() // 1000, frame))
+
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Writes the frames still in the queue and closes the log."""
+
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+
+    def _run(self) -> None:
+        dumps = json.JSONEncoder(separators=(",", ":")).encode
+        with gzip.open(self.path, "ab", self.compresslevel) as f:
+            last_flush = time.monotonic()
+            while True:
+                batch = [self._queue.get()]
+                try:
+                    while True:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                for item in batch:
+                    if item is None:
+                        return
+                    f.write(dumps(item).encode())
+                    f.write(b"\n")
+                self.n_frames += len(batch)
+                if time.monotonic() - last_flush > FLUSH_INTERVAL:
+                    f.flush()
+                    last_flush = time.monotonic()
+
+
+
+class RecordingSocket:
+    """Combined stream connection that writes every frame it receives to a FrameWriter."""
+
+    def __init__(self, connection: Any, writer: FrameWriter) -> None:
+        self.connection = connection
+        self.writer     = writer
+        self.socket     = None
+
+
+    async def __aenter__(self) -> "RecordingSocket":
+        self.socket = await self.connection.__aenter__()
+        return self
+
+
+    async def __aexit__(self, *exc) -> Any:
+        return await self.connection.__aexit__(*exc)
+
+
+    async def recv(self) -> Any:
+        msg = await self.socket.recv()
+        self.writer.write(msg)
+        return msg
+
+
+
+class RecordingSocketManager:
+    """Wraps a BinanceSocketManager and records the raw frames of all its connections.
+
+    Usage:
+        manager = RecordingSocketManager(BinanceSocketManager(client), FrameWriter("frames.jsonl.gz"))
+    """
+
+    def __init__(self, manager: BinanceSocketManager, writer: FrameWriter) -> None:
+        self.manager = manager
+        self.writer  = writer
+
+
+    def multiplex_socket(self, streams: List[str]) -> RecordingSocket:
+        return RecordingSocket(self.manager.multiplex_socket(streams), self.writer)
+
+
+
+class ReplaySocket:
+    """Combined stream connection that returns the recorded frames of its streams.
+
+    Frames without a stream, like error messages, are skipped. After the last
+    frame the connection stays silent, like a connection without traffic.
+    """
+
+    def __init__(self, manager: "ReplaySocketManager", streams: List[str]) -> None:
+        self.manager  = manager
+        self.streams  = set(streams)
+        self.n_frames = 0
+        self._frames  = read_frames(manager.path)
+
+
+    async def __aenter__(self) -> "ReplaySocket":
+        self.manager.start()
+        return self
+
+
+    async def __aexit__(self, *exc) -> None:
+        pass
+
+
+    async def recv(self) -> Any:
+        speed = self.manager.speed
+        for t, frame in self._frames:
+            if not isinstance(frame, dict) or frame.get("stream") not in self.streams:
+                continue
+            self.n_frames += 1
+            if speed is None:
+                if self.n_frames % REPLAY_BATCH == 0:
+                    await asyncio.sleep(0)
+            else:
+                delay = self.manager.due(t) - time.monotonic()
+                if delay > 0.001:
+                    await asyncio.sleep(delay)
+            return frame
+
+        self.manager.finish(self)
+        await asyncio.get_running_loop().create_future()
+
+
+
+class ReplaySocketManager:
+    """Stand-in for BinanceSocketManager that replays a log of FrameWriter.
+
+    Every connection returns the frames of its own streams, in recorded order.
+    With `speed` 1 frames arrive with the same time between them as when they
+    were recorded, with `speed` N N times faster, and with `speed` None as
+    fast as they are read. All connections share one clock, so the order
+    of frames over connections is kept as well. `finished` is set after
+    every connection returned its last frame.
+
+    Usage, to reproduce a recorded session:
+        tasks = Candle.get_tasks(options, client, ReplaySocketManager("frames.jsonl.gz", 10), db, shutdown_flag)
+    """
+
+    def __init__(self, path: Union[str, Path], speed: Optional[float] = 1.0) -> None:
+        self.path     = Path(path)
+        self.speed    = speed
+        self.finished = asyncio.Event()
+        self._sockets = dict()
+        self._done    = set()
+        self._start   = None
+        self._first   = next((t for t, _ in read_frames(self.path)), 0)
+
+
+    def multiplex_socket(self, streams: List[str]) -> ReplaySocket:
+        # A reconnect continues where the previous connection left off.
+        key = frozenset(streams)
+        if key not in self._sockets:
+            self._sockets[key] = ReplaySocket(self, streams)
+        return self._sockets[key]
+
+
+    @property
+    def n_frames(self) -> int:
+        return sum(s.n_frames for s in self._sockets.values())
+
+
+    def start(self) -> None:
+        if self._start is None:
+            self._start = time.monotonic()
+
+
+    def due(self, t: int) -> float:
+        """Monotonic time at which the frame received at `t` µs is replayed."""
+
+        return self._start + (t - self._first) / 1e6 / self.speed
+
+
+    def finish(self, socket: ReplaySocket) -> None:
+        self._done.add(id(socket))
+        if len(self._done) == len(self._sockets):
+            logging.info(f"Replayed {self.n_frames} frames of {self.path}.")
+            self.finished.set()
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from typing import Any, Optional
+
+from binance import AsyncClient
+from binance.exceptions import BinanceAPIException
+
+
+# Request weight of the REST endpoints bbot uses, by AsyncClient method name.
+# See https://binance-docs.github.io/apidocs/spot/en/#limits
+REQUEST_WEIGHTS = {
+    "get_exchange_info":   20,
+    "get_symbol_ticker":   2,
+    "get_order_book":      5,
+    "get_server_time":     1,
+    "ping":                1,
+}
+
+# Weight of get_klines depends on `limit`: (limit below, weight), 10 above
+KLINES_WEIGHTS = ((100, 1), (500, 2), (1001, 5))
+
+# Status codes Binance uses to tell a client to back off.
+# 429: too many requests, 418: ip banned after ignoring 429s.
+THROTTLE_STATUS = (429, 418)
+
+
+
+class TokenBucket:
+    """Token bucket of request weight.
+
+    The bucket holds at most `capacity` tokens and refills at `capacity / period`
+    tokens per second. Waiters are served first come, first served.
+    """
+
+    def __init__(self, capacity: int, period: float = 60.0) -> None:
+        self.capacity      = capacity
+        self.rate          = capacity / period
+        self.tokens        = float(capacity)
+        self._updated      = time.monotonic()
+        self._paused_until = 0.0
+        self._lock         = asyncio.Lock()
+
+
+    async def acquire(self, weight: int) -> None:
+        """Waits until `weight` tokens are available and takes them."""
+
+        weight = min(weight, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._paused_until - time.monotonic()
+                if wait <= 0:
+                    if self.tokens >= weight:
+                        self.tokens -= weight
+                        return
+                    wait = (weight - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+
+    def pause(self, seconds: float) -> None:
+        """Stops handing out tokens for `seconds` and empties the bucket."""
+
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self.tokens        = 0.0
+
+
+    def observe(self, used_weight: int) -> None:
+        """Corrects the bucket with the weight the server says is used."""
+
+        self._refill()
+        self.tokens = min(self.tokens, float(self.capacity - used_weight))
+
+
+    def _refill(self) -> None:
+        now           = time.monotonic()
+        self.tokens   = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+
+class RequestScheduler:
+    """Shared rate limiter for the REST api of Binance.
+
+    Every request takes its weight from a TokenBucket first, so any number of
+    coroutines can download at the same time without exceeding the weight limit.
+    The bucket is synced with the X-MBX-USED-WEIGHT-1M header of a response when
+    it was the only request in flight: the client keeps only its last response,
+    which may belong to another request otherwise.
+
+    A 429 or 418 response pauses all requests for the Retry-After time of the
+    response, and the request is retried. Without Retry-After, a 429 pauses for
+    an exponential backoff, and a 418 (ip banned) for `max_backoff`.
+
+    Usage:
+        scheduler = RequestScheduler(client, options.request_weight_limit)
+        klines = await scheduler.request("get_klines", symbol="BTCUSDT", interval="1m")
+    """
+
+    def __init__(
+        self,
+        client:       AsyncClient,
+        weight_limit: int   = 1200,
+        period:       float = 60.0,
+        max_retries:  int   = 5,
+        max_backoff:  float = 60.0,
+    ) -> None:
+        self.client       = client
+        self.bucket       = TokenBucket(weight_limit, period)
+        self.max_retries  = max_retries
+        self.max_backoff  = max_backoff
+        self.n_requests   = 0
+        self.n_throttled  = 0
+        self._backoff     = 1.0
+        self._in_flight   = 0
+        self._n_started   = 0
+
+
+    async def request(self, method: str, **params) -> Any:
+        """Calls `method` of the client with `params` as soon as the rate limit allows."""
+
+        weight = self.weight(method, params)
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire(weight)
+            self._in_flight += 1
+            self._n_started += 1
+            started          = self._n_started
+            alone            = self._in_flight == 1
+            try:
+                response = await getattr(self.client, method)(**params)
+            except BinanceAPIException as e:
+                if e.status_code not in THROTTLE_STATUS or attempt == self.max_retries:
+                    raise
+                self.throttled(e)
+                continue
+            finally:
+                self._in_flight -= 1
+            self.n_requests += 1
+            self._backoff    = 1.0
+            if alone and self._n_started == started:
+                # No other request ran meanwhile, so client.response is the one of this call.
+                self.sync_used_weight()
+            return response
+
+
+    @staticmethod
+    def weight(method: str, params: dict) -> int:
+        """Returns the request weight of calling `method` with `params`."""
+
+        if method == "get_klines":
+            limit = params.get("limit", 500)
+            return next((w for below, w in KLINES_WEIGHTS if limit < below), 10)
+        return REQUEST_WEIGHTS.get(method, 1)
+
+
+    def throttled(self, e: BinanceAPIException) -> None:
+        """Pauses the bucket after a 429 or 418 response."""
+
+        self.n_throttled += 1
+        retry_after = self._header(e.response, "Retry-After")
+        if retry_after is None and e.status_code == 418:
+            seconds = self.max_backoff
+        elif retry_after is None:
+            seconds       = self._backoff
+            self._backoff = min(2 * self._backoff, self.max_backoff)
+        else:
+            seconds = float(retry_after)
+        logging.warning(f"Binance returned {e.status_code}, pausing requests for {seconds}s.")
+        self.bucket.pause(seconds)
+
+
+    def sync_used_weight(self) -> None:
+        used = self._header(getattr(self.client, "response", None), "X-MBX-USED-WEIGHT-1M")
+        if used is not None:
+            self.bucket.observe(int(used))
+
+
+    @staticmethod
+    def _header(response: Any, name: str) -> Optional[str]:
+        headers = getattr(response, "headers", None)
+        if headers is None:
+            return None
+        return headers.get(name)
@@ -0,0 +1,564 @@
+import asyncio
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+from .constants import INTERVAL_MS, INTERVAL_OFFSET_MS, Interval
+from .streams import stream_symbol
+
+
+# Binance sends a kline update about every 2 seconds per stream.
+STEP_MS = 2000
+DAY_MS  = 86400000
+
+
+
+def simulated_symbols(n: int, quote_asset: str = "USDT") -> List[str]:
+    """Returns `n` made up symbol names, like `SIM0042USDT`."""
+
+    return [f"SIM{i:04d}{quote_asset}" for i in range(n)]
+
+
+def _crc(s: str) -> int:
+    return zlib.crc32(s.lower().encode())
+
+
+def _round_to(x: np.ndarray, size: np.ndarray) -> np.ndarray:
+    """Rounds to a whole number of `size`, but not below one `size`."""
+
+    return np.maximum(np.round(x / size), 1) * size
+
+
+def _fmt(x: float) -> str:
+    return f"{x:.8f}"
+
+
+
+class SimulatedMarket:
+    """Random-walk market of a set of symbols, advanced in steps of `step_ms`.
+
+    All state is kept in NumPy arrays with one entry per symbol, so a step of
+    thousands of symbols costs a handful of vectorized operations. Messages
+    are rendered from the state one at a time, in the format of the combined
+    streams of Binance.
+
+    Event times of the symbols are spread evenly over a step, so consecutive
+    messages of one symbol are exactly `step_ms` apart.
+    """
+
+    def __init__(
+        self,
+        symbols:    List[str],
+        price:      np.ndarray,
+        tick:       np.ndarray,
+        step:       np.ndarray,
+        start_ms:   int,
+        step_ms:    int,
+        volatility: float,
+        trade_rate: float,
+        notional:   float,
+        seed:       int,
+    ) -> None:
+        n = len(symbols)
+        self.symbols    = [s.upper() for s in symbols]
+        self.tick       = tick
+        self.step       = step
+        self.step_ms    = step_ms
+        self.trade_rate = trade_rate
+        self.notional   = notional
+        self.sigma      = volatility * np.sqrt(step_ms / DAY_MS)
+        self.rng        = np.random.default_rng([seed, *map(_crc, symbols)])
+
+        self.time       = start_ms + np.arange(n, dtype=np.int64) * step_ms // max(n, 1)
+        self.price      = price.copy()
+        self.last_qty   = step.copy()
+        self.maker      = np.zeros(n, dtype=bool)
+
+        # Open 1m kline
+        self.open_time  = self.time // 60000 * 60000
+        self.open       = self.price.copy()
+        self.high       = self.price.copy()
+        self.low        = self.price.copy()
+        self.volume     = np.zeros((n, 4))   # base, quote, taker base, taker quote
+        self.n_trades   = np.zeros(n, dtype=np.int64)
+        self.closed     = np.zeros(n, dtype=bool)
+
+        # Ids
+        self.trade_id   = self.rng.integers(10**8, 10**9, n)
+        self.first_id   = self.trade_id + 1
+        self.agg_id     = self.rng.integers(10**8, 10**9, n)
+        self.update_id  = self.rng.integers(10**9, 10**10, n)
+
+        # Last 24 hours
+        self.open_24h   = self.price.copy()
+        self.high_24h   = _round_to(self.price * 1.02, tick)
+        self.low_24h    = _round_to(self.price * 0.98, tick)
+        self.count_24h  = self.rng.poisson(trade_rate * DAY_MS / 1000, n)
+        self.volume_24h = _round_to(self.count_24h * notional / self.price, step)
+        self.quote_24h  = self.volume_24h * self.price
+
+
+    def advance(self) -> None:
+        """Moves every symbol one step forward in time."""
+
+        n   = len(self.symbols)
+        rng = self.rng
+        self.time += self.step_ms
+
+        kline_open = self.time // 60000 * 60000
+        new = kline_open != self.open_time
+        self.open_time      = kline_open
+        self.open[new]      = self.price[new]
+        self.high[new]      = self.price[new]
+        self.low[new]       = self.price[new]
+        self.volume[new]    = 0
+        self.n_trades[new]  = 0
+        self.first_id[new]  = self.trade_id[new] + 1
+        self.closed         = (self.time + self.step_ms) // 60000 != kline_open
+
+        k     = rng.poisson(self.trade_rate * self.step_ms / 1000, n) + 1
+        price = self.price * np.exp(self.sigma * rng.standard_normal(n))
+        price = _round_to(price, self.tick)
+        qty   = _round_to(self.notional * rng.lognormal(0, 0.7, n) / price, self.step)
+        base  = qty * k
+        taker = rng.uniform(0.3, 0.7, n)
+
+        self.price     = price
+        self.last_qty  = qty
+        self.maker     = taker < 0.5
+        np.maximum(self.high, price, out=self.high)
+        np.minimum(self.low, price, out=self.low)
+        taker = np.floor(base * taker / self.step) * self.step
+        self.volume   += np.column_stack((base, base * price, taker, taker * price))
+        self.n_trades += k
+        self.trade_id += k
+        self.agg_id   += 1
+
+        np.maximum(self.high_24h, price, out=self.high_24h)
+        np.minimum(self.low_24h, price, out=self.low_24h)
+        self.volume_24h += base
+        self.quote_24h  += base * price
+        self.count_24h  += k
+
+
+    # Messages, see https://binance-docs.github.io/apidocs/spot/en/#websocket-market-streams
+
+    def kline(self, i: int) -> Dict[str, Any]:
+        s, v = self.symbols[i], self.volume[i]
+        t    = int(self.open_time[i])
+        return {
+            "e": "kline",
+            "E": int(self.time[i]),
+            "s": s,
+            "k": {
+                "t": t,
+                "T": t + 59999,
+                "s": s,
+                "i": "1m",
+                "f": int(self.first_id[i]),
+                "L": int(self.trade_id[i]),
+                "o": _fmt(self.open[i]),
+                "c": _fmt(self.price[i]),
+                "h": _fmt(self.high[i]),
+                "l": _fmt(self.low[i]),
+                "v": _fmt(v[0]),
+                "n": int(self.n_trades[i]),
+                "x": bool(self.closed[i]),
+                "q": _fmt(v[1]),
+                "V": _fmt(v[2]),
+                "Q": _fmt(v[3]),
+                "B": "0",
+            },
+        }
+
+
+    def trade(self, i: int) -> Dict[str, Any]:
+        t = int(self.trade_id[i])
+        return {
+            "e": "trade",
+            "E": int(self.time[i]),
+            "s": self.symbols[i],
+            "t": t,
+            "p": _fmt(self.price[i]),
+            "q": _fmt(self.last_qty[i]),
+            "b": 2 * t + 1,
+            "a": 2 * t,
+            "T": int(self.time[i]),
+            "m": bool(self.maker[i]),
+            "M": True,
+        }
+
+
+    def agg_trade(self, i: int) -> Dict[str, Any]:
+        return {
+            "e": "aggTrade",
+            "E": int(self.time[i]),
+            "s": self.symbols[i],
+            "a": int(self.agg_id[i]),
+            "p": _fmt(self.price[i]),
+            "q": _fmt(self.last_qty[i]),
+            "f": int(self.trade_id[i]),
+            "l": int(self.trade_id[i]),
+            "T": int(self.time[i]),
+            "m": bool(self.maker[i]),
+            "M": True,
+        }
+
+
+    def depth(self, i: int, levels: int = 10) -> Dict[str, Any]:
+        """A diff depth update with `levels` bids and asks around the price, some removed."""
+
+        rng    = self.rng
+        tick   = self.tick[i]
+        gaps   = np.cumsum(rng.integers(1, 4, (2, levels)), axis=1) * tick
+        qty    = _round_to(self.notional * rng.lognormal(0, 1, (2, levels)) / self.price[i], self.step[i])
+        qty[rng.random((2, levels)) < 0.3] = 0
+        bids   = self.price[i] - gaps[0]
+        asks   = self.price[i] + gaps[1]
+        first  = int(self.update_id[i]) + 1
+        self.update_id[i] += 2 * levels
+        return {
+            "e": "depthUpdate",
+            "E": int(self.time[i]),
+            "s": self.symbols[i],
+            "U": first,
+            "u": int(self.update_id[i]),
+            "b": [[_fmt(p), _fmt(q)] for p, q in zip(bids, qty[0]) if p > 0],
+            "a": [[_fmt(p), _fmt(q)] for p, q in zip(asks, qty[1])],
+        }
+
+
+    def mini_ticker(self, i: int) -> Dict[str, Any]:
+        return {
+            "e": "24hrMiniTicker",
+            "E": int(self.time[i]),
+            "s": self.symbols[i],
+            "c": _fmt(self.price[i]),
+            "o": _fmt(self.open_24h[i]),
+            "h": _fmt(self.high_24h[i]),
+            "l": _fmt(self.low_24h[i]),
+            "v": _fmt(self.volume_24h[i]),
+            "q": _fmt(self.quote_24h[i]),
+        }
+
+
+    def ticker(self, i: int) -> Dict[str, Any]:
+        e, c, o = int(self.time[i]), self.price[i], self.open_24h[i]
+        t       = int(self.trade_id[i])
+        return {
+            "e": "24hrTicker",
+            "E": e,
+            "s": self.symbols[i],
+            "p": _fmt(c - o),
+            "P": f"{100 * (c - o) / o:.3f}",
+            "w": _fmt(self.quote_24h[i] / self.volume_24h[i]),
+            "x": _fmt(o),
+            "c": _fmt(c),
+            "Q": _fmt(self.last_qty[i]),
+            "b": _fmt(c - self.tick[i]),
+            "B": _fmt(self.last_qty[i]),
+            "a": _fmt(c + self.tick[i]),
+            "A": _fmt(self.last_qty[i]),
+            "o": _fmt(o),
+            "h": _fmt(self.high_24h[i]),
+            "l": _fmt(self.low_24h[i]),
+            "v": _fmt(self.volume_24h[i]),
+            "q": _fmt(self.quote_24h[i]),
+            "O": e - DAY_MS,
+            "C": e,
+            "F": t - int(self.count_24h[i]) + 1,
+            "L": t,
+            "n": int(self.count_24h[i]),
+        }
+
+
+    RENDERERS = {
+        "kline_1m":    kline,
+        "trade":       trade,
+        "aggTrade":    agg_trade,
+        "depth":       depth,
+        "depth@100ms": depth,
+        "miniTicker":  mini_ticker,
+        "ticker":      ticker,
+    }
+
+
+
+class SimulatedClient:
+    """Offline stand-in for the python-binance AsyncClient.
+
+    Serves a made up market of any number of symbols: exchange info, tickers
+    and historical klines. Klines are a random walk per symbol and interval,
+    generated backwards from the base price of the symbol at `start_ms`,
+    so every request for the same candles returns the same candles and
+    the history ends where the streams of SimulatedSocketManager begin.
+
+    Usage, for a stress test of 2000 symbols at 50 times the real message rate:
+        client  = SimulatedClient(2000)
+        manager = SimulatedSocketManager(client, speed=50)
+        tasks   = Candle.get_tasks(options, client, manager, db, shutdown_flag)
+
+    `start_ms` defaults to the current time, which is where
+    `Candle.history_producer()` expects the history to end.
+    Set `options.request_weight_limit` high enough, otherwise the history of
+    thousands of symbols is downloaded at the rate Binance allows.
+    """
+
+    def __init__(
+        self,
+        symbols:    Union[int, Iterable[str]] = 1000,
+        seed:       int             = 0,
+        start_ms:   Optional[int]   = None,
+        volatility: float           = 0.03,    # of the price per day
+        trade_rate: float           = 2.0,     # trades per second per symbol
+        notional:   float           = 200.0,   # average trade size in the quote asset
+        latency:    float           = 0.0,     # seconds per request
+    ) -> None:
+        if isinstance(symbols, int):
+            symbols = simulated_symbols(symbols)
+        self.symbols    = [s.upper() for s in symbols]
+        self.seed       = seed
+        self.start_ms   = int(time.time() * 1000) if start_ms is None else start_ms
+        self.volatility = volatility
+        self.trade_rate = trade_rate
+        self.notional   = notional
+        self.latency    = latency
+        self.response   = None
+        self.n_requests = 0
+
+        # Base price log-uniform between 0.0001 and 100000, tick and step sizes to match
+        crc             = np.array([_crc(s) for s in self.symbols], dtype=np.int64)
+        magnitude       = np.floor(np.log10(10.0 ** ((crc % 9000) / 1000 - 4)))
+        self.tick       = 10.0 ** np.maximum(magnitude - 4, -8)
+        self.step       = 10.0 ** np.clip(np.floor(np.log10(notional)) - magnitude - 3, -8, 0)
+        self.price      = _round_to(10.0 ** ((crc % 9000) / 1000 - 4), self.tick)
+        self._index     = {s: i for i, s in enumerate(self.symbols)}
+
+
+    def market(self, symbols: List[str], step_ms: int = STEP_MS) -> SimulatedMarket:
+        """Returns the live market of `symbols`, starting at `start_ms`."""
+
+        idx = [self._index[s.upper()] for s in symbols]
+        return SimulatedMarket(
+            symbols    = [self.symbols[i] for i in idx],
+            price      = self.price[idx],
+            tick       = self.tick[idx],
+            step       = self.step[idx],
+            start_ms   = self.start_ms,
+            step_ms    = step_ms,
+            volatility = self.volatility,
+            trade_rate = self.trade_rate,
+            notional   = self.notional,
+            seed       = self.seed,
+        )
+
+
+    # AsyncClient api
+
+    async def get_server_time(self) -> Dict[str, int]:
+        await self._request()
+        return {"serverTime": self.start_ms}
+
+
+    async def get_exchange_info(self) -> Dict[str, Any]:
+        await self._request()
+        return {
+            "timezone":   "UTC",
+            "serverTime": self.start_ms,
+            "rateLimits": [{
+                "rateLimitType": "REQUEST_WEIGHT",
+                "interval":      "MINUTE",
+                "intervalNum":   1,
+                "limit":         1200,
+            }],
+            "symbols": [
+                {
+                    "symbol":     s,
+                    "status":     "TRADING",
+                    "baseAsset":  s[:-4],
+                    "quoteAsset": s[-4:],
+                    "filters": [
+                        {"filterType": "PRICE_FILTER", "tickSize": _fmt(tick)},
+                        {"filterType": "LOT_SIZE", "stepSize": _fmt(step)},
+                    ],
+                }
+                for s, tick, step in zip(self.symbols, self.tick, self.step)
+            ],
+        }
+
+
+    async def get_all_tickers(self) -> List[Dict[str, str]]:
+        await self._request()
+        return [{"symbol": s, "price": _fmt(p)} for s, p in zip(self.symbols, self.price)]
+
+
+    async def get_klines(
+        self,
+        symbol:    str,
+        interval:  str,
+        startTime: Optional[int] = None,
+        endTime:   Optional[int] = None,
+        limit:     int           = 500,
+    ) -> List[list]:
+        """Klines like Binance returns them: open times from `startTime`, at most `limit`."""
+
+        await self._request()
+        iv     = Interval(interval)
+        length = INTERVAL_MS[iv]
+        offset = INTERVAL_OFFSET_MS[iv]
+        last   = (self.start_ms - offset) // length * length + offset
+        if endTime is not None:
+            last = min(last, (endTime - offset) // length * length + offset)
+        if startTime is None:
+            first = last - (min(limit, 1000) - 1) * length
+        else:
+            first = -(-(startTime - offset) // length) * length + offset
+        n = min(limit, 1000, (last - first) // length + 1)
+        if n <= 0:
+            return []
+        return self.klines(symbol, iv, first, n)
+
+
+    async def close_connection(self) -> None:
+        pass
+
+
+    # Internal
+
+    def klines(self, symbol: str, interval: Interval, first: int, n: int) -> List[list]:
+        """`n` historical klines of `symbol` from open time `first`."""
+
+        i      = self._index[symbol.upper()]
+        length = INTERVAL_MS[interval]
+        offset = INTERVAL_OFFSET_MS[interval]
+        end    = (self.start_ms - offset) // length * length + offset
+        back   = (end - first) // length + 1
+        tick   = self.tick[i]
+        sigma  = self.volatility * np.sqrt(length / DAY_MS)
+
+        # Row d of z belongs to the candle d intervals before the open one, in every request
+        rng    = np.random.default_rng([self.seed, _crc(symbol), length])
+        z      = rng.standard_normal((back + 1, 4))
+        close  = np.exp(np.log(self.price[i]) - np.concatenate(([0.0], np.cumsum(sigma * z[:back, 0]))))
+        close  = _round_to(close, tick)
+
+        d      = back - 1 - np.arange(n)
+        z      = z[d]
+        o, c   = close[d + 1], close[d]
+        high   = np.ceil(np.maximum(o, c) * np.exp(0.5 * sigma * np.abs(z[:, 1])) / tick) * tick
+        low    = np.floor(np.minimum(o, c) * np.exp(-0.5 * sigma * np.abs(z[:, 2])) / tick) * tick
+        low    = np.maximum(low, tick)
+        trades = np.maximum(np.round(self.trade_rate * length / 1000 * np.exp(0.5 * z[:, 3])), 1)
+        base   = _round_to(trades * self.notional * np.exp(0.5 * z[:, 3]) / c, self.step[i])
+        quote  = base * c
+        taker  = np.floor(base * (0.5 + 0.1 * np.tanh(z[:, 0])) / self.step[i]) * self.step[i]
+        opens  = first + length * np.arange(n, dtype=np.int64)
+
+        columns = [
+            np.char.mod("%.8f", col).tolist()
+            for col in (o, high, low, c, base, quote, taker, taker * c)
+        ]
+        return [
+            [int(t), oo, hh, ll, cc, v, int(t) + length - 1, q, int(k), tv, tq, "0"]
+            for t, oo, hh, ll, cc, v, q, tv, tq, k in zip(opens, *columns, trades)
+        ]
+
+
+    async def _request(self) -> None:
+        self.n_requests += 1
+        await asyncio.sleep(self.latency)
+
+
+
+class SimulatedSocket:
+    """A combined stream connection of SimulatedSocketManager.
+
+    Every call of `recv()` returns the next message, one per stream per step.
+    Messages are paced to `speed` times the real rate, spread evenly over the
+    step. With `speed` None messages are returned as fast as they are read.
+    """
+
+    def __init__(
+        self,
+        market:  SimulatedMarket,
+        streams: List[str],
+        speed:   Optional[float],
+        counter: "SimulatedSocketManager",
+    ) -> None:
+        index        = {s: i for i, s in enumerate(market.symbols)}
+        self.market  = market
+        self.streams = [
+            (name, SimulatedMarket.RENDERERS[name.split("@", 1)[1]], index[stream_symbol(name).upper()])
+            for name in streams
+        ]
+        self.counter = counter
+        self._pace   = None if speed is None else market.step_ms / 1000 / speed / len(streams)
+        self._next   = len(self.streams)
+        self._start  = None
+        self._sent   = 0
+
+
+    async def __aenter__(self) -> "SimulatedSocket":
+        self._start = asyncio.get_running_loop().time()
+        return self
+
+
+    async def __aexit__(self, *exc) -> None:
+        pass
+
+
+    async def recv(self) -> Dict[str, Any]:
+        if self._next == len(self.streams):
+            self._next = 0
+            self.market.advance()
+            # Let other tasks run, even when nobody has to wait for messages
+            await asyncio.sleep(0)
+
+        if self._pace is not None:
+            delay = self._start + self._sent * self._pace - asyncio.get_running_loop().time()
+            if delay > 0.001:
+                await asyncio.sleep(delay)
+
+        name, render, i = self.streams[self._next]
+        self._next += 1
+        self._sent += 1
+        self.counter.n_messages += 1
+        return {"stream": name, "data": render(self.market, i)}
+
+
+
+class SimulatedSocketManager:
+    """Offline stand-in for the python-binance BinanceSocketManager.
+
+    Streams the market of a SimulatedClient from the moment its history ends.
+    Supported streams: <symbol>@kline_1m, @trade, @aggTrade, @depth, @depth@100ms,
+    @miniTicker and @ticker. Every connection simulates the symbols of its
+    own streams, so streams of one symbol agree when they share a connection.
+
+    At `speed` 1 every stream sends one message per `step_ms`, like Binance
+    sends kline updates. The message rate of a connection is
+    speed * n_streams * 1000 / step_ms per second, or unlimited if `speed` is None.
+    """
+
+    def __init__(
+        self,
+        client:  SimulatedClient,
+        speed:   Optional[float] = 1.0,
+        step_ms: int             = STEP_MS,
+    ) -> None:
+        self.client     = client
+        self.speed      = speed
+        self.step_ms    = step_ms
+        self.n_messages = 0
+        self._markets: Dict[tuple, SimulatedMarket] = dict()
+
+
+    def multiplex_socket(self, streams: List[str]) -> SimulatedSocket:
+        # A reconnect continues the market where the previous connection left it.
+        key = tuple(streams)
+        if key not in self._markets:
+            symbols = list(dict.fromkeys(stream_symbol(s).upper() for s in streams))
+            self._markets[key] = self.client.market(symbols, self.step_ms)
+        return SimulatedSocket(self._markets[key], streams, self.speed, self)
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from typing import Any, List
+
+from binance import BinanceSocketManager
+
+from .constants import ContentType
+
+
+# Binance accepts at most 1024 streams on a single combined connection.
+MAX_STREAMS_PER_CONNECTION = 1024
+
+
+
+def shard_streams(
+    streams:  List[str],
+    n_shards: int = 1,
+    limit:    int = MAX_STREAMS_PER_CONNECTION,
+) -> List[List[str]]:
+    """Splits stream names over combined connections.
+
+    Uses `n_shards` connections, or more if that many can not hold all streams
+    within `limit`. Streams are dealt round robin over the shards, so shards
+    differ in size by at most one stream. Empty shards are left out.
+    """
+
+    if not streams:
+        return []
+    n_shards = max(n_shards, -(-len(streams) // limit))
+    shards   = [sorted(streams)[i::n_shards] for i in range(n_shards)]
+    return [s for s in shards if s]
+
+
+def stream_symbol(stream: str) -> str:
+    """Returns the symbol of a stream name like `btcusdt@kline_1m`."""
+
+    return stream.partition("@")[0]
+
+
+
+class StreamShard:
+    """A single combined websocket connection that carries many streams.
+
+    Messages are added to the queue as tuple(symbol, "*", content_type, raw_message),
+    where raw_message is the combined stream wrapper {"stream": ..., "data": ...}.
+    When the connection fails, only this shard reconnects, after a backoff that
+    doubles on every consecutive failure.
+    """
+
+    def __init__(
+        self,
+        shard_id:    int,
+        streams:     List[str],
+        contenttype: ContentType,
+        max_backoff: float = 60.0,
+    ) -> None:
+        if len(streams) > MAX_STREAMS_PER_CONNECTION:
+            raise ValueError("Too many streams for a single connection.")
+        self.shard_id     = shard_id
+        self.streams      = streams
+        self.contenttype  = contenttype
+        self.max_backoff  = max_backoff
+        self.n_messages   = 0
+        self.n_reconnects = 0
+
+
+    async def run(
+        self,
+        queue:         asyncio.Queue,
+        manager:       BinanceSocketManager,
+        shutdown_flag: bool,
+    ) -> None:
+        """Reads the connection until `shutdown_flag` is set, reconnecting when it fails."""
+
+        backoff = 1.0
+        while not shutdown_flag:
+            try:
+                async with manager.multiplex_socket(self.streams) as socket:
+                    while not shutdown_flag:
+                        msg = await socket.recv()
+                        if self.is_error(msg):
+                            raise ConnectionError(msg.get("m", "websocket error"))
+                        await queue.put(
+                            (stream_symbol(msg["stream"]), "*", self.contenttype, msg)
+                        )
+                        self.n_messages += 1
+                        backoff = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.n_reconnects += 1
+                logging.warning(f"Stream shard {self.shard_id} failed ({e}), reconnecting in {backoff}s.")
+                await asyncio.sleep(backoff)
+                backoff = min(2 * backoff, self.max_backoff)
+
+
+    @staticmethod
+    def is_error(msg: Any) -> bool:
+        # python-binance reports a lost connection as a message.
+        return isinstance(msg, dict) and msg.get("e") == "error"
+
+
+    def __repr__(self) -> str:
+        return (
+            f"StreamShard(id={self.shard_id}, streams={len(self.streams)}, "
+            f"messages={self.n_messages}, reconnects={self.n_reconnects})"
+        )
@@ -2,21 +2,145 @@
 
 import asyncio
 import logging
-from typing import List, Optional, Type, TypeVar
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Type, TypeVar
 
 from binance import AsyncClient, BinanceSocketManager
 from pydantic import BaseModel
 from pydantic.error_wrappers import ValidationError
 from pydantic.types import PositiveInt, condecimal
 
-from ..bbot.constants import ContentType, Interval, Stream
-from ..bbot.pipeline import HistoricalCandlePipe, StreamCandlePipe
-from .database import DataBase
-from .options import Options
+from ..bbot.constants import INTERVAL_MS, INTERVAL_OFFSET_MS, ContentType, Interval, Stream
+from ..bbot.recorder import FrameWriter, RecordingSocketManager
+from ..bbot.scheduler import RequestScheduler
+from ..bbot.streams import StreamShard, shard_streams
+from .scale import Scale
+from .store import CandleStore, candle_dir
+
+if TYPE_CHECKING:
+    from .database import DataBase
+    from .options import Options
 
 _Candle = TypeVar("_Candle", bound="Candle")
 
 
+
+class ParsedKline:
+    """A kline update from the stream, parsed once and shared by every window handler.
+
+    Times are epoch milliseconds. `candle` holds the cumulative values of the 1m kline so far.
+    """
+
+    __slots__ = ("symbol", "event_time", "open_time", "close_time", "closed", "candle")
+
+    def __init__(
+        self,
+        symbol:     str,
+        event_time: int,
+        open_time:  int,
+        close_time: int,
+        closed:     bool,
+        candle:     "Candle",
+    ) -> None:
+        self.symbol     = symbol
+        self.event_time = event_time
+        self.open_time  = open_time
+        self.close_time = close_time
+        self.closed     = closed
+        self.candle     = candle
+
+
+class CandleRecord:
+    """Compact candle for trusted exchange data, see `Candle.parse_candle_fast()`.
+
+    Has the same fields as Candle, stored as plain floats and ints in `__slots__`,
+    or as scaled ints (see models/scale.py). Nothing is validated.
+    """
+
+    __slots__ = (
+        "open_price",
+        "close_price",
+        "high_price",
+        "low_price",
+        "base_volume",
+        "quote_volume",
+        "base_volume_taker",
+        "quote_volume_taker",
+        "n_trades",
+        "corrupt",
+    )
+
+    def __init__(
+        self,
+        open_price:         float,
+        close_price:        float,
+        high_price:         float,
+        low_price:          float,
+        base_volume:        float,
+        quote_volume:       float,
+        base_volume_taker:  float,
+        quote_volume_taker: float,
+        n_trades:           int,
+        corrupt:            bool = False,
+    ) -> None:
+        self.open_price         = open_price
+        self.close_price        = close_price
+        self.high_price         = high_price
+        self.low_price          = low_price
+        self.base_volume        = base_volume
+        self.quote_volume       = quote_volume
+        self.base_volume_taker  = base_volume_taker
+        self.quote_volume_taker = quote_volume_taker
+        self.n_trades           = n_trades
+        self.corrupt            = corrupt
+
+
+    def to_candle(self) -> "Candle":
+        """Returns a validated Candle with the same values."""
+
+        return Candle(**{f: getattr(self, f) for f in self.__slots__})
+
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{f}={getattr(self, f)!r}" for f in self.__slots__)
+        return f"CandleRecord({fields})"
+
+
+
+class ValidationSampler:
+    """Decides which messages from the exchange get full validation: one in `n`.
+
+    With n == 0 nothing is validated, with n == 1 everything is.
+    """
+
+    __slots__ = ("n", "_count")
+
+    def __init__(self, n: int) -> None:
+        self.n      = n
+        self._count = 0
+
+
+    def __call__(self) -> bool:
+        if not self.n:
+            return False
+        self._count += 1
+        if self._count >= self.n:
+            self._count = 0
+            return True
+        return False
+
+
+    def select(self, n: int) -> range:
+        """Same as calling the sampler `n` times, returns the indices that got True."""
+
+        if not self.n:
+            return range(0)
+        first       = self.n - self._count - 1
+        self._count = (self._count + n) % self.n
+        return range(first, n, self.n)
+
+
+
 class Candle(BaseModel):
     """Candlestick from websocket stream or historical API call.
 
@@ -104,6 +228,73 @@ class Candle(BaseModel):
 
 
 
+    @staticmethod
+    def parse_candle_fast(
+        raw_candle: dict, 
+        validate:   bool            = False, 
+        scale:      Optional[Scale] = None
+    ) -> CandleRecord:
+        """Parse websocket candlestick from the exchange, return CandleRecord instance.
+
+        Skips validation, unless `validate` is set. A candle that fails
+        validation is logged and returned with `corrupt` set.
+        With a `scale`, prices and volumes are returned as scaled ints instead of floats.
+        """
+
+        corrupt = validate and Candle.parse_candle(raw_candle) is None
+        if scale is not None:
+            return CandleRecord(
+                scale.price(raw_candle["o"]),
+                scale.price(raw_candle["c"]),
+                scale.price(raw_candle["h"]),
+                scale.price(raw_candle["l"]),
+                scale.qty(raw_candle["v"]),
+                scale.quote_qty(raw_candle["q"]),
+                scale.qty(raw_candle["V"]),
+                scale.quote_qty(raw_candle["Q"]),
+                int(raw_candle["n"]),
+                corrupt,
+            )
+        return CandleRecord(
+            float(raw_candle["o"]),
+            float(raw_candle["c"]),
+            float(raw_candle["h"]),
+            float(raw_candle["l"]),
+            float(raw_candle["v"]),
+            float(raw_candle["q"]),
+            float(raw_candle["V"]),
+            float(raw_candle["Q"]),
+            int(raw_candle["n"]),
+            corrupt,
+        )
+
+
+
+    @staticmethod
+    def parse_kline(
+        raw_kline: dict, 
+        validate:  bool            = False, 
+        scale:     Optional[Scale] = None
+    ) -> ParsedKline:
+        """Parse a kline event from the websocket, return ParsedKline instance.
+
+        Accepts both the plain event and the `{"stream": ..., "data": ...}` wrapper
+        that combined streams use. See `parse_candle_fast()` for `validate` and `scale`.
+        """
+
+        event = raw_kline.get("data", raw_kline)
+        k     = event["k"]
+        return ParsedKline(
+            symbol     = event["s"].lower(),
+            event_time = event["E"],
+            open_time  = k["t"],
+            close_time = k["T"],
+            closed     = bool(k["x"]),
+            candle     = Candle.parse_candle_fast(k, validate, scale),
+        )
+
+
+
     @staticmethod
     def parse_historical_candle(raw_candle: List) -> _Candle:
         """Parse historical candlestick, return Candle instance."""
@@ -125,6 +316,46 @@ class Candle(BaseModel):
 
 
 
+    @staticmethod
+    def parse_historical_candle_fast(
+        raw_candle: List, 
+        validate:   bool            = False, 
+        scale:      Optional[Scale] = None
+    ) -> CandleRecord:
+        """Parse historical candlestick from the exchange, return CandleRecord instance.
+
+        See `parse_candle_fast()`.
+        """
+
+        corrupt = validate and Candle.parse_historical_candle(raw_candle) is None
+        if scale is not None:
+            return CandleRecord(
+                scale.price(raw_candle[1]),
+                scale.price(raw_candle[4]),
+                scale.price(raw_candle[2]),
+                scale.price(raw_candle[3]),
+                scale.qty(raw_candle[5]),
+                scale.quote_qty(raw_candle[7]),
+                scale.qty(raw_candle[9]),
+                scale.quote_qty(raw_candle[10]),
+                int(raw_candle[8]),
+                corrupt,
+            )
+        return CandleRecord(
+            float(raw_candle[1]),
+            float(raw_candle[4]),
+            float(raw_candle[2]),
+            float(raw_candle[3]),
+            float(raw_candle[5]),
+            float(raw_candle[7]),
+            float(raw_candle[9]),
+            float(raw_candle[10]),
+            int(raw_candle[8]),
+            corrupt,
+        )
+
+
+
     @staticmethod
     def update(
         candle:                 Type[_Candle],
@@ -161,11 +392,14 @@ class Candle(BaseModel):
         update:                 Type[_Candle],
         previous_update:        Type[_Candle],
         previous_update_closed: bool,
-    ) -> _Candle:
-        """Produces a candle for the timeframe with an interval of 2 seconds."""
+    ) -> CandleRecord:
+        """Produces a candle for the timeframe with an interval of 2 seconds.
+
+        Both updates were parsed already, so the result is not validated again.
+        """
 
         if previous_update_closed:
-          return Candle(
+          return CandleRecord(
             open_price         = previous_update.close_price,
             close_price        = update.close_price,
             high_price         = max(update.close_price, previous_update.close_price),
@@ -177,7 +411,7 @@ class Candle(BaseModel):
             n_trades           = update.n_trades
           )
         else:
-          return Candle(
+          return CandleRecord(
             open_price         = previous_update.close_price,
             close_price        = update.close_price,
             high_price         = max(update.close_price, previous_update.close_price),
@@ -193,26 +427,19 @@ class Candle(BaseModel):
 
     @staticmethod
     async def stream_producer(
-        symbol:        str,
+        shard:         StreamShard,
         queue:         asyncio.Queue,
-        client:        AsyncClient,
         manager:       BinanceSocketManager,
         shutdown_flag: bool,
     ) -> None:
-        """Coroutine that streams 1m candlestick data for a single symbol, through a websocket.
+        """Coroutine that streams 1m candlestick data for a shard of symbols, through one combined websocket.
 
         Single candles are added to the queue, as tuple(symbol, interval, content_type, raw_candle)
         Streams are always 1 minute candles. Windows are programatically updated later.
         That way bbot requires just one stream for multiple windows.
         """
 
-        socket = manager.kline_socket(symbol)
-        async with socket as candle_socket:
-            while not shutdown_flag:
-                raw_candle = await candle_socket.recv()
-                msg = (symbol, "*", ContentType.CANDLE_STREAM, raw_candle)
-                await queue.put(msg)
-        await client.close_connection()
+        await shard.run(queue, manager, shutdown_flag)
 
 
 
@@ -222,105 +449,88 @@ class Candle(BaseModel):
         intervals:     set[Interval],
         window_length: int,
         queue:         asyncio.Queue,
-        client:        AsyncClient,
+        scheduler:     RequestScheduler,
         shutdown_flag: bool,
+        stored:        Optional[Dict[Interval, int]] = None,
     ) -> None:
         """Coroutine that downloads historical candlestick data for a single symbol and all time intervals.
 
-        Single candles are added to the queue, as tuple(symbol, interval, content_type, raw_candle)
-        After n candles are processed, where n == window_length, a `finish` notification is added to the queue.
-        After every filled window, the coroutine pauzes for 5 seconds, to avoid API abuse.
+        Klines are downloaded in pages of at most 1000, the last `window_length` klines of every interval.
+        `stored` holds the close time in epoch ms of the last candle that was loaded from the CandleStore,
+        per interval. Those windows only download the klines after it, up to now, so a restart costs
+        requests in proportion to the downtime. The last kline is the open one, the stream continues it.
+        Every page is added to the queue as one block, as tuple(symbol, interval, content_type, raw_candles)
+        After a window is downloaded, a `finish` notification is added to the queue.
+        All intervals are downloaded concurrently. The shared RequestScheduler keeps
+        the requests of all symbols within the weight limit of the api.
         This procedure is cancelled if `shutdown_flag` is set to true.
         """
 
-        def gen_timestring(i, l):
-            # helperfunc
-            amount = i[:-1]
-            period = i[-1]
-            total  = str(l * amount)
-            if period == "m":
-                return total + " minutes ago UTC"
-            elif period == "h":
-                return total + " hours ago UTC"
-            elif period == "d":
-                return total + " days ago UTC"
-            else:
-                return total + " weeks ago UTC"
-
-        async def download_window(s, i, t):
-            async for raw_candle in await client.get_historical_klines_generator(
-                s.upper(), i, t
-            ):
-                msg = (
-                    s,
-                    Interval(i),
-                    ContentType.CANDLE_HISTORY,
-                    raw_candle,
+        async def download_window(s, i, n):
+            length = INTERVAL_MS[i]
+            offset = INTERVAL_OFFSET_MS[i]
+            now    = int(time.time() * 1000)
+            last   = (now - offset) // length * length + offset
+            start  = last - (n - 1) * length
+            if stored and i in stored and stored[i] + 1 >= start:
+                start = stored[i] + 1
+                n     = (last - start) // length + 1
+            while n > 0:
+                page = await scheduler.request(
+                    "get_klines", symbol=s.upper(), interval=i.value,
+                    startTime=start, endTime=now, limit=min(n, 1000),
                 )
-                await queue.put(msg)
+                if not page:
+                    break
+                await queue.put((s, i, ContentType.CANDLE_HISTORY_BLOCK, page))
+                n    -= len(page)
+                start = page[-1][0] + length
 
-        for i in intervals:
-            interval = i.value
-            time = gen_timestring(interval, window_length)
+        async def fill_window(i):
             if shutdown_flag:
                 return
-            elif i == Interval.SECOND_2:
-                continue
-            else:
-                await download_window(symbol, interval, time)
-                await queue.put(
-                  (symbol, interval, None, "finished_history_download")
-                )
-                await asyncio.sleep(5)
-
-
-
-    @staticmethod
-    async def history_consumer(
-        queue:         asyncio.Queue,
-        db:            DataBase,
-        shutdown_flag: bool
-    ) -> None:
-        
-        pipeline = HistoricalCandlePipe()
-        while not shutdown_flag:
-            symbol, interval, contenttype, payload = await queue.get()
-            if payload == "finished_history_download":
-                db.symbols[symbol].windows[interval]._history_downloaded = True
-            else:
-                db = pipeline.process(symbol, interval, contenttype, payload, db)
-
-
+            await download_window(symbol, i, window_length or 1000)
+            await queue.put(
+              (symbol, i.value, None, "finished_history_download")
+            )
 
-    @staticmethod
-    async def stream_consumer(
-        queue:         asyncio.Queue,
-        db:            DataBase,
-        shutdown_flag: bool
-    ) -> None:
-        
-        pipeline = StreamCandlePipe()
-        while not shutdown_flag:
-            symbol, interval, contenttype, payload = await queue.get()
-            if db.symbols[symbol].windows[interval]._history_downloaded:
-                db = pipeline.process(symbol, interval, contenttype, payload, db)
+        await asyncio.gather(
+            *(fill_window(Interval(i)) for i in intervals if i != Interval.SECOND_2)
+        )
 
 
 
     @staticmethod
     def get_tasks(
-        options:       Options, 
+        options:       "Options", 
         client:        AsyncClient, 
         manager:       BinanceSocketManager, 
-        db:            DataBase,
+        db:            "DataBase",
         shutdown_flag: bool
     ) -> Optional[set[asyncio.Task]]:
 
         if not Stream.CANDLE in options.streams:
             return
 
-        q_hist = asyncio.Queue()
-        q_str = asyncio.Queue()
+        from ..bbot.consumers import ConsumerPool
+        pool      = ConsumerPool(
+            db, options.consumer_shards, options.consumer_mode,
+            options.queue_size, options.queue_policy,
+        )
+        scheduler = RequestScheduler(client, options.request_weight_limit)
+        for sym in db.selected_symbols - db.symbols.keys():
+            db.add_symbol(sym)
+
+        stored = dict()
+        if options.datadir is not None:
+            store = CandleStore(candle_dir(options.datadir))
+            now   = int(time.time() * 1000)
+            for sym in db.selected_symbols:
+                windows = db.symbols[sym].windows
+                store.load(sym, windows, now)
+                stored[sym] = {
+                    iv: int(w.timeframes.tail(1)["close_time"][0]) for iv, w in windows.items() if w.timeframes
+                }
 
         hp_tasks = set()
         for sym in db.selected_symbols:
@@ -330,41 +540,36 @@ class Candle(BaseModel):
                         symbol        =sym,
                         intervals     =options.window_intervals,
                         window_length =options.window_length,
-                        queue         =q_hist,
-                        client        =client,
-                        shutdown_flag =shutdown_flag
+                        queue         =pool,
+                        scheduler     =scheduler,
+                        shutdown_flag =shutdown_flag,
+                        stored        =stored.get(sym),
                     )
                 )
             )
 
-        hc = asyncio.create_task(
-            Candle.history_consumer(
-                queue         =q_hist, 
-                db            =db, 
-                shutdown_flag =shutdown_flag
-            )
-        )
+        if options.record_path is not None:
+            manager = RecordingSocketManager(manager, FrameWriter(options.record_path))
 
         sp_tasks = set()
-        for sym in db.selected_symbols:
+        streams  = [f"{sym.lower()}@kline_1m" for sym in db.selected_symbols]
+        shards   = [
+            StreamShard(i, s, ContentType.CANDLE_STREAM)
+            for i, s in enumerate(shard_streams(streams, options.stream_shards))
+        ]
+        for shard in shards:
             sp_tasks.add(
                 asyncio.create_task(
                     Candle.stream_producer(
-                        symbol        =sym,
-                        queue         =q_str, 
-                        client        =client,
+                        shard         =shard,
+                        queue         =pool,
                         manager       =manager,
                         shutdown_flag =shutdown_flag
                     )
                 )
             )
 
-        sc = asyncio.create_task(
-            Candle.stream_consumer(
-                queue         =q_str, 
-                db            =db, 
-                shutdown_flag =shutdown_flag
-            )
-        )
-        return {*hp_tasks, hc, *sp_tasks, sc}
+        if db.metrics is not None:
+            db.metrics.register(pool, shards)
 
+        return {*hp_tasks, *sp_tasks, *pool.start()}
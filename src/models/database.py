@@ -1,10 +1,15 @@
 # pylint: disable=no-name-in-module
 
 from enum import Enum
+from typing import Optional
 from pydantic import BaseModel
 
+from ..bbot.latency import LatencyStats
+from ..bbot.metrics import Metrics
 from .options import Options
+from .scale import Scale
 from .symbol import Symbol
+from .window import Window
 
 
 
@@ -13,7 +18,7 @@ class DataBase(BaseModel):
     This class is injected in user defined feature functions.
     All data is nested in this model, hierarchical:
 
-    db -> dict[str, Symbol] -> dict[Options.Interval, Window] -> deque[Timeframe] -> candle
+    db -> dict[str, Symbol] -> dict[Options.Interval, Window] -> CandleBuffer[Timeframe] -> candle
                                                                                   -> miniticker
                                                                                   -> ...
 
@@ -37,7 +42,44 @@ class DataBase(BaseModel):
     all_symbols_at_binance: set[str]          = set()
     selected_symbols:       set[str]          = set()
     # exchange info
+    scales:                 dict[str, Scale]  = dict()   # if Options.fixed_point
     # account info
 
     symbols:                dict[str, Symbol] = dict()
-    # user events
\ No newline at end of file
+    # user events
+
+    latency:                Optional[LatencyStats] = None  # if Options.latency_stats
+    metrics:                Optional[Metrics]      = None  # if Options.metrics_port
+
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+    def __init__(self, **data) -> None:
+        super().__init__(**data)
+        if self.options.latency_stats and self.latency is None:
+            self.latency = LatencyStats()
+        if self.options.metrics_port is not None and self.metrics is None:
+            self.metrics = Metrics()
+
+
+    def add_symbol(self, name: str) -> Symbol:
+        """Creates a symbol with a window for every interval in `Options.window_intervals`.
+
+        With `Options.fixed_point` the windows store the candles in the units of the
+        Scale of the symbol in `scales`, see `Downloader.parse_scales()`. A symbol
+        without exchange info gets 1e-8 units, which fit any number Binance sends.
+        """
+
+        scale  = self.scales.get(name.lower(), Scale()) if self.options.fixed_point else None
+        symbol = Symbol(
+            name    = name,
+            scale   = scale,
+            windows = {
+                iv: Window(interval=iv, window_length=self.options.window_length, scale=scale)
+                for iv in self.options.window_intervals
+            },
+        )
+        self.symbols[symbol.name] = symbol
+        return symbol
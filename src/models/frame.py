@@ -0,0 +1,34 @@
+"""Pandas views of windows. Requires `pandas`.
+
+Like the Arrow export in models/arrow.py, nothing is copied: the columns
+of the DataFrame share memory with the NumPy columns of the CandleBuffer,
+so the cost is the same for 10 or 10 million timeframes. The views are only valid until the window is updated.
+"""
+
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .window import Window
+
+
+
+def _pandas() -> Any:
+    try:
+        import pandas
+    except ImportError as e:
+        raise ImportError("DataFrame conversion requires pandas: pip install pandas") from e
+    return pandas
+
+
+def to_frame(window: "Window") -> Any:
+    """Returns the timeframes of `window` as a DataFrame of views, indexed by open time.
+
+    The index and `close_time` are naive datetime64[ms] in UTC: pandas copies
+    the values to attach a time zone.
+    """
+
+    pd      = _pandas()
+    columns = dict(window.timeframes.views())
+    index   = pd.DatetimeIndex(columns.pop("open_time").view("datetime64[ms]"), name="open_time", copy=False)
+    columns["close_time"] = columns["close_time"].view("datetime64[ms]")
+    return pd.DataFrame(columns, index=index, copy=False)
@@ -1,5 +1,6 @@
 # pylint: disable=no-name-in-module
 
+from pathlib import Path
 from typing import Callable, Optional
 from collections.abc import Iterable
 
@@ -7,23 +8,36 @@ from pydantic import BaseModel, validator
 from pydantic.error_wrappers import ValidationError
 from pydantic.types import DirectoryPath, SecretStr
 
-from ..bbot.constants import Mode, Interval, Stream
+from ..bbot.constants import ConsumerMode, Mode, Interval, QueuePolicy, Stream
 
 class Options(BaseModel):
     """Contains all optional arguments for Bbot.
     Required by Bot object at initialization.
     """
 
-    key:              SecretStr               = " "
-    secret:           SecretStr               = " "
-    mode:             Mode                    = Mode.TEST
-    datadir:          Optional[DirectoryPath] = None
-    base_assets:      set[str]                = {"BTC", "HOT"}
-    quote_assets:     set[str]                = {"USDT"}
-    window_intervals: set[Interval]           = {Interval.SECOND_2, Interval.MINUTE_1}
-    window_length:    int                     = 200
-    streams:          Optional[set[Stream]]   = {Stream.CANDLE, Stream.DEPTH5, Stream.MINITICKER}
-    features:         Optional[set[Callable]] = None
+    key:                    SecretStr               = " "
+    secret:                 SecretStr               = " "
+    mode:                   Mode                    = Mode.TEST
+    datadir:                Optional[DirectoryPath] = None
+    base_assets:            set[str]                = {"BTC", "HOT"}
+    quote_assets:           set[str]                = {"USDT"}
+    window_intervals:       set[Interval]           = {Interval.SECOND_2, Interval.MINUTE_1}
+    window_length:          int                     = 200
+    streams:                Optional[set[Stream]]   = {Stream.CANDLE, Stream.DEPTH5, Stream.MINITICKER}
+    features:               Optional[set[Callable]] = None
+    feature_workers:        int                     = 0     # processes that compute the features, 0 = the consumers
+    panel_period:           float                   = 1.0   # seconds between updates of the panel features
+    validation_sample_rate: int                     = 100   # validate 1 in n exchange candles, 0 = never
+    fixed_point:            bool                    = False # store prices and volumes as scaled int64
+    request_weight_limit:   int                     = 1200  # rest api request weight per minute
+    stream_shards:          int                     = 1     # websocket connections, more if needed
+    consumer_shards:        int                     = 1     # symbols are partitioned over n consumers
+    consumer_mode:          ConsumerMode            = ConsumerMode.TASK
+    queue_size:             int                     = 10000 # items per consumer queue, 0 = unbounded
+    queue_policy:           QueuePolicy             = QueuePolicy.BLOCK
+    record_path:            Optional[Path]          = None  # append raw stream frames to this gzip log
+    latency_stats:          bool                    = False # keep latency histograms, see db.latency
+    metrics_port:           Optional[int]           = None  # serve prometheus metrics on localhost:port
 
 
 
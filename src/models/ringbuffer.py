@@ -0,0 +1,467 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+
+# Name and dtype of every column in a CandleBuffer.
+# Times are stored as epoch milliseconds, like Binance sends them.
+CANDLE_COLUMNS = (
+    ("open_time",          np.int64),
+    ("close_time",         np.int64),
+    ("open_price",         np.float64),
+    ("close_price",        np.float64),
+    ("high_price",         np.float64),
+    ("low_price",          np.float64),
+    ("base_volume",        np.float64),
+    ("quote_volume",       np.float64),
+    ("base_volume_taker",  np.float64),
+    ("quote_volume_taker", np.float64),
+    ("n_trades",           np.int64),
+    ("corrupt",            np.bool_),
+    ("has_candle",         np.bool_),
+)
+
+CANDLE_FIELDS = tuple(name for name, _ in CANDLE_COLUMNS[2:-2])
+
+
+
+def ms_to_datetime(ms: int) -> datetime:
+    """Converts epoch milliseconds to an aware UTC datetime."""
+
+    return datetime.fromtimestamp(int(ms) / 1000, tz=timezone.utc)
+
+
+def datetime_to_ms(dt: Any) -> int:
+    """Converts a datetime (or epoch milliseconds) to epoch milliseconds."""
+
+    if isinstance(dt, datetime):
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return int(round(dt.timestamp() * 1000))
+    return int(dt)
+
+
+
+class CandleView:
+    """Lightweight view on a single candle inside a CandleBuffer.
+
+    Reading an attribute reads the column, setting an attribute writes it.
+    A view is only valid until its slot is evicted from the buffer.
+    """
+
+    __slots__ = ("_buffer", "_idx")
+
+    def __init__(self, buffer: "CandleBuffer", idx: int) -> None:
+        self._buffer = buffer
+        self._idx    = idx
+
+
+    def to_candle(self):
+        """Materializes the view as a validated Candle model."""
+
+        from .candle import Candle
+        d = self.to_dict()
+        if self._buffer.scale is not None:
+            d = self._buffer.scale.candle_to_decimals(d)
+        else:
+            # Sums of floats carry rounding noise beyond the 8 decimals of a Candle.
+            for f in CANDLE_FIELDS[:-1]:
+                d[f] = round(d[f], 8)
+        return Candle(**d)
+
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {f: getattr(self, f) for f in CANDLE_FIELDS}
+        d["n_trades"] = int(d["n_trades"])
+        d["corrupt"]  = bool(self._buffer._columns["corrupt"][self._idx])
+        return d
+
+
+    def __repr__(self) -> str:
+        return f"CandleView({self.to_dict()})"
+
+
+
+def _column_property(name: str) -> property:
+
+    def fget(self):
+        return self._buffer._columns[name][self._idx].item()
+
+    def fset(self, value):
+        self._buffer._columns[name][self._idx] = value
+
+    return property(fget, fset)
+
+
+for _name in CANDLE_FIELDS + ("corrupt",):
+    setattr(CandleView, _name, _column_property(_name))
+
+
+
+class TimeFrameView:
+    """Lightweight stand-in for a TimeFrame that lives in a CandleBuffer.
+
+    Supports the attributes the pipelines use: `open_time`, `close_time`
+    and `candle`. Assigning a Candle to `candle` copies it into the columns.
+    """
+
+    __slots__ = ("_buffer", "_idx")
+
+    def __init__(self, buffer: "CandleBuffer", idx: int) -> None:
+        self._buffer = buffer
+        self._idx    = idx
+
+
+    @property
+    def open_time_ms(self) -> int:
+        return int(self._buffer._columns["open_time"][self._idx])
+
+
+    @property
+    def open_time(self) -> datetime:
+        return ms_to_datetime(self._buffer._columns["open_time"][self._idx])
+
+    @open_time.setter
+    def open_time(self, value) -> None:
+        self._buffer._columns["open_time"][self._idx] = datetime_to_ms(value)
+
+
+    @property
+    def close_time(self) -> datetime:
+        return ms_to_datetime(self._buffer._columns["close_time"][self._idx])
+
+    @close_time.setter
+    def close_time(self, value) -> None:
+        self._buffer._columns["close_time"][self._idx] = datetime_to_ms(value)
+
+
+    @property
+    def candle(self) -> Optional[CandleView]:
+        if not self._buffer._columns["has_candle"][self._idx]:
+            return None
+        return CandleView(self._buffer, self._idx)
+
+    @candle.setter
+    def candle(self, candle) -> None:
+        self._buffer._write_candle(self._idx, candle)
+
+
+    def __repr__(self) -> str:
+        return (
+            f"TimeFrameView(open_time={self.open_time}, "
+            f"close_time={self.close_time}, candle={self.candle})"
+        )
+
+
+
+class CandleBuffer:
+    """Fixed-capacity columnar buffer of timeframes.
+
+    Every field is stored in its own NumPy array of twice `capacity`.
+    Prices and volumes are float64, or int64 in the units of `scale` when
+    a Scale is given (see models/scale.py).
+    Appending to a full buffer evicts the oldest timeframe by moving the start
+    of the buffer one slot up. Only when the end of the arrays is reached, the
+    timeframes are moved back to the start, once every `capacity` appends.
+    Appends and evictions are O(1) amortized, and the timeframes always sit
+    in one contiguous slice of every array, so `views()` never copies.
+    A capacity of 0 means unbounded: the arrays grow by doubling and nothing
+    is ever evicted.
+
+    Indexing follows deque semantics, so `buffer[-1].candle` is the most recent candle.
+    A TimeFrameView or CandleView is only valid until the next append.
+
+    The most recent timeframe can be bound to a live source with `bind_live()`.
+    Its candle is then copied from the source lazily, only when it is read.
+
+    Columns besides CANDLE_COLUMNS, like feature values, are added with `add_column()`.
+    A new timeframe starts with their fill value.
+
+    A bounded buffer can be given the arrays to store its columns in, of twice
+    `capacity` values each, like the ones in shared memory of a SharedCandleBuffer.
+    Columns besides CANDLE_COLUMNS are then added columns, filled with NaN.
+    """
+
+    def __init__(self, capacity: int, scale=None, columns: Optional[Dict[str, np.ndarray]] = None) -> None:
+        if capacity < 0:
+            raise ValueError("Capacity of a CandleBuffer can not be negative.")
+        if columns is not None and not capacity:
+            raise ValueError("An unbounded CandleBuffer can not be given its columns.")
+        self.capacity   = capacity
+        self.scale      = scale
+        self.dtype      = np.dtype(np.int64 if scale is not None else np.float64)
+        self.n_appended = 0     # timeframes appended since creation, evicted ones included
+        self._head      = 0     # physical index of the oldest timeframe
+        self._size      = 0
+        size            = 2 * capacity if capacity else 16
+        self._columns   = columns if columns is not None else {
+            name: np.zeros(size, dtype=self.dtype if dtype is np.float64 else dtype)
+            for name, dtype in CANDLE_COLUMNS
+        }
+        self._live         = None   # (source, row) that owns the last candle
+        self._live_version = -1
+        self._fills        = {"corrupt": False, "has_candle": True}  # defaults of `extend()`
+        self._extra: Dict[str, Any] = dict()                          # fill of added columns
+        for name in self._columns.keys() - {name for name, _ in CANDLE_COLUMNS}:
+            self._fills[name] = self._extra[name] = np.nan
+        if columns is not None:
+            self.dtype = columns["open_price"].dtype
+
+
+    def __len__(self) -> int:
+        return self._size
+
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+
+    def __iter__(self) -> Iterator[TimeFrameView]:
+        for i in range(self._size):
+            yield self[i]
+
+
+    def __getitem__(self, i: int) -> TimeFrameView:
+        if self._live is not None:
+            self._sync()
+        return TimeFrameView(self, self._physical(i))
+
+
+    def __setitem__(self, i: int, timeframe) -> None:
+        if self._size == 0 and i in (0, -1):
+            # Assigning the first timeframe of an empty window.
+            self.append(timeframe)
+            return
+        self._write_timeframe(self._physical(i), timeframe)
+
+
+    def append(self, timeframe) -> None:
+        """Appends a TimeFrame (or TimeFrameView), evicting the oldest one if full."""
+
+        self._write_timeframe(self._next_slot(), timeframe)
+
+
+    def append_row(self, open_time: int, close_time: int, candle=None) -> None:
+        """Appends a timeframe given in epoch milliseconds."""
+
+        idx = self._next_slot()
+        self._columns["open_time"][idx]  = open_time
+        self._columns["close_time"][idx] = close_time
+        self._write_candle(idx, candle)
+
+
+    def extend(self, columns: Dict[str, np.ndarray]) -> None:
+        """Appends a block of timeframes at once, given as one array per column.
+
+        `corrupt` and `has_candle` may be left out, they default to False and True.
+        Every column is written with at most two slice assignments. When the block
+        does not fit, the oldest timeframes are evicted, as with `append()`.
+        """
+
+        n = len(columns["open_time"])
+        if not n:
+            return
+        self.unbind_live()
+        if self.capacity and n > self.capacity:
+            columns = {name: values[-self.capacity:] for name, values in columns.items()}
+            n       = self.capacity
+        if self.capacity:
+            self._make_room(n)
+        while self._head + self._size + n > len(self._columns["open_time"]):
+            self._grow()
+
+        start = self._head + self._size
+        for name, col in self._columns.items():
+            values = columns.get(name, self._fills.get(name))
+            if values is None:
+                raise KeyError(f"Column {name} missing in block.")
+            col[start:start + n] = values
+
+        self._size      += n
+        self.n_appended += n
+        if self.capacity and self._size > self.capacity:
+            self._head += self._size - self.capacity
+            self._size  = self.capacity
+
+
+    def tail(self, n: int) -> Dict[str, np.ndarray]:
+        """Returns the last `n` timeframes as one array per column, oldest first."""
+
+        if self._live is not None:
+            self._sync()
+        n   = min(n, self._size)
+        end = self._head + self._size
+        return {name: col[end - n:end].copy() for name, col in self._columns.items()}
+
+
+    def merge(self, columns: Dict[str, np.ndarray]) -> None:
+        """Extends the buffer with a block that may start with a new version of the last timeframe.
+
+        Used to mirror the tail of another buffer, see `tail()`. Columns the block does not
+        have keep their value in that timeframe, and get their fill in the new ones.
+        """
+
+        for name, values in columns.items():
+            if name not in self._columns:
+                self.add_column(name, values.dtype, np.nan if values.dtype.kind == "f" else 0)
+        if not len(columns["open_time"]):
+            return
+        if self._size and columns["open_time"][0] == self[-1].open_time_ms:
+            self.unbind_live()
+            idx = self._physical(-1)
+            for name, values in columns.items():
+                self._columns[name][idx] = values[0]
+            columns = {name: values[1:] for name, values in columns.items()}
+        self.extend(columns)
+
+
+    def last_open_time(self) -> int:
+        """Open time of the most recent timeframe in epoch ms. Cheaper than `buffer[-1].open_time_ms`."""
+
+        if not self._size:
+            raise IndexError("CandleBuffer is empty")
+        return int(self._columns["open_time"][self._head + self._size - 1])
+
+
+    def column(self, name: str) -> np.ndarray:
+        """Returns a copy of a column in chronological order, oldest first."""
+
+        return self.view(name).copy()
+
+
+    def view(self, name: str) -> np.ndarray:
+        """Returns a column in chronological order, as a view on the buffer. See `views()`."""
+
+        if self._live is not None:
+            self._sync()
+        return self._columns[name][self._head:self._head + self._size]
+
+
+    def views(self, names: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+        """Returns every column, or the columns in `names`, in chronological order, oldest first,
+        without copying.
+
+        The views share memory with the buffer: writing them writes the buffer.
+        They are only valid until the next append. The cost does not depend
+        on the number of timeframes.
+        """
+
+        if self._live is not None:
+            self._sync()
+        start, end = self._head, self._head + self._size
+        if names is not None:
+            return {name: self._columns[name][start:end] for name in names}
+        return {name: col[start:end] for name, col in self._columns.items()}
+
+
+    def add_column(self, name: str, dtype: Any = np.float64, fill: Any = np.nan) -> np.ndarray:
+        """Adds a column of `fill` values, and returns its view. Does nothing if it exists."""
+
+        if name not in self._columns:
+            self._columns[name] = np.full(len(self._columns["open_time"]), fill, dtype=dtype)
+            self._fills[name]   = fill
+            self._extra[name]   = fill
+        return self.view(name)
+
+
+    def bind_live(self, source, row: int) -> None:
+        """Binds the last timeframe to `row` of a live source.
+
+        The source needs a `version` that changes on every update and a
+        `write(row, columns, idx)` method that copies the row into the columns.
+        """
+
+        self._live         = (source, row)
+        self._live_version = -1
+
+
+    def unbind_live(self) -> None:
+        """Copies the final state of the live source and releases it."""
+
+        if self._live is not None:
+            self._sync()
+            self._live = None
+
+
+    def clear(self) -> None:
+        self._head = 0
+        self._size = 0
+        self._live = None
+
+
+    # Internal
+
+    def _sync(self) -> None:
+        source, row = self._live
+        if source.version != self._live_version and self._size:
+            source.write(row, self._columns, self._head + self._size - 1)
+            self._live_version = source.version
+
+
+    def _physical(self, i: int) -> int:
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError("CandleBuffer index out of range")
+        return self._head + i
+
+
+    def _next_slot(self) -> int:
+        """Reserves the slot for a new timeframe and returns its physical index."""
+
+        if self.capacity:
+            self._make_room(1)
+        elif self._size == len(self._columns["open_time"]):
+            self._grow()
+        idx = self._head + self._size
+        if self._size == self.capacity and self.capacity:
+            # Full: evict the oldest timeframe.
+            self._head += 1
+        else:
+            self._size += 1
+        self._columns["has_candle"][idx] = False
+        self._columns["corrupt"][idx]    = False
+        for name, fill in self._extra.items():
+            self._columns[name][idx] = fill
+        self.n_appended += 1
+        return idx
+
+
+    def _make_room(self, n: int) -> None:
+        """Moves the timeframes that stay after appending `n` to the start of the arrays,
+        if the arrays end before the `n` new slots.
+        """
+
+        end = self._head + self._size
+        if end + n <= len(self._columns["open_time"]):
+            return
+        keep = min(self._size, self.capacity - n)
+        for col in self._columns.values():
+            col[:keep] = col[end - keep:end]
+        self._head = 0
+        self._size = keep
+
+
+    def _grow(self) -> None:
+        for name, col in self._columns.items():
+            grown = np.zeros(2 * len(col), dtype=col.dtype)
+            grown[:self._size] = col[self._head:self._head + self._size]
+            self._columns[name] = grown
+        self._head = 0
+
+
+    def _write_timeframe(self, idx: int, timeframe) -> None:
+        self._columns["open_time"][idx]  = datetime_to_ms(timeframe.open_time)
+        self._columns["close_time"][idx] = datetime_to_ms(timeframe.close_time)
+        self._write_candle(idx, timeframe.candle)
+
+
+    def _write_candle(self, idx: int, candle) -> None:
+        if candle is None:
+            self._columns["has_candle"][idx] = False
+            return
+        for f in CANDLE_FIELDS:
+            self._columns[f][idx] = getattr(candle, f)
+        self._columns["corrupt"][idx]    = bool(getattr(candle, "corrupt", False))
+        self._columns["has_candle"][idx] = True
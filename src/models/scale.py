@@ -0,0 +1,159 @@
+import logging
+from decimal import Decimal
+from typing import Sequence
+
+import numpy as np
+
+
+# Binance sends every price and quantity with at most 8 decimals.
+DECIMALS = 8
+ONE      = 10 ** DECIMALS
+INT64    = np.iinfo(np.int64).max
+
+
+
+def to_units(value: str) -> int:
+    """Converts a decimal string like "45586.41000000" to an int of 1e-8 units. Exact."""
+
+    whole, _, frac = value.partition(".")
+    return int(whole + (frac + "00000000")[:DECIMALS])
+
+
+def to_units_array(values: Sequence[str]) -> np.ndarray:
+    """Vectorized `to_units()`, returns an int64 array."""
+
+    parts = np.char.partition(np.asarray(values, dtype=str), ".")
+    frac  = np.char.ljust(parts[:, 2], DECIMALS, "0").astype(f"<U{DECIMALS}")
+    try:
+        return np.char.add(parts[:, 0], frac).astype(np.int64)
+    except OverflowError:
+        raise OverflowError(f"A value is too large for int64 units of 1e-{DECIMALS}.") from None
+
+
+def _size_in_units(size: str) -> int:
+    units = to_units(size)
+    return units if units > 0 else 1
+
+
+
+class Scale:
+    """Fixed-point representation of the numbers of a single symbol.
+
+    Prices are stored as an int64 number of ticks, base quantities as
+    a number of steps and quote quantities as a number of 1e-8 units.
+    Tick and step size come from the PRICE_FILTER and LOT_SIZE filters
+    in the exchange info. Arithmetic on these ints is exact and runs at
+    integer speed, and arrays of them are ordinary int64 NumPy arrays.
+
+    Quote quantities are limited to about 92 billion by int64, an OverflowError
+    is raised for larger ones, like the quote volume of a month of a large pair.
+
+    The sizes are those of the current exchange info. Older klines may be quoted
+    in a finer tick or step size: values that are not a multiple of the size are
+    rounded to the nearest one, and counted in `n_rounded`.
+    """
+
+    __slots__ = ("tick", "step", "quote", "n_rounded")
+
+    def __init__(
+        self,
+        tick_size:  str = "0.00000001",
+        step_size:  str = "0.00000001",
+        quote_size: str = "0.00000001",
+    ) -> None:
+        # Sizes in 1e-8 units
+        self.tick  = _size_in_units(tick_size)
+        self.step  = _size_in_units(step_size)
+        self.quote = _size_in_units(quote_size)
+
+        self.n_rounded = 0  # values that were not a multiple of their size
+
+
+    @staticmethod
+    def from_symbol_info(info: dict) -> "Scale":
+        """Creates the Scale of one entry in exchange_info["symbols"]."""
+
+        filters = {f["filterType"]: f for f in info["filters"]}
+        return Scale(
+            tick_size  = filters["PRICE_FILTER"]["tickSize"],
+            step_size  = filters["LOT_SIZE"]["stepSize"],
+        )
+
+
+    # Scalars
+
+    def price(self, value: str) -> int:
+        return self._scale(to_units(value), self.tick, value)
+
+    def qty(self, value: str) -> int:
+        return self._scale(to_units(value), self.step, value)
+
+    def quote_qty(self, value: str) -> int:
+        return self._scale(to_units(value), self.quote, value)
+
+
+    # Arrays
+
+    def prices(self, values: Sequence[str]) -> np.ndarray:
+        return self._scale_array(to_units_array(values), self.tick)
+
+    def quantities(self, values: Sequence[str]) -> np.ndarray:
+        return self._scale_array(to_units_array(values), self.step)
+
+    def quote_quantities(self, values: Sequence[str]) -> np.ndarray:
+        return self._scale_array(to_units_array(values), self.quote)
+
+
+    # Back to decimals
+
+    def price_to_decimal(self, ticks: int) -> Decimal:
+        return Decimal(int(ticks) * self.tick).scaleb(-DECIMALS)
+
+    def qty_to_decimal(self, steps: int) -> Decimal:
+        return Decimal(int(steps) * self.step).scaleb(-DECIMALS)
+
+    def quote_qty_to_decimal(self, units: int) -> Decimal:
+        return Decimal(int(units) * self.quote).scaleb(-DECIMALS)
+
+
+    def candle_to_decimals(self, candle: dict) -> dict:
+        """Converts the scaled fields of a candle dict to Decimals."""
+
+        d = dict(candle)
+        for f in ("open_price", "close_price", "high_price", "low_price"):
+            d[f] = self.price_to_decimal(d[f])
+        for f in ("base_volume", "base_volume_taker"):
+            d[f] = self.qty_to_decimal(d[f])
+        for f in ("quote_volume", "quote_volume_taker"):
+            d[f] = self.quote_qty_to_decimal(d[f])
+        return d
+
+
+    def __repr__(self) -> str:
+        return f"Scale(tick={self.tick}, step={self.step}, quote={self.quote})"
+
+
+    # Internal
+
+    def _scale(self, units: int, size: int, value: str) -> int:
+        n, rest = divmod(units, size)
+        if rest:
+            self._rounded(1, value)
+            n = (units + size // 2) // size
+        if n > INT64:
+            raise OverflowError(f"{value} is too large for int64 units of the tick or step size.")
+        return n
+
+    def _scale_array(self, units: np.ndarray, size: int) -> np.ndarray:
+        if size == 1:
+            return units
+        rest = units % size
+        if rest.any():
+            self._rounded(int(np.count_nonzero(rest)), "A value")
+            return (units + size // 2) // size
+        return units // size
+
+    def _rounded(self, n: int, value: str) -> None:
+        if not self.n_rounded:
+            logging.warning(f"{value} is not a multiple of the tick or step size of {self}, rounded it.")
+        self.n_rounded += n
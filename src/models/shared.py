@@ -0,0 +1,88 @@
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .ringbuffer import CANDLE_COLUMNS, CandleBuffer
+
+
+# head, size and n_appended of the buffer, as int64
+HEADER_SIZE = 3 * 8
+
+
+
+def shared_layout(capacity: int, fixed_point: bool, extra: Sequence[str]) -> Tuple[Dict[str, Tuple[int, np.dtype]], int]:
+    """Returns the offset and dtype of every column in the shared memory, and its size in bytes.
+
+    Columns are 8 byte aligned, and hold twice `capacity` values like those of a CandleBuffer.
+    """
+
+    value   = np.dtype(np.int64 if fixed_point else np.float64)
+    dtypes  = [(name, value if dtype is np.float64 else np.dtype(dtype)) for name, dtype in CANDLE_COLUMNS]
+    dtypes += [(name, np.dtype(np.float64)) for name in extra]
+    layout  = dict()
+    offset  = HEADER_SIZE
+    for name, dtype in dtypes:
+        layout[name] = (offset, dtype)
+        offset      += -(-2 * capacity * dtype.itemsize // 8) * 8
+    return layout, offset
+
+
+
+class SharedCandleBuffer:
+    """A bounded CandleBuffer in a block of shared memory, for the feature workers.
+
+    The process that creates it (`name=None`) owns the memory and unlinks it on `close()`.
+    Other processes attach to it by name, with the same capacity and columns.
+    The position of the buffer in its arrays is not shared by itself: the owner
+    `publish()`es it, and an attached process `restore()`s it before reading.
+
+    Usage:
+        shared = SharedCandleBuffer(200, extra=["ema20"])
+        shared.buffer.merge(window.timeframes.tail(10))
+        position = shared.publish()
+        ...
+        attached = SharedCandleBuffer(200, extra=["ema20"], name=shared.name)
+        attached.restore(position)
+    """
+
+    def __init__(
+        self,
+        capacity:    int,
+        fixed_point: bool             = False,
+        extra:       Sequence[str]    = (),
+        name:        Optional[str]    = None,
+    ) -> None:
+        layout, size = shared_layout(capacity, fixed_point, extra)
+        self.owner   = name is None
+        self.memory  = shared_memory.SharedMemory(name, create=self.owner, size=size if self.owner else 0)
+        self.name    = self.memory.name
+        self.header  = np.ndarray(3, np.int64, self.memory.buf)
+        columns = {
+            name: np.ndarray(2 * capacity, dtype, self.memory.buf, offset)
+            for name, (offset, dtype) in layout.items()
+        }
+        self.buffer = CandleBuffer(capacity, columns=columns)
+
+
+    def publish(self) -> Tuple[int, int, int]:
+        """Writes the position of the buffer to the shared header, and returns it."""
+
+        b = self.buffer
+        self.header[:] = b._head, b._size, b.n_appended
+        return b._head, b._size, b.n_appended
+
+
+    def restore(self, position: Optional[Tuple[int, int, int]] = None) -> None:
+        """Sets the position of the buffer, to the one in the shared header by default."""
+
+        b = self.buffer
+        b._head, b._size, b.n_appended = map(int, position if position is not None else self.header)
+
+
+    def close(self) -> None:
+        # The arrays point into the memory, they have to go first.
+        self.buffer = self.header = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
@@ -0,0 +1,261 @@
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from ..bbot.constants import INTERVAL_MS, Interval
+from .ringbuffer import CANDLE_COLUMNS
+from .scale import Scale
+
+
+MAGIC      = b"BBOTCNDL"
+VERSION    = 1
+# Rows per block. A file grows one block at a time.
+BLOCK_ROWS = 1024
+
+HEADER_DTYPE = np.dtype([
+    ("magic",       "S8"),
+    ("version",     "<u4"),
+    ("block_rows",  "<u4"),
+    ("fixed_point", "<u8"),
+    ("tick",        "<i8"),
+    ("step",        "<i8"),
+    ("quote",       "<i8"),
+    ("n_rows",      "<i8"),
+    ("padding",     "V8"),
+])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+
+
+
+def block_dtype(fixed_point: bool) -> np.dtype:
+    """Layout of one block: every column is stored contiguously, BLOCK_ROWS values each."""
+
+    value = np.dtype("<i8" if fixed_point else "<f8")
+    return np.dtype([
+        (name, value if dtype is np.float64 else np.dtype(dtype).newbyteorder("<"), (BLOCK_ROWS,))
+        for name, dtype in CANDLE_COLUMNS
+    ])
+
+
+def candle_dir(datadir: Union[str, Path]) -> Path:
+    """Directory of the CandleStore under `Options.datadir`."""
+
+    return Path(datadir) / "candles"
+
+
+def scale_units(scale: Optional[Scale]) -> Tuple[int, int, int]:
+    return (scale.tick, scale.step, scale.quote) if scale is not None else (0, 0, 0)
+
+
+
+class CandleFile:
+    """Closed candles of one symbol and interval, in a memory-mapped file.
+
+    The file starts with a header, followed by blocks of BLOCK_ROWS rows.
+    Within a block every column of CANDLE_COLUMNS is contiguous, so reading
+    a column of the last n candles touches only the blocks that hold them.
+    Rows are only appended, in order of open time. The row count in the header
+    is updated after the rows are written, so a process that dies halfway
+    an append leaves a valid file.
+
+    Prices and volumes are stored like the window stores them: float64, or
+    int64 in the units of `scale`. A file written with another scale is not
+    read, and is started anew when it is opened for writing.
+    """
+
+    def __init__(self, path: Union[str, Path], scale: Optional[Scale] = None, writable: bool = True) -> None:
+        self.path     = Path(path)
+        self.scale    = scale
+        self.writable = writable
+        self._header  = None
+        self._blocks  = None
+        self._dtype   = block_dtype(scale is not None)
+
+        if self.path.exists() and self.path.stat().st_size >= HEADER_SIZE:
+            self._map()
+            if not self.compatible():
+                logging.warning(f"Candle store {self.path} was written with another scale, starting anew.")
+                self._header = self._blocks = None
+        if self._header is None and writable:
+            self._create()
+
+
+    def __len__(self) -> int:
+        return int(self._header["n_rows"][0]) if self._header is not None else 0
+
+
+    def compatible(self) -> bool:
+        h = self._header[0]
+        return (
+            h["magic"] == MAGIC
+            and h["version"] == VERSION
+            and h["block_rows"] == BLOCK_ROWS
+            and bool(h["fixed_point"]) == (self.scale is not None)
+            and (int(h["tick"]), int(h["step"]), int(h["quote"])) == scale_units(self.scale)
+        )
+
+
+    def last_open_time(self) -> int:
+        """Open time of the last stored candle in epoch ms, -1 if there is none."""
+
+        n = len(self)
+        if not n:
+            return -1
+        return int(self._blocks["open_time"][(n - 1) // BLOCK_ROWS, (n - 1) % BLOCK_ROWS])
+
+
+    def append(self, columns: Dict[str, np.ndarray]) -> None:
+        """Appends rows, given as one array per column like `CandleBuffer.tail()` returns them."""
+
+        n = len(columns["open_time"])
+        if not n:
+            return
+        start = len(self)
+        self._reserve(start + n)
+        done = 0
+        while done < n:
+            b, o = divmod(start + done, BLOCK_ROWS)
+            k    = min(n - done, BLOCK_ROWS - o)
+            for name in self._dtype.names:
+                self._blocks[name][b, o:o + k] = columns[name][done:done + k]
+            done += k
+        self._header["n_rows"] = start + n
+
+
+    def tail(self, n: int) -> Dict[str, np.ndarray]:
+        """Returns the last `n` rows as one array per column, oldest first."""
+
+        stop  = len(self)
+        start = max(0, stop - n)
+        if start == stop:
+            return {name: np.zeros(0, self._dtype[name].base) for name in self._dtype.names}
+        b0, b1 = start // BLOCK_ROWS, (stop - 1) // BLOCK_ROWS + 1
+        offset = start - b0 * BLOCK_ROWS
+        return {
+            name: self._blocks[name][b0:b1].reshape(-1)[offset:offset + stop - start]
+            for name in self._dtype.names
+        }
+
+
+    def flush(self) -> None:
+        if self._blocks is not None and self.writable:
+            self._blocks.flush()
+            self._header.flush()
+
+
+    # Internal
+
+    def _map(self) -> None:
+        mode         = "r+" if self.writable else "r"
+        size         = self.path.stat().st_size
+        n_blocks     = (size - HEADER_SIZE) // self._dtype.itemsize
+        self._header = np.memmap(self.path, HEADER_DTYPE, mode, shape=(1,))
+        self._blocks = np.memmap(self.path, self._dtype, mode, HEADER_SIZE, (n_blocks,)) if n_blocks else None
+
+
+    def _create(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        header = np.zeros(1, HEADER_DTYPE)
+        header["magic"]       = MAGIC
+        header["version"]     = VERSION
+        header["block_rows"]  = BLOCK_ROWS
+        header["fixed_point"] = self.scale is not None
+        header["tick"], header["step"], header["quote"] = scale_units(self.scale)
+        with open(self.path, "wb") as f:
+            f.write(header.tobytes())
+        self._map()
+
+
+    def _reserve(self, n_rows: int) -> None:
+        n_blocks = -(-n_rows // BLOCK_ROWS)
+        if self._blocks is not None and len(self._blocks) >= n_blocks:
+            return
+        self.flush()
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_SIZE + n_blocks * self._dtype.itemsize)
+        self._map()
+
+
+
+class CandleStore:
+    """One CandleFile per symbol and interval, under `root`.
+
+    Windows are loaded with `Window.load()` when the bot starts, see `Candle.get_tasks()`.
+    Every consumer keeps a store of its own and calls `sync()` after every item, which
+    appends the timeframes that were closed since the last call. The last timeframe of
+    a window is still open and is not stored. The 2s window is built from the stream
+    and is not stored.
+
+    Usage:
+        store = CandleStore(candle_dir(options.datadir))
+        store.load("btcusdt", db.symbols["btcusdt"].windows)
+    """
+
+    def __init__(self, root: Union[str, Path]) -> None:
+        self.root    = Path(root)
+        self._files: Dict[Tuple[str, Interval], CandleFile] = dict()
+        self._synced: Dict[Tuple[str, Interval], int]       = dict()  # n_appended of the window
+
+
+    def path(self, symbol: str, interval: Interval) -> Path:
+        return self.root / symbol / f"{Interval(interval).value}.candles"
+
+
+    def open(
+        self,
+        symbol:   str,
+        interval: Interval,
+        scale:    Optional[Scale] = None,
+        writable: bool            = True,
+    ) -> CandleFile:
+        if not writable:
+            return CandleFile(self.path(symbol, interval), scale, writable=False)
+        key = (symbol, interval)
+        if key not in self._files:
+            self._files[key] = CandleFile(self.path(symbol, interval), scale)
+        return self._files[key]
+
+
+    def load(self, symbol: str, windows: Dict[Interval, "Window"], now_ms: Optional[int] = None) -> None:
+        """Loads the stored candles of every window of `symbol`, see `Window.load()`.
+
+        With `now_ms`, windows whose last stored candle is more than a window length
+        before it are left empty, the download of the history replaces them anyway.
+        """
+
+        for iv, window in windows.items():
+            if iv == Interval.SECOND_2 or not self.path(symbol, iv).exists():
+                continue
+            f = self.open(symbol, iv, window.scale, writable=False)
+            if now_ms is not None and f.last_open_time() < now_ms - (window.window_length or 1000) * INTERVAL_MS[iv]:
+                continue
+            window.load(f)
+
+
+    def sync(self, symbol: str, windows: Dict[Interval, "Window"]) -> None:
+        """Appends the timeframes of the windows of `symbol` that closed since the last sync."""
+
+        for iv, window in windows.items():
+            buffer = window.timeframes
+            key    = (symbol, iv)
+            synced = self._synced.get(key)
+            if synced == buffer.n_appended or iv == Interval.SECOND_2:
+                continue
+            self._synced[key] = buffer.n_appended
+            n = len(buffer) if synced is None else min(len(buffer), buffer.n_appended - synced + 1)
+            if n < 2:
+                continue
+
+            f      = self.open(symbol, iv, window.scale)
+            tail   = buffer.tail(n)
+            closed = tail["open_time"][:-1] > f.last_open_time()
+            if closed.any():
+                f.append({name: col[:-1][closed] for name, col in tail.items()})
+
+
+    def close(self) -> None:
+        for f in self._files.values():
+            f.flush()
+        self._files.clear()
@@ -1,14 +1,32 @@
 # pylint: disable=no-name-in-module
 
+from typing import Optional
+
 from pydantic import BaseModel
 from pydantic.types import constr
 
-from .options import Options
+from ..bbot.constants import Interval
+from .scale import Scale
 from .window import Window
 
 
 class Symbol(BaseModel):
-    """Holds all data related to a symbol, such as `BTCUSDT`."""
+    """Holds all data related to a symbol, such as `BTCUSDT`.
+
+    With a `scale`, windows without one get the scale of the symbol.
+    """
+
+    name:    constr(strip_whitespace=True, to_lower=True, min_length=3, max_length=20)
+    scale:   Optional[Scale]        = None   # set if Options.fixed_point
+    windows: dict[Interval, Window] = dict()
+
+    class Config:
+        arbitrary_types_allowed = True
+
 
-    name:    constr(strip_whitespace=True, to_lower=True, min_length=3, max_length=6)
-    windows: dict[Options.Interval, Window] = dict()
\ No newline at end of file
+    def __init__(self, **data) -> None:
+        super().__init__(**data)
+        if self.scale is not None:
+            for window in self.windows.values():
+                if window.scale is None:
+                    window.set_scale(self.scale)
@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from pydantic import BaseModel
-from pydantic.types import PositiveInt, StrictBool, condecimal, conint
+from pydantic.types import PositiveInt, StrictBool, condecimal
 
 class AggTrade(BaseModel):
     """Aggregate trade: trade information that is aggregated for a single taker order.
@@ -25,13 +25,13 @@ class AggTrade(BaseModel):
     trade_time:          datetime
     aggtrade_id:         PositiveInt
     first_trade_id:      PositiveInt
-    last_trade_id:       conint(ge= first_trade_id)
+    last_trade_id:       PositiveInt
     price:               condecimal(decimal_places=8)
     quantity:            condecimal(decimal_places=8)
     buyer_is_maker:      StrictBool
 
 
-class Trade():
+class Trade(BaseModel):
     """Raw information about a single (partial) trade/transaction. 
     Each trade has a unique buyer and seller.
 
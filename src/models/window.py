@@ -1,23 +1,101 @@
 # pylint: disable=no-name-in-module
 
-from collections import deque
 from datetime import timedelta
-from typing import Deque, Optional
+from typing import Optional
 
+import numpy as np
 from pydantic import BaseModel
 
-from .candle import Candle
-from .options import Options
-from .timeframe import TimeFrame
+from ..bbot.constants import INTERVAL_MS, Interval
+from .candle import CandleRecord
+from .ringbuffer import CandleBuffer
+from .scale import Scale
 
 
 class Window(BaseModel):
-    """Holds a sequence of timeframes and additional metadata."""
+    """Holds a sequence of timeframes and additional metadata.
 
-    interval:                   Options.Interval
-    timeframes:                 Deque[TimeFrame]    = deque()
+    Timeframes are stored in a columnar buffer of `window_length` slots.
+    `window.timeframes[-1].candle` returns a lightweight view on that storage.
+    With a `scale`, prices and volumes are stored as scaled int64 instead of float64.
+    """
 
-    _last_candle_update:        Optional[Candle]    = None
-    _last_candle_update_closed: Optional[bool]      = None
-    _history_downloaded:        bool                = False
-    _latency:                   Optional[timedelta] = None
+    interval:                   Interval
+    window_length:              int                    = 200
+    scale:                      Optional[Scale]        = None
+    timeframes:                 Optional[CandleBuffer] = None
+
+    _last_candle_update:        Optional[CandleRecord] = None
+    _last_candle_update_closed: Optional[bool]         = None
+    _last_update_open_time:     Optional[int]          = None   # of the 1m kline of the last update
+    _history_downloaded:        bool                   = False
+    _latency:                   Optional[timedelta]    = None
+
+
+    class Config:
+        arbitrary_types_allowed      = True
+        underscore_attrs_are_private = True
+
+
+    def __init__(self, **data) -> None:
+        super().__init__(**data)
+        if self.timeframes is None:
+            self.timeframes = CandleBuffer(self.window_length, self.scale)
+
+
+    def set_scale(self, scale: Optional[Scale]) -> None:
+        """Stores the prices and volumes of an empty window in the units of `scale`."""
+
+        if self.timeframes:
+            raise ValueError("Can only change the scale of an empty window.")
+        self.scale      = scale
+        self.timeframes = CandleBuffer(self.window_length, scale)
+
+
+    def to_numpy(self, column: Optional[str] = None):
+        """Returns the columns of the timeframes as NumPy arrays that share memory with the window.
+
+        A dict of all columns, or a single array when `column` is given.
+        Valid until the window is updated.
+        """
+
+        if column is not None:
+            return self.timeframes.view(column)
+        return self.timeframes.views()
+
+
+    def to_frame(self):
+        """Returns the timeframes as a pandas DataFrame that shares memory with the window.
+
+        Requires pandas, see models/frame.py. Valid until the window is updated.
+        """
+
+        from .frame import to_frame
+        return to_frame(self)
+
+
+    def to_arrow(self):
+        """Returns the timeframes as an Arrow Table that shares memory with the window.
+
+        Requires pyarrow, see models/arrow.py. Valid until the window is updated.
+        """
+
+        from .arrow import to_table
+        return to_table(self)
+
+
+    def load(self, file: "CandleFile") -> int:
+        """Fills an empty window with the last stored candles, see models/store.py.
+
+        Only the candles after the last gap in the file are loaded, so the window
+        stays continuous. Returns the number of loaded timeframes.
+        """
+
+        if self.timeframes:
+            raise ValueError("Can only load stored candles in an empty window.")
+        columns = file.tail(self.window_length or len(file))
+        gaps    = np.flatnonzero(np.diff(columns["open_time"]) != INTERVAL_MS[self.interval])
+        if len(gaps):
+            columns = {name: col[gaps[-1] + 1:] for name, col in columns.items()}
+        self.timeframes.extend(columns)
+        return len(columns["open_time"])
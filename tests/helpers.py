@@ -0,0 +1,74 @@
+"""Data and databases shared by the tests."""
+
+import copy
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+from src.bbot.constants import ContentType, Interval
+from src.bbot.consumers import FINISHED
+from src.models.database import DataBase
+from src.models.options import Options
+from src.models.symbol import Symbol
+from src.models.window import Window
+
+RAW_DATA = Path(__file__).resolve().parent / "raw_data"
+SYMBOLS = ("btcusdt", "ethusdt", "bnbusdt")
+INTERVALS = (Interval.SECOND_2, Interval.MINUTE_1, Interval.MINUTE_3)
+
+
+def load(name):
+    return json.loads((RAW_DATA / name).read_text())
+
+
+def candle(price):
+    return SimpleNamespace(
+        open_price=price,
+        close_price=price + 1,
+        high_price=price + 2,
+        low_price=price - 1,
+        base_volume=10.0,
+        quote_volume=20.0,
+        base_volume_taker=5.0,
+        quote_volume_taker=6.0,
+        n_trades=7,
+    )
+
+
+def window(n, capacity=5):
+    """A 1m window of `capacity` timeframes, after `n` candles were appended."""
+    w = Window(interval=Interval.MINUTE_1, window_length=capacity)
+    for i in range(n):
+        w.timeframes.append_row(i * 60000, i * 60000 + 59999, candle(float(i)))
+    return w
+
+
+def create_db(features=None, window_length=50, **options):
+    """A DataBase with a window of every interval in INTERVALS for every symbol in SYMBOLS."""
+    db = DataBase(options=Options(validation_sample_rate=0, features=features, **options))
+    for s in SYMBOLS:
+        db.symbols[s] = Symbol(
+            name=s, windows={iv: Window(interval=iv, window_length=window_length) for iv in INTERVALS}
+        )
+    return db
+
+
+def items():
+    """History notifications and a continuous kline stream, interleaved over all symbols."""
+    template = load("kline_1m.json")[0]
+    start = template["data"]["E"] // 60000 * 60000
+    out = [(s, iv.value, None, FINISHED) for s in SYMBOLS for iv in INTERVALS[1:]]
+    for j in range(200):
+        for n, s in enumerate(SYMBOLS):
+            m = copy.deepcopy(template)
+            m["stream"] = f"{s}@kline_1m"
+            e = start + 2000 * j
+            tick = (e % 60000) // 2000
+            k = m["data"]["k"]
+            m["data"]["E"] = e
+            k["t"], k["T"], k["x"] = e // 60000 * 60000, e // 60000 * 60000 + 59999, tick == 29
+            k["c"] = f"{45000 + n + j % 7:.8f}"
+            k["v"] = f"{1 + tick * 0.5:.8f}"
+            k["n"] = 10 + tick
+            out.append((s, "*", ContentType.CANDLE_STREAM, m))
+    return out
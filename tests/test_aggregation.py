@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.bbot.constants import Interval
+from src.bbot.pipeline.aggregation import IntervalAggregator
+from src.models.ringbuffer import CandleBuffer
+
+
+def kline(o, h, l, c, v, n):
+    return SimpleNamespace(
+        open_price=o,
+        high_price=h,
+        low_price=l,
+        close_price=c,
+        base_volume=v,
+        quote_volume=v * 10,
+        base_volume_taker=v / 2,
+        quote_volume_taker=v * 5,
+        n_trades=n,
+    )
+
+
+@pytest.fixture
+def windows():
+    return {
+        iv: SimpleNamespace(timeframes=CandleBuffer(10))
+        for iv in (Interval.SECOND_2, Interval.MINUTE_1, Interval.MINUTE_3)
+    }
+
+
+def test_aggregates_into_higher_intervals(windows):
+    agg = IntervalAggregator(windows)
+    assert agg.intervals == [Interval.MINUTE_1, Interval.MINUTE_3]
+
+    agg.update(0, kline(10, 10, 10, 10, 1.0, 1), False)       # seeds, no delta known
+    agg.update(0, kline(10, 12, 9, 11, 3.0, 4), False)
+    agg.update(0, kline(10, 12, 9, 11.5, 4.0, 5), True)       # 1m kline closes
+    agg.update(60000, kline(11.5, 14, 11, 13, 2.0, 2), False)
+
+    m1 = windows[Interval.MINUTE_1].timeframes
+    m3 = windows[Interval.MINUTE_3].timeframes
+    assert len(m1) == 2
+    assert len(m3) == 1
+    assert m1[0].candle.close_price == 11.5
+    assert m1[0].candle.base_volume == 4.0
+    assert m1[-1].candle.base_volume == 2.0
+    assert m1[-1].close_time.timestamp() * 1000 == 119999
+
+    c = m3[-1].candle
+    assert (c.open_price, c.high_price, c.low_price, c.close_price) == (10, 14, 9, 13)
+    assert c.base_volume == 6.0
+    assert c.n_trades == 7
+    assert len(windows[Interval.SECOND_2].timeframes) == 0
+
+
+def test_rolls_over_higher_interval(windows):
+    agg = IntervalAggregator(windows)
+    agg.update(0, kline(1, 1, 1, 1, 0.0, 0), False)
+    for minute in range(4):
+        agg.update(minute * 60000, kline(1, 2, 1, 2, 1.0, 1), True)
+
+    m3 = windows[Interval.MINUTE_3].timeframes
+    assert [tf.open_time_ms for tf in m3] == [0, 180000]
+    assert m3[0].candle.base_volume == 3.0
+    assert m3[-1].candle.base_volume == 1.0
+
+
+def test_drops_late_update(windows):
+    agg = IntervalAggregator(windows)
+    agg.update(0, kline(1, 1, 1, 1, 0.0, 0), False)
+    assert agg.update(180000, kline(1, 1, 1, 1, 1.0, 1), False)
+    assert not agg.update(0, kline(1, 5, 0, 5, 9.0, 9), True)
+    assert agg.n_late == 1
+
+    m3 = windows[Interval.MINUTE_3].timeframes
+    assert [tf.open_time_ms for tf in m3] == [180000]
+    assert (m3[-1].candle.high_price, m3[-1].candle.base_volume) == (1, 1.0)
+    assert agg.update(180000, kline(1, 2, 1, 2, 3.0, 2), False)
+    assert m3[-1].candle.base_volume == 3.0
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from src.bbot.constants import Interval
+from src.models.database import DataBase
+from src.models.options import Options
+from src.models.symbol import Symbol
+
+from .helpers import window
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from src.models.arrow import ParquetWriter, record_batch  # noqa: E402
+
+
+def test_batch_shares_memory():
+    w = window(7)
+    batch = record_batch(w)
+    assert batch.num_rows == 5
+
+    table = w.to_arrow()
+    assert table.column("close_price").to_pylist() == [3.0, 4.0, 5.0, 6.0, 7.0]
+    assert table.column("open_time").type == pa.timestamp("ms", tz="UTC")
+
+    # Writing the window shows through the batch, nothing was copied
+    w.timeframes[-1].candle.close_price = 100.0
+    assert table.column("close_price").to_pylist()[-1] == 100.0
+    address = batch.column(0).buffers()[1].address
+    assert address == w.timeframes.view("open_time").ctypes.data
+
+
+def test_parquet_round_trip(tmp_path):
+    db = DataBase(options=Options())
+    db.symbols["btcusdt"] = Symbol(
+        name="btcusdt", windows={Interval.MINUTE_1: window(7), Interval.MINUTE_3: window(2)}
+    )
+    paths = ParquetWriter(tmp_path).write_database(db)
+    assert len(paths) == 2
+
+    table = pq.read_table(paths[0])
+    expected = db.symbols["btcusdt"].windows[Interval.MINUTE_1].timeframes
+    assert np.array_equal(table.column("high_price").to_numpy(), expected.column("high_price"))
+    assert table.schema.metadata[b"interval"] == b"1m"
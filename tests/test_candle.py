@@ -0,0 +1,42 @@
+from src.models.candle import Candle, CandleRecord, ValidationSampler
+
+from .helpers import load
+
+
+def test_parse_candle_fast_matches_validated():
+    raw = load("kline_1m.json")[0]["data"]["k"]
+    fast = Candle.parse_candle_fast(raw)
+    validated = Candle.parse_candle(raw)
+    assert isinstance(fast, CandleRecord)
+    for f in CandleRecord.__slots__:
+        assert getattr(fast, f) == float(getattr(validated, f))
+    assert not fast.corrupt
+
+
+def test_parse_historical_candle_fast():
+    raw = load("hist_candles.json")[0]
+    fast = Candle.parse_historical_candle_fast(raw, validate=True)
+    assert fast.open_price == 45586.41
+    assert fast.n_trades == 2082
+    assert not fast.corrupt
+
+
+def test_sampled_validation_marks_corrupt():
+    raw = dict(load("kline_1m.json")[0]["data"]["k"], o="-1.0")
+    assert not Candle.parse_candle_fast(raw).corrupt
+    assert Candle.parse_candle_fast(raw, validate=True).corrupt
+
+
+def test_parse_kline():
+    kline = Candle.parse_kline(load("kline_1m.json")[0])
+    assert kline.symbol == "btcusdt"
+    assert kline.open_time == 1628726820000
+    assert not kline.closed
+    assert isinstance(kline.candle, CandleRecord)
+
+
+def test_validation_sampler():
+    sampler = ValidationSampler(3)
+    assert [sampler() for _ in range(6)] == [False, False, True] * 2
+    never = ValidationSampler(0)
+    assert not any(never() for _ in range(10))
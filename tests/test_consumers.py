@@ -0,0 +1,87 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.bbot.constants import ConsumerMode, ContentType, Interval
+from src.bbot.consumers import FINISHED, ConsumerPool, ShardConsumer, consumer_shard
+
+from .helpers import INTERVALS, SYMBOLS, create_db, items
+
+
+def reference():
+    db = create_db()
+    consumer = ShardConsumer(db)
+    for item in items():
+        consumer.process(item)
+    return db
+
+
+def assert_same_windows(db, expected):
+    for s in SYMBOLS:
+        for iv in INTERVALS:
+            a = db.symbols[s].windows[iv].timeframes
+            b = expected.symbols[s].windows[iv].timeframes
+            assert len(a) == len(b) > 0
+            for name in ("open_time", "close_price", "high_price", "base_volume", "n_trades"):
+                assert np.array_equal(a.column(name), b.column(name)), (s, iv, name)
+
+
+def test_consumer_shard_is_stable():
+    shards = [consumer_shard(s, 4) for s in SYMBOLS]
+    assert shards == [consumer_shard(s, 4) for s in SYMBOLS]
+    assert all(0 <= i < 4 for i in shards)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", list(ConsumerMode))
+async def test_pool_matches_serial_consumer(mode):
+    db = create_db()
+    pool = ConsumerPool(db, n_shards=2, mode=mode, queue_size=8)
+    tasks = pool.start()
+    for item in items():
+        await pool.put(item)
+    await asyncio.get_running_loop().run_in_executor(None, pool.stop, 30)
+    await asyncio.wait_for(asyncio.gather(*tasks), 30)
+
+    assert sum(pool.n_items) == len(items())
+    assert_same_windows(db, reference())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", list(ConsumerMode))
+async def test_bad_item_does_not_stop_the_shard(mode):
+    db = create_db()
+    pool = ConsumerPool(db, n_shards=2, mode=mode, queue_size=8)
+    tasks = pool.start()
+    stream = items()
+    bad = ("btcusdt", "*", ContentType.CANDLE_STREAM, {"stream": "btcusdt@kline_1m", "data": {"k": {"t": 0}}})
+    for i, item in enumerate(stream):
+        if i == len(stream) // 2:
+            await pool.put(bad)
+        await pool.put(item)
+    await asyncio.get_running_loop().run_in_executor(None, pool.stop, 30)
+    await asyncio.wait_for(asyncio.gather(*tasks), 30)
+
+    assert pool.n_errors() == {ContentType.CANDLE_STREAM: 1}
+    assert_same_windows(db, reference())
+
+
+
+def test_dropped_updates_leave_empty_2s_timeframes():
+    db = create_db()
+    consumer = ShardConsumer(db)
+    stream = items()
+    # Every fourth update of btcusdt is dropped, the last one of a kline among them
+    dropped = [i for i, item in enumerate(stream) if item[0] == "btcusdt" and item[3] != FINISHED][1::4]
+    assert any(stream[i][3]["data"]["k"]["x"] for i in dropped)
+    for i, item in enumerate(stream):
+        if i not in dropped:
+            assert consumer.consume(item)
+    assert not consumer.n_errors
+
+    window = db.symbols["btcusdt"].windows[Interval.SECOND_2].timeframes
+    assert (np.diff(window.column("open_time")) == 2000).all()
+    has_candle = window.column("has_candle")
+    assert 0 < (~has_candle).sum() < len(window)
+    assert (window.column("base_volume")[has_candle] > 0).all()
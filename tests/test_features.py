@@ -0,0 +1,374 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src.bbot import featurepool
+from src.bbot.constants import ConsumerMode, ContentType
+from src.bbot.consumers import ConsumerPool, ShardConsumer, consumer_shard
+from src.bbot.featurepool import FeaturePool
+from src.bbot.features import Feature, FeatureEngine, PanelEngine, PanelFeature, ema, graph, panel
+from src.bbot.latency import LatencyStats
+from src.bbot.metrics import Metrics
+from src.models.window import Window
+
+from .helpers import INTERVALS, SYMBOLS, candle, create_db, items, window
+
+
+def last_close(window):
+    return window.to_numpy("close_price")[-1]
+
+
+def test_incremental_matches_recomputation():
+    ema5 = ema(5)
+    db, short = create_db({ema5, last_close}), create_db({ema5}, window_length=5)
+    consumers = ShardConsumer(db), ShardConsumer(short)
+    checked = 0
+    for item in items():
+        for consumer in consumers:
+            consumer.process(item)
+        if item[0] != "btcusdt" or not db.symbols["btcusdt"].windows[INTERVALS[1]].timeframes:
+            continue
+        # Every tick updates the open candle, every 30 ticks a new one is appended
+        for iv, w in db.symbols["btcusdt"].windows.items():
+            assert w.timeframes.view(ema5.name)[-1] == pytest.approx(ema5(w))
+            assert w.timeframes.view("last_close")[-1] == last_close(w)
+            # Evicted candles stay in the state
+            assert short.symbols["btcusdt"].windows[iv].timeframes.view(ema5.name)[-1] == pytest.approx(
+                w.timeframes.view(ema5.name)[-1]
+            )
+            checked += 1
+    assert checked > 500
+
+    # The values of closed candles are the ones of their final version
+    w = db.symbols["ethusdt"].windows[INTERVALS[1]]
+    closes = w.to_numpy("close_price")
+    expected = [closes[0]]
+    for c in closes[1:]:
+        expected.append(expected[-1] + (c - expected[-1]) / 3)
+    assert np.allclose(w.timeframes.view(ema5.name), expected)
+
+
+def test_state_is_not_updated_by_the_open_candle():
+    updates = []
+
+    def count(state, candle):
+        updates.append(candle.close_price)
+        return state + 1, state + 1
+
+    engine = FeatureEngine({Feature("n_closed", update=count, init=lambda: 0)})
+    window = Window(interval=INTERVALS[1], window_length=10)
+    buffer = window.timeframes
+    for i in range(3):
+        buffer.append_row(i * 60000, i * 60000 + 59999, candle(float(i)))
+        for _ in range(4):
+            buffer[-1].candle.close_price += 1
+            engine.update("btcusdt", {INTERVALS[1]: window})
+    assert list(buffer.view("n_closed")) == [1, 2, 3]
+    # Four ticks per candle, and once more for the final version of a closed candle
+    assert len(updates) == 3 * 4 + 2
+    assert updates[4] == updates[3] == 5.0
+
+
+@pytest.mark.asyncio
+async def test_worker_processes_send_features_back():
+    db, serial = create_db({ema(5)}), create_db({ema(5)})
+    pool = ConsumerPool(db, n_shards=2, mode=ConsumerMode.PROCESS, queue_size=8)
+    tasks = pool.start()
+    consumer = ShardConsumer(serial)
+    for item in items():
+        await pool.put(item)
+        consumer.process(item)
+    await asyncio.get_running_loop().run_in_executor(None, pool.stop, 30)
+    await asyncio.wait_for(asyncio.gather(*tasks), 30)
+
+    for s in SYMBOLS:
+        for iv in INTERVALS:
+            a = db.symbols[s].windows[iv].timeframes.view("ema5_close_price")
+            assert np.allclose(a, serial.symbols[s].windows[iv].timeframes.view("ema5_close_price"))
+
+
+def test_feature_needs_one_function():
+    with pytest.raises(ValueError):
+        Feature("none")
+
+
+def true_range(state, high, low, close):
+    tr = high - low if state is None else max(high, state) - min(low, state)
+    return close, tr
+
+
+def test_graph_orders_inputs_first():
+    tr = Feature("tr", update=true_range, inputs=["high_price", "low_price", "close_price"])
+    atr = ema(3, "tr", name="atr")
+    stop = Feature("stop", compute=lambda close, atr: close[-1] - 2 * atr[-1], inputs=["close_price", "atr"])
+    assert [f.name for f in graph({stop, atr, tr})] == ["tr", "atr", "stop"]
+
+    with pytest.raises(ValueError, match="not a window column"):
+        graph({atr})
+    a = Feature("a", compute=np.mean, inputs=["b"])
+    b = Feature("b", compute=np.mean, inputs=["a"])
+    with pytest.raises(ValueError, match="depend on each other"):
+        graph({a, b})
+
+
+def test_nodes_run_once_and_only_when_inputs_change():
+    calls = []
+
+    def counted(name, f):
+        def wrapper(*args):
+            calls.append(name)
+            return f(*args)
+        return wrapper
+
+    tr = Feature("tr", update=counted("tr", true_range), inputs=["high_price", "low_price", "close_price"])
+    atr = ema(3, "tr", name="atr")
+    atr.update = counted("atr", atr.update)
+    fast, slow = ema(2), ema(4)
+    cross = Feature(
+        "cross", compute=counted("cross", lambda f, s: f[-1] - s[-1]), inputs=[fast.name, slow.name]
+    )
+    latency = LatencyStats()
+    engine = FeatureEngine({tr, atr, fast, slow, cross}, latency)
+    window = Window(interval=INTERVALS[1], window_length=10)
+    buffer = window.timeframes
+    tick = lambda: engine.update("btcusdt", {INTERVALS[1]: window})
+
+    buffer.append_row(0, 59999, candle(1.0))
+    tick()
+    assert calls == ["tr", "atr", "cross"]
+
+    # Only the volume changed: nothing depends on it
+    calls.clear()
+    buffer[-1].candle.base_volume += 1
+    tick()
+    assert calls == []
+
+    # The low does not change the EMAs of the close, so cross is skipped
+    buffer[-1].candle.low_price -= 1
+    tick()
+    assert calls == ["tr", "atr"]
+
+    # The true range of the first candle does not depend on the close, so atr is skipped
+    calls.clear()
+    buffer[-1].candle.close_price += 1
+    tick()
+    assert calls == ["tr", "cross"]
+    assert buffer.view("cross")[-1] == pytest.approx(0.0)
+
+    # A new candle folds the final version of the previous one into the state
+    calls.clear()
+    buffer.append_row(60000, 119999, candle(4.0))
+    tick()
+    assert calls == ["tr", "tr", "atr", "atr", "cross"]
+    assert buffer.view("atr")[-1] == pytest.approx(atr(window))
+    assert buffer.view("cross")[-1] == pytest.approx(fast(window) - slow(window))
+
+    summary = latency.feature_summary()
+    assert summary["tr"]["count"] == 4 and summary["cross"]["count"] == 3
+    assert summary["ema2_close_price"]["count"] == 3
+    text = Metrics().render(SimpleNamespace(latency=latency))
+    assert 'bbot_feature_seconds_count{feature="atr"} 3' in text
+
+
+def test_feature_pool_matches_consumer():
+    features = {ema(5), Feature("tr", update=true_range, inputs=["high_price", "low_price", "close_price"])}
+    db, serial = create_db(features), create_db(features)
+    db.options.feature_workers = 2
+    pooled, consumer = ShardConsumer(db), ShardConsumer(serial)
+    try:
+        for item in items():
+            pooled.process(item)
+            consumer.process(item)
+        pooled.features.flush(30)
+    finally:
+        pooled.close()
+
+    # Timeframes of the 2s window that were evicted while the workers started are not
+    # in the state of the pool, the EMA forgets them after a few timeframes.
+    for s in SYMBOLS:
+        for iv in INTERVALS:
+            a, b = db.symbols[s].windows[iv].timeframes, serial.symbols[s].windows[iv].timeframes
+            start = -10 if iv == INTERVALS[0] else 0
+            for name in ("ema5_close_price", "tr"):
+                assert np.allclose(a.view(name)[start:], b.view(name)[start:], equal_nan=True), (s, iv, name)
+
+
+def test_panel_aligns_on_open_time():
+    windows = [Window(interval=INTERVALS[1], window_length=10) for _ in range(3)]
+    for i in range(5):
+        windows[0].timeframes.append_row(i * 60000, i * 60000 + 59999, candle(float(i)))
+    # Behind by one timeframe, and a gap
+    for i in (0, 1, 3):
+        windows[1].timeframes.append_row(i * 60000, i * 60000 + 59999, candle(float(10 + i)))
+
+    matrix = panel(windows, "open_price", 4)
+    assert matrix.shape == (2, 4)
+    assert list(matrix[0]) == [1.0, 2.0, 3.0, 4.0]
+    assert np.array_equal(matrix[1], [11.0, np.nan, 13.0, np.nan], equal_nan=True)
+
+    momentum = PanelFeature("momentum", lambda m: m[:, -1] - m[:, 0], INTERVALS[1], "open_price", 4)
+    assert np.array_equal(momentum(windows), [3.0, np.nan, np.nan], equal_nan=True)
+
+
+def momentum(closes):
+    return closes[:, -1] / closes[:, 0] - 1
+
+
+def rank(closes):
+    return closes[:, -1].argsort().argsort()
+
+
+def no_panel(closes):
+    raise ValueError("no panel")
+
+
+async def settled(db, minute):
+    """Waits until `minute` is the last 1m timeframe of every symbol, and a few panel periods more."""
+    buffers = [db.symbols[s].windows[INTERVALS[1]].timeframes for s in SYMBOLS]
+    while not all(b and b.last_open_time() == minute for b in buffers):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(10 * db.options.panel_period)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", list(ConsumerMode))
+async def test_pool_computes_panels_over_all_shards(mode):
+    db = create_db({
+        PanelFeature("momentum", momentum, INTERVALS[0], length=5),
+        PanelFeature("rank", rank, INTERVALS[1]),
+        PanelFeature("broken", no_panel, INTERVALS[1]),
+        ema(3),
+    })
+    db.options = db.options.copy(update={"panel_period": 0.01})
+    pool = ConsumerPool(db, n_shards=2, mode=mode, queue_size=8)
+    pool.panels.latency = LatencyStats()
+    tasks = pool.start()
+    minute = None
+    for item in items():
+        if item[2] == ContentType.CANDLE_STREAM:
+            if minute is not None and item[3]["data"]["k"]["t"] != minute:
+                await asyncio.wait_for(settled(db, minute), 30)
+            minute = item[3]["data"]["k"]["t"]
+        await pool.put(item)
+    await asyncio.get_running_loop().run_in_executor(None, pool.stop, 30)
+    await asyncio.wait_for(asyncio.gather(*tasks), 30)
+
+    # Every timeframe was the last one during a panel update, and keeps its value
+    for s in SYMBOLS:
+        ranks = db.symbols[s].windows[INTERVALS[1]].timeframes.view("rank")
+        assert len(ranks) > 5 and set(ranks) <= {0, 1, 2}
+
+    # The symbols are in both shards, the ranks are those of all symbols
+    for n, s in enumerate(SYMBOLS):
+        windows = db.symbols[s].windows
+        closes  = windows[INTERVALS[0]].to_numpy("close_price")[-5:]
+        assert windows[INTERVALS[0]].timeframes.view("momentum")[-1] == pytest.approx(closes[-1] / closes[0] - 1)
+        assert windows[INTERVALS[1]].timeframes.view("rank")[-1] == n
+        assert np.isnan(windows[INTERVALS[1]].timeframes.view("broken")).all()
+    assert len({consumer_shard(s, 2) for s in SYMBOLS}) == 2
+    assert pool.panels.n_errors["broken"] == pool.panels.latency.feature_summary()["rank"]["count"] > 0
+
+
+def test_panel_value_goes_in_the_timeframe_it_was_computed_for():
+    windows = [window(3), window(3)]
+
+    def appending(closes):
+        # A consumer thread appends a timeframe while the panel is computed
+        windows[0].timeframes.append_row(3 * 60000, 3 * 60000 + 59999, candle(3.0))
+        return closes[:, -1]
+
+    engine = PanelEngine([PanelFeature("last", appending, INTERVALS[1])])
+    engine.update({s: SimpleNamespace(windows={INTERVALS[1]: w}) for s, w in zip(SYMBOLS, windows)})
+    assert np.array_equal(windows[0].timeframes.view("last"), [np.nan, np.nan, 3.0, np.nan], equal_nan=True)
+    assert np.array_equal(windows[1].timeframes.view("last"), [np.nan, np.nan, 3.0], equal_nan=True)
+
+
+def fails_on_even(state, close):
+    if int(close) % 2 == 0:
+        raise ValueError("even close")
+    return close, close
+
+
+def test_raising_feature_gets_nan():
+    odd = Feature("odd", update=fails_on_even, inputs=["close_price"])
+    db = create_db({odd, ema(5), Feature("boom", compute=lambda w: 1 / 0)})
+    consumer = ShardConsumer(db)
+    for item in items():
+        assert consumer.consume(item)
+
+    buffer = db.symbols["btcusdt"].windows[INTERVALS[1]].timeframes
+    closes, values = buffer.view("close_price"), buffer.view("odd")
+    even = closes.astype(int) % 2 == 0
+    assert even.any() and (~even).any()
+    assert np.isnan(values[even]).all() and (values[~even] == closes[~even]).all()
+    assert np.isnan(buffer.view("boom")).all()
+    assert not np.isnan(buffer.view("ema5_close_price")).any()
+    assert consumer.features.n_errors["boom"] > 0 and consumer.features.n_errors["odd"] > 0
+
+
+def sum_but_three(total, close):
+    if close == 3:
+        raise ValueError("three")
+    return total + close, total + close
+
+
+def test_raising_candle_in_a_batch_only_loses_its_value():
+    # All six timeframes are new at once, like after a history block
+    feature = Feature("sum", update=sum_but_three, inputs=["close_price"], init=lambda: 0.0)
+    engine = FeatureEngine({feature})
+    w = window(6, capacity=6)
+    engine.update("btcusdt", {w.interval: w})
+
+    assert np.array_equal(w.timeframes.view("sum"), [1, 3, np.nan, 7, 12, 18], equal_nan=True)
+    assert engine.n_errors["sum"] == 1
+
+
+def test_feature_pool_survives_a_failing_window(monkeypatch):
+    def broken(*args):
+        raise RuntimeError("worker died")
+
+    monkeypatch.setattr(featurepool, "_compute", broken)
+    db = create_db({ema(5)})
+    consumer = ShardConsumer(db)
+    for item in items()[:50]:
+        consumer.process(item)
+    pool = FeaturePool({ema(5)}, 1)
+    for executor in pool.executors:
+        executor.shutdown()
+    pool.executors = [ThreadPoolExecutor(1)]
+    try:
+        pool.update("btcusdt", db.symbols["btcusdt"].windows)
+        pool.flush(10)
+    finally:
+        pool.close()
+    assert sum(pool.n_errors.values()) == len(INTERVALS) and not pool._running
+
+
+@pytest.mark.asyncio
+async def test_feature_pool_writes_back_when_idle():
+    db, serial = create_db({ema(5)}), create_db({ema(5)})
+    db.options.feature_workers = 1
+    pool = ConsumerPool(db, n_shards=1, mode=ConsumerMode.TASK)
+    tasks = pool.start()
+    consumer = ShardConsumer(serial)
+    for item in items():
+        await pool.put(item)
+        consumer.process(item)
+    windows = [(db.symbols[s].windows[iv], serial.symbols[s].windows[iv]) for s in SYMBOLS for iv in INTERVALS]
+
+    def synced(a, b):
+        values = a.timeframes.views().get("ema5_close_price")
+        return values is not None and values[-1] == pytest.approx(b.timeframes.view("ema5_close_price")[-1])
+
+    # No more items arrive, the last values are written back by idle()
+    deadline = time.monotonic() + 30
+    while not all(synced(a, b) for a, b in windows):
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.05)
+    pool.stop()
+    await asyncio.wait_for(asyncio.gather(*tasks), 30)
+
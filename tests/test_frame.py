@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from .helpers import window
+
+
+def test_numpy_views():
+    w = window(7)
+    closes = w.to_numpy("close_price")
+    assert list(closes) == [3.0, 4.0, 5.0, 6.0, 7.0]
+    assert np.shares_memory(closes, w.to_numpy()["close_price"])
+
+    closes[-1] = 100.0
+    assert w.timeframes[-1].candle.close_price == 100.0
+
+
+def test_frame_shares_memory():
+    pd = pytest.importorskip("pandas")
+    w = window(7)
+    df = w.to_frame()
+    assert len(df) == 5
+    assert df.index[0] == pd.Timestamp("1970-01-01 00:02")
+    assert np.shares_memory(df.index.asi8, w.to_numpy("open_time"))
+    assert np.shares_memory(df["n_trades"].to_numpy(), w.to_numpy("n_trades"))
+
+    w.timeframes[-1].candle.close_price = 100.0
+    assert df["close_price"].iloc[-1] == 100.0
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src.bbot.constants import Interval
+from src.bbot.downloader import Downloader
+from src.bbot.pipeline import HistoricalCandlePipe
+from src.models.candle import Candle, ValidationSampler
+from src.models.ringbuffer import CandleBuffer
+
+from .helpers import load
+
+
+def klines(n):
+    """Continuous 1m klines based on the first recorded one."""
+    first = load("hist_candles.json")[0]
+    rows = []
+    for i in range(n):
+        row = list(first)
+        row[0] += i * 60000
+        row[6] += i * 60000
+        row[4] = f"{45586.41 + i * 0.01:.8f}"
+        row[8] += i
+        rows.append(row)
+    return rows
+
+
+def make_db(capacity, scale=None):
+    window = SimpleNamespace(
+        interval=Interval.MINUTE_1, scale=scale, timeframes=CandleBuffer(capacity, scale)
+    )
+    symbol = SimpleNamespace(windows={Interval.MINUTE_1: window})
+    return SimpleNamespace(symbols={"btcusdt": symbol}), window
+
+
+def test_block_matches_row_by_row():
+    raw = klines(12)
+    db, window = make_db(len(raw) - 3)
+    HistoricalCandlePipe().process_block("btcusdt", Interval.MINUTE_1, raw, db)
+
+    assert len(window.timeframes) == len(raw) - 3
+    assert window.timeframes[0].open_time_ms == raw[3][0]
+    for tf, row in zip(window.timeframes, raw[3:]):
+        expected = Candle.parse_historical_candle_fast(row)
+        assert tf.candle.close_price == expected.close_price
+        assert tf.candle.quote_volume_taker == expected.quote_volume_taker
+        assert tf.candle.n_trades == expected.n_trades
+
+
+def test_block_continues_window():
+    raw = klines(12)
+    db, window = make_db(0)
+    pipe = HistoricalCandlePipe()
+    pipe.process_block("btcusdt", Interval.MINUTE_1, raw[:5], db)
+    pipe.process_block("btcusdt", Interval.MINUTE_1, raw[5:], db)
+    assert list(window.timeframes.column("open_time")) == [r[0] for r in raw]
+
+    with pytest.raises(Exception):
+        pipe.process_block("btcusdt", Interval.MINUTE_1, raw[:2], db)
+
+
+def test_block_rejects_gap():
+    raw = klines(12)
+    db, window = make_db(10)
+    with pytest.raises(Exception):
+        HistoricalCandlePipe().process_block("btcusdt", Interval.MINUTE_1, raw[:2] + raw[3:5], db)
+    assert len(window.timeframes) == 0
+
+
+def test_scaled_block():
+    scale = Downloader.parse_scales(load("exchange_info.json"))["btcusdt"]
+    raw = klines(12)
+    db, window = make_db(10, scale)
+    HistoricalCandlePipe().process_block("btcusdt", Interval.MINUTE_1, raw, db)
+    assert window.timeframes.column("open_price").dtype == np.int64
+    assert window.timeframes[-1].candle.open_price == scale.price(raw[-1][1])
+
+
+def test_sampler_select_matches_calls():
+    a, b = ValidationSampler(4), ValidationSampler(4)
+    a.select(3)
+    [b() for _ in range(3)]
+    assert list(a.select(10)) == [i for i in range(10) if b()]
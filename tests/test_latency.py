@@ -0,0 +1,82 @@
+import asyncio
+import random
+
+import pytest
+
+from src.bbot.constants import ConsumerMode, ContentType, LatencyStage
+from src.bbot.consumers import ConsumerPool
+from src.bbot.latency import STAGE_INDEX, LatencyHistogram, LatencyStats, bucket, bucket_bounds
+
+from .helpers import SYMBOLS, create_db, items
+
+
+def test_buckets_cover_all_durations():
+    for ns in [*range(1000), *(random.getrandbits(k) for k in range(1, 63) for _ in range(20))]:
+        low, high = bucket_bounds(bucket(ns))
+        assert low <= ns <= high
+        assert high - low <= max(ns // 8, 1)
+
+
+def test_percentiles_within_a_bucket():
+    values = [random.randint(1000, 10**7) for _ in range(10000)]
+    h = LatencyHistogram()
+    for v in values:
+        h.record(v)
+    values.sort()
+    for p in (50, 90, 99):
+        exact = values[int(p / 100 * len(values)) - 1]
+        assert abs(h.percentile(p) - exact) <= exact / 8
+    assert h.max == values[-1]
+    assert h.merge(h).n == 2 * len(values)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", [ConsumerMode.TASK, ConsumerMode.PROCESS])
+async def test_pool_records_every_stage(mode):
+    db = create_db(latency_stats=True)
+    pool = ConsumerPool(db, n_shards=2, mode=mode)
+    tasks = pool.start()
+    for item in items():
+        await pool.put(item)
+    await asyncio.get_running_loop().run_in_executor(None, pool.stop, 30)
+    await asyncio.wait_for(asyncio.gather(*tasks), 30)
+
+    n_stream = sum(1 for i in items() if i[2] == ContentType.CANDLE_STREAM)
+    summary = db.latency.summary(stream=ContentType.CANDLE_STREAM)
+    for stage in (LatencyStage.QUEUE, LatencyStage.PARSE, LatencyStage.INSERT, LatencyStage.DELAY):
+        assert summary[stage]["count"] == n_stream
+    assert summary[LatencyStage.INSERT]["p50"] > 0
+    assert set(db.latency.summary(symbol=SYMBOLS[0])) == set(summary)
+    for s in SYMBOLS:
+        assert all(w._latency is not None for w in db.symbols[s].windows.values())
+
+
+def test_disabled_by_default():
+    db = create_db(latency_stats=False)
+    assert db.latency is None
+
+
+def test_totals_add_up_all_symbols():
+    stats, worker = LatencyStats(), LatencyStats()
+    for i in range(1000):
+        for stage, ns in ((LatencyStage.QUEUE, 1000 + i), (LatencyStage.INSERT, 5000)):
+            stats.record(f"s{i}", ContentType.CANDLE_STREAM, stage, ns)
+    worker.record("s0", ContentType.CANDLE_STREAM, LatencyStage.QUEUE, 10**6)
+    stats.merge(worker.take())
+
+    totals = stats.select_totals()
+    assert set(totals) == {
+        (ContentType.CANDLE_STREAM, LatencyStage.QUEUE), (ContentType.CANDLE_STREAM, LatencyStage.INSERT)
+    }
+    queue = totals[(ContentType.CANDLE_STREAM, LatencyStage.QUEUE)]
+    merged = LatencyHistogram()
+    for h in stats.select(stage=LatencyStage.QUEUE).values():
+        merged.merge(h)
+    assert queue.counts == merged.counts and queue.n == 1001 and queue.max == 10**6
+    assert stats.summary() == {
+        stage: h.summary() for (_, stage), h in totals.items()
+    }
+    assert stats.summary(symbol="s0")[LatencyStage.QUEUE]["count"] == 2
+    assert not worker.select_totals()
+    assert stats.stages("s1", ContentType.CANDLE_STREAM)[STAGE_INDEX[LatencyStage.QUEUE]].n == 1
+
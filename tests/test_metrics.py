@@ -0,0 +1,59 @@
+import asyncio
+import urllib.error
+import urllib.request
+
+import pytest
+
+from src.bbot.constants import ConsumerMode, ContentType
+from src.bbot.consumers import ConsumerPool
+from src.bbot.latency import LatencyHistogram
+from src.bbot.metrics import MetricsServer
+from src.bbot.streams import StreamShard
+
+from .helpers import SYMBOLS, create_db, items
+
+
+def scrape(port, path="/metrics"):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=10) as r:
+        return r.headers["Content-Type"], r.read().decode()
+
+
+def test_cumulative_counts():
+    h = LatencyHistogram()
+    for ns in (500, 1500, 1500, 900000, 10**9):
+        h.record(ns)
+    assert h.cumulative([1000, 2000, 10**6, 10**10]) == [1, 3, 4, 5]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", [ConsumerMode.TASK, ConsumerMode.PROCESS])
+async def test_server_exposes_pool_and_latency(mode):
+    db = create_db(latency_stats=True, metrics_port=0)
+    pool = ConsumerPool(db, n_shards=2, mode=mode)
+    shard = StreamShard(0, [f"{s}@kline_1m" for s in SYMBOLS], ContentType.CANDLE_STREAM)
+    shard.n_reconnects = 2
+    db.metrics.register(pool, [shard])
+    server = MetricsServer(db, 0).start()
+    try:
+        tasks = pool.start()
+        for item in items():
+            await pool.put(item)
+        await asyncio.get_running_loop().run_in_executor(None, pool.stop, 30)
+        await asyncio.wait_for(asyncio.gather(*tasks), 30)
+
+        content_type, text = await asyncio.get_running_loop().run_in_executor(None, scrape, server.port)
+        with pytest.raises(urllib.error.HTTPError):
+            scrape(server.port, "/other")
+    finally:
+        server.stop()
+
+    n_stream = sum(1 for i in items() if i[2] == ContentType.CANDLE_STREAM)
+    lines = set(text.splitlines())
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert f'bbot_messages_processed_total{{content_type="CANDLE_STREAM"}} {n_stream}' in lines
+    assert 'bbot_queue_depth{shard="1"} 0' in lines
+    assert 'bbot_stream_reconnects_total{shard="0"} 2' in lines
+    assert "# TYPE bbot_latency_seconds histogram" in lines
+    labels = 'stage="delay",content_type="CANDLE_STREAM"'
+    assert f'bbot_latency_seconds_bucket{{{labels},le="+Inf"}} {n_stream}' in lines
+    assert f"bbot_latency_seconds_count{{{labels}}} {n_stream}" in lines
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.bbot.constants import ContentType, QueuePolicy
+from src.bbot.consumers import conflation_key
+from src.bbot.queues import WAKE, BoundedQueue
+
+
+def update(symbol, t, n):
+    """Stream item of kline `t` with a marker `n`."""
+    payload = {"stream": f"{symbol}@kline_1m", "data": {"k": {"t": t, "n": n}}}
+    return (symbol, "*", ContentType.CANDLE_STREAM, payload)
+
+
+def history(symbol):
+    return (symbol, "1m", ContentType.CANDLE_HISTORY_BLOCK, [])
+
+
+async def drain(q):
+    return [await q.get() for _ in range(len(q))]
+
+
+@pytest.mark.asyncio
+async def test_block_waits_for_room():
+    q = BoundedQueue(2, QueuePolicy.BLOCK, conflation_key)
+    await q.put(update("btcusdt", 0, 0))
+    await q.put(update("btcusdt", 0, 1))
+    blocked = asyncio.create_task(q.put(update("btcusdt", 0, 2)))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+    assert (await q.get())[3]["data"]["k"]["n"] == 0
+    await asyncio.wait_for(blocked, 1)
+    assert [i[3]["data"]["k"]["n"] for i in await drain(q)] == [1, 2]
+    assert q.stats()["blocked"] == 1
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_keeps_history():
+    q = BoundedQueue(3, QueuePolicy.DROP_OLDEST, conflation_key)
+    await q.put(history("btcusdt"))
+    for n in range(5):
+        await q.put(update("btcusdt", n * 60000, n))
+    items = await drain(q)
+    assert items[0] == history("btcusdt")
+    assert [i[3]["data"]["k"]["n"] for i in items[1:]] == [3, 4]
+    assert q.n_dropped == 3
+
+
+@pytest.mark.asyncio
+async def test_conflate_replaces_update_of_same_kline():
+    q = BoundedQueue(2, QueuePolicy.CONFLATE, conflation_key)
+    await q.put(update("btcusdt", 0, 0))
+    await q.put(update("ethusdt", 0, 0))
+    await q.put(update("btcusdt", 0, 1))        # replaces btcusdt n=0 in place
+    await q.put(update("btcusdt", 60000, 2))    # next kline: drops the oldest instead
+    items = await drain(q)
+    assert [(i[0], i[3]["data"]["k"]["n"]) for i in items] == [("ethusdt", 0), ("btcusdt", 2)]
+    assert q.stats()["conflated"] == 1
+    assert q.stats()["dropped"] == 1
+
+
+def test_thread_consumer():
+    q = BoundedQueue(4, QueuePolicy.BLOCK)
+    received = []
+
+    def consume():
+        for item in iter(q.get_blocking, None):
+            received.append(item)
+
+    t = threading.Thread(target=consume)
+    t.start()
+    for i in range(100):
+        q.put_blocking(i)
+    q.close()
+    t.join(5)
+    assert received == list(range(100))
+
+
+@pytest.mark.asyncio
+async def test_wake_returns_from_a_waiting_get():
+    q = BoundedQueue()
+    getter = asyncio.create_task(q.get())
+    await asyncio.sleep(0.01)
+    threading.Thread(target=q.wake).start()
+    assert await asyncio.wait_for(getter, 5) is WAKE
+
+    # Queued items go first, WAKE is returned once
+    q.wake()
+    await q.put(history("btcusdt"))
+    assert await q.get() == history("btcusdt")
+    assert q.get_blocking() is WAKE
+    await q.put(history("ethusdt"))
+    assert q.get_blocking() == history("ethusdt")
+
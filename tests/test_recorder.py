@@ -0,0 +1,70 @@
+import asyncio
+import gzip
+
+import pytest
+
+from src.bbot.constants import ContentType
+from src.bbot.recorder import FrameWriter, RecordingSocketManager, ReplaySocketManager, read_frames
+from src.bbot.simulator import SimulatedClient, SimulatedSocketManager
+from src.bbot.streams import StreamShard
+
+STREAMS = ["sim0000usdt@kline_1m", "sim0001usdt@kline_1m", "sim0001usdt@trade"]
+
+
+async def record(path, n):
+    writer = FrameWriter(path)
+    manager = RecordingSocketManager(SimulatedSocketManager(SimulatedClient(2), speed=None), writer)
+    frames = []
+    async with manager.multiplex_socket(STREAMS) as socket:
+        for _ in range(n):
+            frames.append(await socket.recv())
+    writer.close()
+    return frames
+
+
+@pytest.mark.asyncio
+async def test_log_appends_sessions(tmp_path):
+    path = tmp_path / "frames.jsonl.gz"
+    first = await record(path, 30)
+    second = await record(path, 20)
+
+    log = list(read_frames(path))
+    assert [f for _, f in log] == first + second
+    assert all(a <= b for (a, _), (b, _) in zip(log, log[1:]))
+
+
+@pytest.mark.asyncio
+async def test_truncated_log_is_read_up_to_last_frame(tmp_path):
+    path = tmp_path / "frames.jsonl.gz"
+    frames = await record(path, 50)
+    data = path.read_bytes()
+    path.write_bytes(data[: len(data) // 2])
+
+    log = [f for _, f in read_frames(path)]
+    assert 0 < len(log) < len(frames)
+    assert log == frames[: len(log)]
+
+
+@pytest.mark.asyncio
+async def test_replay_feeds_queue_in_recorded_order(tmp_path):
+    path = tmp_path / "frames.jsonl.gz"
+    frames = await record(path, 60)
+    with gzip.open(path, "ab") as f:
+        f.write(b'[0,{"e":"error","m":"lost"}]\n')
+
+    manager = ReplaySocketManager(path, speed=None)
+    queue = asyncio.Queue()
+    shards = [
+        asyncio.create_task(StreamShard(i, s, ContentType.CANDLE_STREAM).run(queue, manager, False))
+        for i, s in enumerate((STREAMS[:1], STREAMS[1:]))
+    ]
+    await asyncio.wait_for(manager.finished.wait(), 10)
+    for t in shards:
+        t.cancel()
+    await asyncio.gather(*shards, return_exceptions=True)
+
+    items = [queue.get_nowait() for _ in range(queue.qsize())]
+    assert manager.n_frames == len(items) == len(frames)
+    assert sorted(map(str, (m for *_, m in items))) == sorted(map(str, frames))
+    assert [m for *_, m in items if m["stream"] == STREAMS[0]] == [f for f in frames if f["stream"] == STREAMS[0]]
+    assert {s for s, *_ in items} == {"sim0000usdt", "sim0001usdt"}
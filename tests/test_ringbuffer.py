@@ -0,0 +1,108 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from src.models.ringbuffer import CandleBuffer
+
+from .helpers import candle
+
+
+@pytest.fixture
+def buffer():
+    return CandleBuffer(3)
+
+
+def test_append_and_index(buffer):
+    assert not buffer
+    buffer.append_row(0, 59999, candle(1.0))
+    buffer.append_row(60000, 119999)
+    assert len(buffer) == 2
+    assert buffer[0].candle.open_price == 1.0
+    assert buffer[-1].candle is None
+    assert buffer[-1].open_time == datetime(1970, 1, 1, 0, 1, tzinfo=timezone.utc)
+
+
+def test_eviction(buffer):
+    for i in range(5):
+        buffer.append_row(i * 60000, i * 60000 + 59999, candle(float(i)))
+    assert len(buffer) == 3
+    assert [tf.candle.open_price for tf in buffer] == [2.0, 3.0, 4.0]
+    assert list(buffer.column("open_price")) == [2.0, 3.0, 4.0]
+    with pytest.raises(IndexError):
+        buffer[3]
+
+
+def test_view_writes_through(buffer):
+    buffer.append_row(0, 59999, candle(1.0))
+    view = buffer[-1].candle
+    view.close_price = 9.5
+    view.n_trades += 1
+    assert buffer[-1].candle.close_price == 9.5
+    assert buffer[-1].candle.n_trades == 8
+
+
+def test_unbounded_grows():
+    buffer = CandleBuffer(0)
+    for i in range(40):
+        buffer.append_row(i, i, candle(float(i)))
+    assert len(buffer) == 40
+    assert buffer[0].candle.open_price == 0.0
+    assert buffer[-1].candle.open_price == 39.0
+
+
+def block(start, n):
+    times = np.arange(start, start + n, dtype=np.int64) * 60000
+    columns = {f: np.full(n, 1.0) for f in candle(1.0).__dict__}
+    columns.update(open_time=times, close_time=times + 59999, n_trades=np.arange(n))
+    return columns
+
+
+def test_extend_wraps_and_evicts(buffer):
+    buffer.append_row(0, 59999, candle(1.0))
+    buffer.append_row(60000, 119999, candle(1.0))
+    buffer.extend(block(2, 2))
+    assert [tf.open_time_ms for tf in buffer] == [60000, 120000, 180000]
+    assert buffer[-1].candle.n_trades == 1
+
+    buffer.extend(block(4, 5))
+    assert [tf.open_time_ms for tf in buffer] == [360000, 420000, 480000]
+
+
+def test_extend_unbounded():
+    buffer = CandleBuffer(0)
+    buffer.extend(block(0, 40))
+    assert len(buffer) == 40
+    assert buffer.column("n_trades")[-1] == 39
+
+
+def test_views_are_contiguous(buffer):
+    assert len(buffer.views()["open_time"]) == 0
+    for i in range(4):
+        buffer.extend(block(2 * i, 2))
+        buffer.append_row((2 * i + 2) * 60000, (2 * i + 2) * 60000 + 59999, candle(1.0))
+        views = buffer.views()
+        assert list(views["open_time"] // 60000) == list(range(2 * i, 2 * i + 3))
+        assert views["open_time"].base is not None
+
+    views["n_trades"][-1] = 99
+    assert buffer[-1].candle.n_trades == 99
+    assert buffer.view("n_trades").ctypes.data == views["n_trades"].ctypes.data
+
+
+def test_shared_buffer_attaches_by_name():
+    from src.models.shared import SharedCandleBuffer
+
+    owner = SharedCandleBuffer(3, extra=["ema"])
+    attached = SharedCandleBuffer(3, extra=["ema"], name=owner.name)
+    try:
+        owner.buffer.extend(block(0, 5))
+        owner.publish()
+        attached.restore()
+        assert list(attached.buffer.view("open_time")) == [120000, 180000, 240000]
+        assert np.isnan(attached.buffer.view("ema")).all()
+        attached.buffer.view("ema")[-1] = 1.5
+        assert owner.buffer[-1].candle is not None and owner.buffer.view("ema")[-1] == 1.5
+    finally:
+        attached.close()
+        owner.close()
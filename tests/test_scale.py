@@ -0,0 +1,117 @@
+from decimal import Decimal
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src.bbot.constants import Interval
+from src.bbot.consumers import ShardConsumer
+from src.bbot.downloader import Downloader
+from src.bbot.pipeline.aggregation import IntervalAggregator
+from src.models.candle import Candle
+from src.models.database import DataBase
+from src.models.options import Options
+from src.models.ringbuffer import CandleBuffer
+from src.models.scale import Scale, to_units, to_units_array
+from src.models.symbol import Symbol
+from src.models.window import Window
+
+from .helpers import INTERVALS, SYMBOLS, items, load
+
+
+@pytest.fixture
+def scale():
+    info = load("exchange_info.json")
+    return Downloader.parse_scales(info)["btcusdt"]
+
+
+def test_to_units():
+    assert to_units("45586.41000000") == 4558641000000
+    assert to_units("0.5") == 50000000
+    assert to_units("12") == 1200000000
+    assert list(to_units_array(["45586.41000000", "0.5", "12"])) == [
+        4558641000000,
+        50000000,
+        1200000000,
+    ]
+
+
+def test_scale_round_trip(scale):
+    assert scale.tick == 1000000
+    ticks = scale.price("45586.41000000")
+    assert ticks == 4558641
+    assert scale.price_to_decimal(ticks) == Decimal("45586.41")
+    assert scale.prices(["45586.41000000", "45586.42000000"]).dtype == np.int64
+    assert scale.n_rounded == 0
+
+
+def test_finer_history_is_rounded(scale):
+    # Quoted in a tick size of 0.001, before the current one of 0.01
+    assert scale.price("45586.41400000") == 4558641
+    assert scale.price("45586.41500000") == 4558642
+    assert list(scale.prices(["45586.41000000", "45586.41600000", "45586.41200000"])) == [
+        4558641,
+        4558642,
+        4558641,
+    ]
+    assert scale.n_rounded == 4
+
+
+def test_scaled_candle_buffer(scale):
+    raw = load("hist_candles.json")[0]
+    record = Candle.parse_historical_candle_fast(raw, scale=scale)
+    assert isinstance(record.open_price, int)
+
+    buffer = CandleBuffer(3, scale)
+    buffer.append_row(raw[0], raw[6], record)
+    assert buffer.column("open_price").dtype == np.int64
+    candle = buffer[-1].candle.to_candle()
+    assert candle.open_price == Decimal(raw[1])
+    assert candle.quote_volume == Decimal(raw[7])
+    assert candle.base_volume_taker == Decimal(raw[9])
+
+
+def test_fixed_point_symbols_store_scaled_candles():
+    options = Options(fixed_point=True, validation_sample_rate=0, window_length=50).copy(
+        update={"window_intervals": set(INTERVALS)}
+    )
+    db = DataBase(options=options, scales={s: Scale(tick_size="0.01") for s in SYMBOLS})
+    for s in SYMBOLS:
+        db.add_symbol(s)
+    consumer = ShardConsumer(db)
+    for item in items():
+        consumer.process(item)
+
+    for s in SYMBOLS:
+        assert db.symbols[s].scale is db.scales[s]
+        for iv, window in db.symbols[s].windows.items():
+            assert window.scale is db.scales[s]
+            assert window.timeframes.column("close_price").dtype == np.int64
+            assert window.timeframes[-1].candle.to_candle().close_price in {
+                Decimal(45000 + SYMBOLS.index(s) + j) for j in range(7)
+            }
+
+    # Windows of a symbol get its scale
+    symbol = Symbol(name="btcusdt", scale=db.scales["btcusdt"], windows={INTERVALS[1]: Window(interval=INTERVALS[1])})
+    assert symbol.windows[INTERVALS[1]].timeframes.dtype == np.int64
+
+
+def test_quote_volume_overflow_is_detected(scale):
+    with pytest.raises(OverflowError):
+        scale.quote_qty("100000000000.00000000")
+    with pytest.raises(OverflowError):
+        scale.quote_quantities(["100000000000.00000000"])
+
+    # 90 billion fits, the sum of two in the open 3m candle does not
+    price = scale.price("45000.00000000")
+    kline = SimpleNamespace(
+        open_price=price, high_price=price, low_price=price, close_price=price,
+        base_volume=1, quote_volume=scale.quote_qty("90000000000.00000000"),
+        base_volume_taker=0, quote_volume_taker=0, n_trades=1,
+    )
+    intervals = (Interval.MINUTE_1, Interval.MINUTE_3)
+    aggregator = IntervalAggregator({iv: Window(interval=iv, window_length=5, scale=scale) for iv in intervals})
+    aggregator.update(0, kline, True)
+    aggregator.update(60000, kline, True)
+    with pytest.raises(OverflowError):
+        aggregator.update(120000, kline, True)
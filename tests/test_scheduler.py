@@ -0,0 +1,179 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from binance import AsyncClient
+
+from src.bbot.constants import ContentType, Interval
+from src.bbot.scheduler import RequestScheduler, TokenBucket
+from src.models.candle import Candle
+
+from .helpers import load
+
+
+
+class StubBinance:
+    """Local stand-in for the klines endpoint of the Binance REST api."""
+
+    def __init__(self, n_throttled=0, status=429, retry_after="0"):
+        self.klines = load("hist_candles.json")
+        self.n_throttled = n_throttled
+        self.status = status
+        self.retry_after = retry_after
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get_klines(self, request):
+        self.requests.append((time.monotonic(), dict(request.query)))
+        if self.n_throttled:
+            self.n_throttled -= 1
+            headers = {"Retry-After": self.retry_after} if self.retry_after else {}
+            return web.json_response(
+                {"code": -1003, "msg": "Too many requests."}, status=self.status, headers=headers
+            )
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.05)
+        self.in_flight -= 1
+        return web.json_response(
+            self.klines, headers={"X-MBX-USED-WEIGHT-1M": str(2 * len(self.requests))}
+        )
+
+
+async def serve(stub):
+    app = web.Application()
+    app.router.add_get("/api/v3/klines", stub.get_klines)
+    server = TestServer(app)
+    await server.start_server()
+    client = AsyncClient()
+    client.API_URL = str(server.make_url("/api"))
+    return server, client
+
+
+@pytest.mark.asyncio
+async def test_requests_run_concurrently():
+    stub = StubBinance()
+    server, client = await serve(stub)
+    scheduler = RequestScheduler(client, weight_limit=1200)
+    try:
+        pages = await asyncio.gather(
+            *(scheduler.request("get_klines", symbol="BTCUSDT", interval="1m") for _ in range(5))
+        )
+    finally:
+        await client.close_connection()
+        await server.close()
+    assert all(page == stub.klines for page in pages)
+    assert stub.max_in_flight > 1
+    assert scheduler.n_requests == 5
+
+
+@pytest.mark.asyncio
+async def test_weight_limit_is_respected():
+    stub = StubBinance()
+    server, client = await serve(stub)
+    # 10 weight per 0.5s, every request weighs 5
+    scheduler = RequestScheduler(client, weight_limit=10, period=0.5)
+    start = time.monotonic()
+    try:
+        await asyncio.gather(
+            *(scheduler.request("get_klines", symbol="BTCUSDT", interval="1m", limit=500) for _ in range(6))
+        )
+    finally:
+        await client.close_connection()
+        await server.close()
+    # Two requests fit in the bucket, the other four wait 0.25s each.
+    assert time.monotonic() - start >= 0.9
+
+
+@pytest.mark.asyncio
+async def test_backs_off_when_throttled():
+    stub = StubBinance(n_throttled=2, status=429, retry_after=None)
+    server, client = await serve(stub)
+    scheduler = RequestScheduler(client)
+    try:
+        page = await scheduler.request("get_klines", symbol="BTCUSDT", interval="1m")
+    finally:
+        await client.close_connection()
+        await server.close()
+    assert page == stub.klines
+    assert scheduler.n_throttled == 2
+    # Exponential backoff: 1s, then 2s
+    times = [t for t, _ in stub.requests]
+    assert times[1] - times[0] >= 0.9
+    assert times[2] - times[1] >= 1.9
+
+
+@pytest.mark.asyncio
+async def test_history_producer_downloads_intervals_concurrently():
+    stub = StubBinance()
+    server, client = await serve(stub)
+    queue = asyncio.Queue()
+    intervals = {Interval.SECOND_2, Interval.MINUTE_1, Interval.HOUR_1}
+    try:
+        await Candle.history_producer(
+            "btcusdt", intervals, 3, queue, RequestScheduler(client), False
+        )
+    finally:
+        await client.close_connection()
+        await server.close()
+
+    items = [queue.get_nowait() for _ in range(queue.qsize())]
+    blocks = [i for i in items if i[2] == ContentType.CANDLE_HISTORY_BLOCK]
+    assert {b[1] for b in blocks} == {Interval.MINUTE_1, Interval.HOUR_1}
+    assert sum(i[3] == "finished_history_download" for i in items) == 2
+    assert stub.max_in_flight == 2
+    assert {q["interval"] for _, q in stub.requests} == {"1m", "1h"}
+
+
+@pytest.mark.asyncio
+async def test_ban_without_retry_after_waits_max_backoff():
+    stub = StubBinance(n_throttled=2, status=418, retry_after=None)
+    server, client = await serve(stub)
+    scheduler = RequestScheduler(client, max_backoff=0.5)
+    try:
+        page = await scheduler.request("get_klines", symbol="BTCUSDT", interval="1m")
+    finally:
+        await client.close_connection()
+        await server.close()
+    assert page == stub.klines
+    times = [t for t, _ in stub.requests]
+    assert times[1] - times[0] >= 0.45 and times[2] - times[1] >= 0.45
+
+
+@pytest.mark.asyncio
+async def test_used_weight_is_synced_from_own_response():
+    stub = StubBinance()
+    server, client = await serve(stub)
+    scheduler = RequestScheduler(client, weight_limit=1200)
+    try:
+        # One at a time: the header of the response is used, 2 weight per request so far
+        for _ in range(3):
+            await scheduler.request("get_klines", symbol="BTCUSDT", interval="1m", limit=50)
+        assert scheduler.bucket.tokens <= 1200 - 6
+        synced = []
+        scheduler.sync_used_weight = lambda: synced.append(True)
+        await asyncio.gather(
+            *(scheduler.request("get_klines", symbol="BTCUSDT", interval="1m", limit=50) for _ in range(3))
+        )
+    finally:
+        await client.close_connection()
+        await server.close()
+    # Concurrent requests share client.response, none of them syncs
+    assert synced == []
+
+
+def test_request_weights():
+    assert RequestScheduler.weight("get_klines", {"limit": 50}) == 1
+    assert RequestScheduler.weight("get_klines", {}) == 5
+    assert RequestScheduler.weight("get_klines", {"limit": 1000}) == 5
+    assert RequestScheduler.weight("get_exchange_info", {}) == 20
+
+
+@pytest.mark.asyncio
+async def test_bucket_observes_used_weight():
+    bucket = TokenBucket(100)
+    bucket.observe(90)
+    assert bucket.tokens <= 10
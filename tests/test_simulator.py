@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from src.bbot.constants import INTERVAL_MS, Interval, Stream
+from src.bbot.downloader import Downloader
+from src.bbot.pipeline import HistoricalCandlePipe
+from src.bbot.simulator import SimulatedClient, SimulatedSocketManager
+from src.models.candle import Candle
+from src.models.database import DataBase
+from src.models.options import Options
+from src.models.symbol import Symbol
+from src.models.window import Window
+
+START = 1628726873749
+INTERVALS = (Interval.SECOND_2, Interval.MINUTE_1, Interval.MINUTE_5)
+
+
+@pytest.mark.asyncio
+async def test_history_is_continuous_and_repeatable():
+    client = SimulatedClient(3, start_ms=START)
+    scales = Downloader.parse_scales(await client.get_exchange_info())
+    symbol = client.symbols[1]
+    last = await client.get_klines(symbol, "1m", limit=10)
+    older = await client.get_klines(symbol, "1m", startTime=last[0][0] - 5 * 60000, limit=10)
+
+    assert last[-1][0] == START // 60000 * 60000
+    assert older[5:] == last[:5]
+    assert await client.get_klines(symbol, "1m", startTime=last[-1][0] + 1) == []
+    for a, b in zip(older, older[1:]):
+        assert b[0] == a[0] + 60000 and b[1] == a[4]
+
+    # Prices and quantities fit the tick and step sizes of the exchange info
+    columns = HistoricalCandlePipe.parse_block(older, scales[symbol.lower()])
+    assert (columns["high_price"] >= columns["low_price"]).all()
+
+
+@pytest.mark.asyncio
+async def test_streams_render_every_kind():
+    client = SimulatedClient(2, start_ms=START)
+    scale = Downloader.parse_scales(await client.get_exchange_info())["sim0000usdt"]
+    kinds = ("kline_1m", "trade", "aggTrade", "depth", "miniTicker", "ticker")
+    streams = [f"sim0000usdt@{k}" for k in kinds] + ["sim0001usdt@kline_1m"]
+    manager = SimulatedSocketManager(client, speed=None)
+
+    events, types = [], set()
+    async with manager.multiplex_socket(streams) as socket:
+        for _ in range(10 * len(streams)):
+            msg = await socket.recv()
+            types.add(msg["data"]["e"])
+            if msg["stream"] == "sim0000usdt@kline_1m":
+                kline = Candle.parse_kline(msg, True, scale)
+                events.append(kline.event_time)
+    assert types == {"kline", "trade", "aggTrade", "depthUpdate", "24hrMiniTicker", "24hrTicker"}
+    assert all(b - a == 2000 for a, b in zip(events, events[1:]))
+    assert manager.n_messages == 10 * len(streams)
+
+
+@pytest.mark.asyncio
+async def test_get_tasks_runs_on_simulator():
+    client = SimulatedClient(4)
+    manager = SimulatedSocketManager(client, speed=None)
+    options = Options(window_length=20, stream_shards=2, validation_sample_rate=1).copy(
+        update={"window_intervals": set(INTERVALS), "streams": {Stream.CANDLE}}
+    )
+    db = DataBase(options=options)
+    db.selected_symbols = {s.lower() for s in client.symbols}
+    for s in db.selected_symbols:
+        db.symbols[s] = Symbol(
+            name=s, windows={iv: Window(interval=iv, window_length=20) for iv in INTERVALS}
+        )
+
+    tasks = Candle.get_tasks(options, client, manager, db, False)
+    windows = [s.windows for s in db.symbols.values()]
+    while not all(len(w[Interval.SECOND_2].timeframes) == 20 for w in windows):
+        await asyncio.sleep(0.01)
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    for w in windows:
+        for iv in INTERVALS[1:]:
+            opens = w[iv].timeframes.column("open_time")
+            assert len(opens) == 20
+            assert ((opens[1:] - opens[:-1]) == INTERVAL_MS[iv]).all()
@@ -0,0 +1,171 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.bbot.constants import INTERVAL_MS, Interval, Stream
+from src.bbot.consumers import ShardConsumer
+from src.bbot.pipeline import HistoricalCandlePipe
+from src.bbot.scheduler import RequestScheduler
+from src.bbot.simulator import SimulatedClient, SimulatedSocketManager
+from src.models.candle import Candle
+from src.models.database import DataBase
+from src.models.options import Options
+from src.models.ringbuffer import CANDLE_COLUMNS
+from src.models.scale import Scale
+from src.models.store import BLOCK_ROWS, CandleFile, CandleStore, candle_dir
+from src.models.symbol import Symbol
+from src.models.window import Window
+
+from .helpers import INTERVALS, SYMBOLS, create_db, items
+from .test_history import klines
+
+
+def block(start, n):
+    columns = {name: np.zeros(n, dtype) for name, dtype in CANDLE_COLUMNS}
+    columns["open_time"] = np.arange(start, start + n, dtype=np.int64) * 60000
+    columns["close_price"] = np.arange(start, start + n, dtype=np.float64)
+    columns["has_candle"][:] = True
+    return columns
+
+
+def test_file_appends_across_blocks(tmp_path):
+    path = tmp_path / "btcusdt" / "1m.candles"
+    f = CandleFile(path)
+    assert len(f) == 0 and f.last_open_time() == -1
+    f.append(block(0, BLOCK_ROWS - 5))
+    f.append(block(BLOCK_ROWS - 5, 2 * BLOCK_ROWS))
+    f.flush()
+
+    g = CandleFile(path, writable=False)
+    tail = g.tail(BLOCK_ROWS + 10)
+    n = 3 * BLOCK_ROWS - 5
+    assert len(g) == n
+    assert g.last_open_time() == (n - 1) * 60000
+    assert np.array_equal(tail["close_price"], np.arange(n - BLOCK_ROWS - 10, n))
+    assert tail["has_candle"].all()
+
+    # Another scale makes the file unreadable, and empty once it is written again.
+    assert len(CandleFile(path, Scale(), writable=False)) == 0
+    assert len(CandleFile(path, Scale())) == 0
+
+
+def test_consumer_stores_closed_timeframes(tmp_path):
+    db = create_db(datadir=tmp_path)
+    consumer = ShardConsumer(db)
+    for item in items():
+        consumer.process(item)
+    consumer.close()
+
+    store = CandleStore(candle_dir(tmp_path))
+    for s in SYMBOLS:
+        windows = {iv: Window(interval=iv, window_length=50) for iv in INTERVALS}
+        store.load(s, windows)
+        assert not windows[Interval.SECOND_2].timeframes
+        for iv in INTERVALS[1:]:
+            loaded = windows[iv].timeframes
+            live = db.symbols[s].windows[iv].timeframes
+            assert len(loaded) == len(live) - 1
+            for name in ("open_time", "close_price", "base_volume", "n_trades"):
+                assert np.array_equal(loaded.column(name), live.column(name)[:-1])
+
+
+def test_history_continues_loaded_window(tmp_path):
+    raw = klines(30)
+    pipe = HistoricalCandlePipe()
+    stored = DataBase(options=Options())
+    stored.symbols["btcusdt"] = Symbol(
+        name="btcusdt", windows={Interval.MINUTE_1: Window(interval=Interval.MINUTE_1, window_length=20)}
+    )
+    pipe.process_block("btcusdt", Interval.MINUTE_1, raw[:20], stored)
+    store = CandleStore(tmp_path)
+    store.sync("btcusdt", stored.symbols["btcusdt"].windows)
+    store.close()
+
+    db = DataBase(options=Options())
+    windows = {Interval.MINUTE_1: Window(interval=Interval.MINUTE_1, window_length=20)}
+    db.symbols["btcusdt"] = Symbol(name="btcusdt", windows=windows)
+    store.load("btcusdt", windows, now_ms=raw[-1][0])
+    assert len(windows[Interval.MINUTE_1].timeframes) == 19
+
+    # A new download overlaps the stored candles
+    pipe.process_block("btcusdt", Interval.MINUTE_1, raw[10:], db)
+    opens = windows[Interval.MINUTE_1].timeframes.column("open_time")
+    assert list(opens) == [r[0] for r in raw[10:]]
+
+    # Stored candles older than a window length are not loaded
+    stale = {Interval.MINUTE_1: Window(interval=Interval.MINUTE_1, window_length=20)}
+    store.load("btcusdt", stale, now_ms=raw[-1][0] + 20 * 60000)
+    assert not stale[Interval.MINUTE_1].timeframes
+
+
+@pytest.mark.asyncio
+async def test_restart_downloads_only_the_gap(tmp_path):
+    client = SimulatedClient(2)
+    limits = []
+    get_klines = client.get_klines
+
+    async def recorded(**params):
+        limits.append(params["limit"])
+        return await get_klines(**params)
+
+    client.get_klines = recorded
+    intervals = (Interval.SECOND_2, Interval.MINUTE_1, Interval.MINUTE_5)
+    options = Options(window_length=20, validation_sample_rate=1, datadir=tmp_path).copy(
+        update={"window_intervals": set(intervals), "streams": {Stream.CANDLE}}
+    )
+
+    async def run():
+        db = DataBase(options=options)
+        db.selected_symbols = {s.lower() for s in client.symbols}
+        for s in db.selected_symbols:
+            db.symbols[s] = Symbol(
+                name=s, windows={iv: Window(interval=iv, window_length=20) for iv in intervals}
+            )
+        limits.clear()
+        # In real time the stream does not run ahead of the clock of the history download.
+        tasks = Candle.get_tasks(options, client, SimulatedSocketManager(client, speed=1), db, False)
+        windows = [s.windows for s in db.symbols.values()]
+        while not all(w[iv]._history_downloaded for w in windows for iv in intervals[1:]):
+            await asyncio.sleep(0.01)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return windows, sorted(limits)
+
+    first, first_limits = await run()
+    second, second_limits = await run()
+    # Every window downloads its length, then only the open kline
+    assert first_limits == [20] * 4
+    assert second_limits == [1] * 4
+    for a, b in zip(first, second):
+        for iv in intervals[1:]:
+            opens = b[iv].timeframes.column("open_time")
+            assert len(opens) == 20
+            assert ((opens[1:] - opens[:-1]) == INTERVAL_MS[iv]).all()
+            assert np.array_equal(opens, a[iv].timeframes.column("open_time"))
+
+
+@pytest.mark.asyncio
+async def test_history_producer_requests_after_stored():
+    client = SimulatedClient(1)
+    requests = []
+    get_klines = client.get_klines
+
+    async def recorded(**params):
+        requests.append(params)
+        return await get_klines(**params)
+
+    client.get_klines = recorded
+    last = client.start_ms // 60000 * 60000
+    queue = asyncio.Queue()
+    await Candle.history_producer(
+        "sim0000usdt", {Interval.MINUTE_1}, 20, queue, RequestScheduler(client), False,
+        stored={Interval.MINUTE_1: last - 7 * 60000 - 1},
+    )
+
+    (params,) = requests
+    assert params["startTime"] == last - 7 * 60000
+    assert params["limit"] == 8 and params["endTime"] >= last
+    page = queue.get_nowait()[3]
+    assert [k[0] for k in page] == [last - i * 60000 for i in range(7, -1, -1)]
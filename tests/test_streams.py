@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from src.bbot.constants import ContentType
+from src.bbot.streams import MAX_STREAMS_PER_CONNECTION, StreamShard, shard_streams
+from src.models.candle import Candle
+
+from .helpers import load
+
+
+
+class FakeSocket:
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def recv(self):
+        if not self.messages:
+            await asyncio.sleep(3600)
+        return self.messages.pop(0)
+
+
+class FakeManager:
+    """Hands out one scripted connection per multiplex_socket() call."""
+
+    def __init__(self, *connections):
+        self.connections = list(connections)
+        self.subscriptions = []
+
+    def multiplex_socket(self, streams):
+        self.subscriptions.append(list(streams))
+        return FakeSocket(self.connections.pop(0))
+
+
+def test_shard_streams():
+    streams = [f"sym{i}@kline_1m" for i in range(10)]
+    shards = shard_streams(streams, 3)
+    assert [len(s) for s in shards] == [4, 3, 3]
+    assert sorted(sum(shards, [])) == sorted(streams)
+
+    many = [f"sym{i}@kline_1m" for i in range(2 * MAX_STREAMS_PER_CONNECTION + 1)]
+    assert len(shard_streams(many, 1)) == 3
+    assert shard_streams([], 4) == []
+    assert len(shard_streams(streams[:2], 4)) == 2
+
+
+@pytest.mark.asyncio
+async def test_shard_routes_and_reconnects():
+    msg = load("kline_1m.json")[0]
+    other = dict(msg, stream="ethusdt@kline_1m")
+    manager = FakeManager(
+        [msg, {"e": "error", "m": "connection lost"}],
+        [other, msg],
+    )
+    shard = StreamShard(0, ["btcusdt@kline_1m", "ethusdt@kline_1m"], ContentType.CANDLE_STREAM)
+    queue = asyncio.Queue()
+    task = asyncio.create_task(Candle.stream_producer(shard, queue, manager, False))
+
+    received = [await asyncio.wait_for(queue.get(), 5) for _ in range(3)]
+    task.cancel()
+
+    assert [r[0] for r in received] == ["btcusdt", "ethusdt", "btcusdt"]
+    assert all(r[2] == ContentType.CANDLE_STREAM for r in received)
+    assert shard.n_reconnects == 1
+    assert shard.n_messages == 3
+    assert manager.subscriptions == [shard.streams] * 2
+
+
+def test_parse_kline_from_combined_stream():
+    msg = load("kline_1m.json")[0]
+    assert "stream" in msg
+    assert Candle.parse_kline(msg).symbol == "btcusdt"
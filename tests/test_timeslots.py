@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from src.bbot.constants import Interval, InTimeFrame
+from src.bbot.pipeline import HistoricalCandlePipe
+from src.bbot.pipeline.timeslots import (
+    RELATIVE_SLOTS,
+    TOO_NEW,
+    TOO_OLD,
+    slot_open,
+    slot_opens,
+    which_slot,
+    which_slots,
+)
+from src.models.window import Window
+
+MINUTE = 60000
+
+
+def test_slot_open():
+    assert slot_open(MINUTE + 1, Interval.MINUTE_1) == MINUTE
+    assert slot_open(MINUTE - 1, Interval.MINUTE_3) == 0
+    # Weekly candles open on monday, 4 days after the epoch.
+    assert slot_open(5 * 86400000, Interval.WEEK_1) == 4 * 86400000
+    times = np.array([1, MINUTE, 7 * MINUTE + 5])
+    assert list(slot_opens(times, Interval.MINUTE_3)) == [0, 0, 6 * MINUTE]
+
+
+def test_which_slot():
+    last = 10 * MINUTE
+    assert which_slot(last + MINUTE - 1, last, MINUTE) == InTimeFrame.CURRENT
+    assert which_slot(last + MINUTE, last, MINUTE) == InTimeFrame.NEXT
+    assert which_slot(last - 1, last, MINUTE) == InTimeFrame.PREVIOUS
+    assert which_slot(last - MINUTE - 1, last, MINUTE) == InTimeFrame.OTHER
+    with pytest.raises(Exception):
+        which_slot(last + 2 * MINUTE, last, MINUTE)
+
+
+def test_which_slots_matches_scalar():
+    last = 10 * MINUTE
+    times = np.arange(last - 3 * MINUTE, last + 4 * MINUTE, 7919)
+    rel = which_slots(times, last, MINUTE)
+    assert rel.dtype == np.int8
+    for t, r in zip(times, rel):
+        if r == TOO_NEW:
+            with pytest.raises(Exception):
+                which_slot(int(t), last, MINUTE)
+        elif r == TOO_OLD:
+            assert which_slot(int(t), last, MINUTE) == InTimeFrame.OTHER
+        else:
+            assert which_slot(int(t), last, MINUTE) == RELATIVE_SLOTS[r]
+
+
+def test_which_timeframe_on_window():
+    window = Window(interval=Interval.MINUTE_3, window_length=5)
+    pipe = HistoricalCandlePipe()
+    assert pipe.which_timeframe(0, window) == InTimeFrame.FIRST
+    window.timeframes.append_row(3 * MINUTE, 6 * MINUTE - 1)
+    assert pipe.which_timeframe(6 * MINUTE - 1, window) == InTimeFrame.CURRENT
+    assert pipe.which_timeframe(9 * MINUTE - 1, window) == InTimeFrame.NEXT